@@ -3,6 +3,16 @@ import time
 import argparse
 import os
 import sys
+import json
+import struct
+import threading
+import socket
+import select
+import urllib.parse
+import layout
+import validate
+from snapshots import SNAPSHOTS
+from metrics import METRICS
 
 ##########
 #
@@ -10,22 +20,440 @@ import sys
 #
 ##########
 
+########## Framed reads
+class frameError(Exception):
+    # the device stopped talking before a whole frame arrived
+    pass
+
+def readFrame(ser, size=layout.IMAGE_SIZE, header=layout.HEADER, firstTimeout=0.5, byteTimeout=0.1, progress=None, discardLimit=None):
+    # read one frame starting with header, returning as soon as size bytes have arrived
+    # firstTimeout is how long the device gets to start answering, byteTimeout how long it may pause after that
+    # the timeout is set once per phase: setting it reconfigures a serial port
+    # a port that keeps talking without ever sending the header gives up after discardLimit bytes (two frames
+    # by default) or once the frame is overdue: firstTimeout plus twice its time on the wire
+    buf = bytearray()
+    synced = False
+    discarded = 0
+    if discardLimit is None: discardLimit = 2 * size
+    wireTime = size * 10.0 / (getattr(ser, 'baudrate', None) or 9600)     # 8N1
+    deadline = time.monotonic() + firstTimeout + 2 * wireTime + byteTimeout
+    ser.timeout = firstTimeout
+    while len(buf) < size:
+        chunk = ser.read(max(1, min(ser.in_waiting, size - len(buf))))
+        if not chunk:
+            if not buf and not synced: raise frameError("No response from device")
+            raise frameError("Truncated frame: got "+str(len(buf))+" of "+str(size)+" bytes")
+        buf += chunk
+        if not synced:
+            # throw away anything before the header, keeping a possible partial header
+            start = buf.find(header)
+            if start < 0:
+                drop = max(0, len(buf) - len(header) + 1)
+            else:
+                drop = start
+                synced = True
+            discarded += drop
+            del buf[:drop]
+            if not synced and discarded > discardLimit:
+                raise frameError("No frame header in "+str(discarded)+" bytes from device")
+        if time.monotonic() > deadline:
+            if synced: raise frameError("Frame overdue: got "+str(len(buf))+" of "+str(size)+" bytes")
+            raise frameError("No frame header from device after "+str(discarded)+" bytes")
+        if ser.timeout != byteTimeout: ser.timeout = byteTimeout
+        if progress and synced: progress(len(buf), size)
+    return bytes(buf)
+
+def readLine(ser, firstTimeout=0.5, byteTimeout=0.1, limit=256):
+    # read up to and including '\n', with the same timeouts as readFrame
+    buf = bytearray()
+    ser.timeout = firstTimeout
+    while not buf.endswith(b'\n') and len(buf) < limit:
+        chunk = ser.read(max(1, min(ser.in_waiting, limit - len(buf))))
+        if not chunk: break
+        buf += chunk
+        newline = buf.find(b'\n')
+        if newline >= 0: return bytes(buf[:newline + 1])
+        if ser.timeout != byteTimeout: ser.timeout = byteTimeout
+    return bytes(buf)
+
+########## Paced writes
+class writeError(Exception):
+    # a write couldn't be got out to the device
+    pass
+
+def writePaced(ser, data, chunk=64, gap=0.0, rate=None, retries=3, backoff=0.05):
+    # send data chunk bytes at a time, no faster than rate bytes/second and with gap seconds
+    # between chunks; the unsent rest of a chunk the port only part took is resent after a backoff
+    # a write timeout raises writeError: pyserial may already have sent some or all of the chunk,
+    # so nothing is resent and the caller sends the whole frame again once the device has dropped it
+    view = memoryview(bytes(data))
+    pos = 0
+    failures = 0
+    start = time.monotonic()
+    chunks = 0
+    while pos < len(view):
+        piece = view[pos:pos + chunk] if chunk else view[pos:]
+        try:
+            sent = ser.write(piece)
+        except serial.SerialTimeoutException:
+            METRICS.inc('write_timeouts_total')
+            if hasattr(ser, 'reset_output_buffer'): ser.reset_output_buffer()   # don't trail the rest after the retry
+            raise writeError("Write timed out after "+str(pos)+" of "+str(len(view))+" bytes")
+        if sent is None: sent = len(piece)
+        pos += sent
+        if sent < len(piece):
+            failures += 1
+            METRICS.inc('write_chunk_retries_total')
+            if failures > retries: raise writeError("Write stalled after "+str(pos)+" of "+str(len(view))+" bytes")
+            time.sleep(backoff * 2 ** (failures - 1))
+            continue
+        ser.flush()
+        chunks += 1
+        if pos < len(view):
+            # keep to the schedule rather than sleeping a fixed time, flush() may already have waited
+            due = start + (pos / rate if rate else 0.0) + chunks * gap
+            wait = due - time.monotonic()
+            if wait > 0: time.sleep(wait)
+    return pos
+
+def readAck(ser, timeout=0.1):
+    # what the device said after a write: 'ok', 'error', or None when it says nothing
+    reply = readLine(ser, timeout, 0.05).upper()
+    if not reply: return None
+    if b'ERR' in reply or b'FAIL' in reply: return 'error'
+    if b'OK' in reply: return 'ok'
+    return None
+
+def showProgress(done, total):
+    print("\r  "+str(done)+"/"+str(total)+" bytes", end='\n' if done >= total else '', flush=True)
+
+
+########## Serial sessions
+WRITE_TIMEOUT = 0.5     # seconds a write may block before the port counts as stalled
+
+class serialSession:
+    # one serial port kept open between commands, reopened after an error
+    def __init__(self, port, baud=9600):
+        self.port = port
+        self.baud = baud
+        self.ser = None
+        self.lock = threading.RLock()  # one command at a time per port
+        self.opens = 0                 # how many times the port was opened
+        self.openTime = 0.0            # seconds spent opening it
+        self.ackSeen = False           # the device here answers writes, so silence means it lost one
+
+    def open(self):
+        if self.ser is not None and self.ser.is_open: return self.ser
+        start = time.perf_counter()
+        try:
+            with METRICS.span('port_open', port=self.port):
+                # with a write timeout a stalled port raises instead of blocking, and the frame is sent again
+                self.ser = serial.Serial(self.port, self.baud, timeout=1, write_timeout=WRITE_TIMEOUT)
+        finally:
+            self.openTime += time.perf_counter() - start
+        self.opens += 1
+        self.ackSeen = False    # it may not be the same device any more
+        return self.ser
+
+    def close(self):
+        with self.lock:
+            if self.ser is not None:
+                try: self.ser.close()
+                except serial.SerialException: pass
+            self.ser = None
+
+    def run(self, job, timeout=1):
+        # run job(ser) on the open port, reopening and retrying once if the port failed
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    ser = self.open()
+                    ser.timeout = timeout
+                    ser.reset_input_buffer()   # drop anything left over from the last command
+                    return job(ser)
+                except serial.SerialException:
+                    self.close()
+                    if attempt: raise
+                    METRICS.inc('retries_total', port=self.port)
+
+########## Network sessions
+def isNetworkPort(port):
+    # 'tcp://host:port' and 'udp://host:port' ports talk to the device over the network
+    return port.startswith('tcp://') or port.startswith('udp://')
+
+class socketPort:
+    # a TCP or UDP socket that behaves enough like serial.Serial for the device routines
+    # socket errors are raised as serial.SerialException so callers handle both the same way
+    def __init__(self, url, connectTimeout=5):
+        parts = urllib.parse.urlsplit(url)
+        if not parts.hostname or not parts.port: raise serial.SerialException("Bad network port "+url+", expected tcp://host:port or udp://host:port")
+        self.kind = parts.scheme
+        self.timeout = 1
+        self.buffer = bytearray()
+        try:
+            if self.kind == 'tcp':
+                self.sock = socket.create_connection((parts.hostname, parts.port), timeout=connectTimeout)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            else:
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.sock.connect((parts.hostname, parts.port))
+            self.sock.setblocking(False)
+        except OSError as e:
+            raise serial.SerialException("could not connect to "+url+": "+str(e)) from e
+        self.is_open = True
+
+    def fill(self, wait):
+        # move whatever arrives within wait seconds into the buffer
+        try:
+            ready, _, _ = select.select([self.sock], [], [], max(0.0, wait))
+            if not ready: return
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            raise serial.SerialException(str(e)) from e
+        if not data and self.kind == 'tcp': raise serial.SerialException("connection closed by device")
+        self.buffer += data
+
+    @property
+    def in_waiting(self):
+        self.fill(0)
+        return len(self.buffer)
+
+    def read(self, size=1):
+        # like serial.Serial.read: wait up to timeout for size bytes, return what arrived
+        deadline = time.monotonic() + (self.timeout if self.timeout is not None else 3600)
+        while len(self.buffer) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            self.fill(remaining)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readinto(self, buf):
+        data = self.read(max(1, min(len(buf), self.in_waiting)))
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        try:
+            self.sock.setblocking(True)
+            self.sock.sendall(data)
+        except OSError as e:
+            raise serial.SerialException(str(e)) from e
+        finally:
+            self.sock.setblocking(False)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self, limit=65536, wait=0.05):
+        # drop what has arrived; a peer that never stops sending only holds us up to limit bytes or wait seconds
+        deadline = time.monotonic() + wait
+        dropped = 0
+        while dropped < limit and time.monotonic() < deadline:
+            dropped += len(self.buffer)
+            self.buffer.clear()
+            self.fill(0)
+            if not self.buffer: break
+        self.buffer.clear()
+
+    def close(self):
+        self.is_open = False
+        self.sock.close()
+
+class networkSession(serialSession):
+    # the same persistent session, over a socket instead of a serial port
+    def open(self):
+        if self.ser is not None and self.ser.is_open: return self.ser
+        start = time.perf_counter()
+        try:
+            with METRICS.span('port_open', port=self.port):
+                self.ser = socketPort(self.port)
+        finally:
+            self.openTime += time.perf_counter() - start
+        self.opens += 1
+        self.ackSeen = False    # it may not be the same device any more
+        return self.ser
+
+
+class sessionPool:
+    # serial and network sessions shared between operations, keyed by port name
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, port):
+        with self.lock:
+            if port not in self.sessions:
+                self.sessions[port] = networkSession(port) if isNetworkPort(port) else serialSession(port)
+            return self.sessions[port]
+
+    def closeAll(self):
+        with self.lock:
+            for session in self.sessions.values(): session.close()
+
+    def stats(self):
+        # port -> (times opened, seconds spent opening)
+        with self.lock:
+            return {port: (s.opens, s.openTime) for port, s in self.sessions.items()}
+
+    def report(self):
+        stats = self.stats()
+        opens = sum(s[0] for s in stats.values())
+        seconds = sum(s[1] for s in stats.values())
+        return "Port opens: "+str(opens)+" ("+format(seconds*1000, '.1f')+" ms opening, "+str(len(stats))+" port(s))"
+
+# the default pool, shared by every x1c3 object
+POOL = sessionPool()
+
+
+########## Image cache
+class imageCache:
+    # the last image seen on each device, keyed by port and firmware version
+    def __init__(self, directory=os.path.expanduser('~/.cache/aprstool/images')):
+        self.directory = directory
+
+    def path(self, port, version):
+        name = os.path.basename(port) + '_' + version
+        name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+        return os.path.join(self.directory, name + '.sav')
+
+    def get(self, port, version):
+        try:
+            with open(self.path(port, version), 'rb') as f:
+                image = f.read()
+        except OSError:
+            return None
+        return image if len(image) == layout.IMAGE_SIZE else None
+
+    def put(self, port, version, image):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp = self.path(port, version) + '.tmp'
+            with open(temp, 'wb') as f:
+                f.write(image)
+            os.replace(temp, self.path(port, version))
+            return True
+        except OSError:
+            return False
+
+    def drop(self, port, version):
+        try: os.remove(self.path(port, version))
+        except OSError: pass
+
+# the default cache, shared by every x1c3 object
+CACHE = imageCache()
+
+class portCache:
+    # what discover.py last found on each port: {port: {'version', 'voltage', 'model', 'callsign', 'seen'}}
+    def __init__(self, path=os.path.expanduser('~/.cache/aprstool/ports.json')):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, entries):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(entries, f, indent=2)
+            os.replace(self.path + '.tmp', self.path)
+            return True
+        except OSError:
+            return False
+
+    def ports(self):
+        return sorted(self.load())
+
+DISCOVERED = portCache()
+
+class writeTuning:
+    # the chunk size and gap --tune found for each port
+    def __init__(self, path=os.path.expanduser('~/.cache/aprstool/tuning.json')):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, port):
+        entry = self.load().get(port)
+        if not entry: return None
+        return entry['chunk'], entry['gap']
+
+    def put(self, port, chunk, gap, rate):
+        data = self.load()
+        data[port] = {'chunk': chunk, 'gap': gap, 'rate': round(rate, 1)}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(self.path + '.tmp', self.path)
+            return True
+        except OSError:
+            return False
+
+TUNING = writeTuning()
+
+# (chunk bytes, gap seconds) tried by --tune, fastest first
+TUNING_STEPS = ((512, 0.0), (256, 0.0), (128, 0.0), (64, 0.0), (32, 0.005), (16, 0.01), (8, 0.02))
+
+
 class x1c3:
     def __init__(self):
         self.raw = ''       # the raw config string
-        self.config = {}    # the parsed configuration dictionary
+        self.config = layout.trackedConfig()   # the parsed configuration dictionary, remembers edited fields
+        self.image = None   # a mutable copy of raw as it was expanded, edits are patched into it
+        self.original = b'' # raw as it was expanded, to see what the edits changed
         self.version = ''   # the hardware/firmware version
         self.voltage = ''   # the battery voltage
         self.port = ''      # the serial port to use
         self.file = ''      # the file to use
         self.parsed = False # has the raw already been parsed?
         self.debugFlag = False
+        self.quietFlag = False  # suppress progress messages (used when driving many devices)
+        self.lastError = ''     # the last serial error, for reporting
+        self.pool = POOL        # where the persistent serial sessions live
+        self.firstTimeout = 0.5 # seconds the device has to start answering
+        self.byteTimeout = 0.1  # seconds it may pause mid-answer
+        self.progress = None    # called with (bytes read, bytes expected) during a read
+        self.cache = CACHE      # images last seen on each device
+        self.headless = False   # scripted run: never prompt, clear the screen or sleep
+        self.metricsFile = None # where finish() writes the timing counters
+        self.model = layout.GENERIC # the device model, set from the firmware string
+        self.writeChunk = None  # bytes per chunk when writing, None for the port's tuned value (or 64)
+        self.writeGap = None    # extra seconds between chunks, None as above (or 0)
+        self.writeRetries = 2   # times a rejected or garbled write is sent again
+        self.writeBackoff = 0.6 # seconds before the first retry, doubled each time; longer than
+                                # the device takes to give up on a half received write
+        self.ackTimeout = 0.1   # seconds to wait for the device to answer a write
+        self.lastWriteRate = 0.0    # bytes/second the last write reached
+        self.validateFlag = True    # refuse to write images that fail validate.py's checks
+        self.strictFlag = False     # refuse values and images that break validate.py's syntax and range rules too
+        self.history = SNAPSHOTS    # every image read, written or saved, see snapshots.py; None to keep no history
 
 
 ########## Utility routines
     def debug(self, message):
         if self.debugFlag: print(message)
 
+    def status(self, message):
+        if not self.quietFlag: print(message)
+
+    def pause(self, seconds):
+        # give the user time to read a message, not in scripted runs
+        if not self.headless: time.sleep(seconds)
+
     def setPort(self,name):
         # set the port name
         self.port = name
@@ -42,6 +470,19 @@ class x1c3:
     def getFile(self):
         return self.file
 
+    def setModel(self,name):
+        # force the model, e.g. when editing a file saved from a known device
+        try:
+            self.model = layout.byName(name)
+        except ValueError as e:
+            print(e)
+            return False
+        return True
+
+    def fields(self):
+        # the config with only the fields this model supports
+        return {k: self.config[k] for k in self.model.names if k in self.config}
+
     def hasConfig(self):
         # return true if the config dictionary has contents
         return bool(len(self.raw) > 0)
@@ -54,27 +495,13 @@ class x1c3:
         self.debug("PrintConfig...")  #debug print
         #if debug: print("Values: ", self.config)  #debug print
         self.menuHeader()
-        for k, v in self.config.items():
+        for k, v in self.fields().items():
             print(k,'=',v)
         # wait for the user before continuing
         print("--------------------------------")
-        input("Continue?")
+        if not self.headless: input("Continue?")
         return True
 
-    def encodeHex(self,param,length, pad=b'\xff'):
-        # end the passed in string with 0x00 and pad with 0xff
-        mystr = self.config[param]
-        bytestring = bytes(mystr,'utf-8')
-        if len(mystr) < length: bytestring+=b'\x00'
-        for x in range(length - len(bytestring)):
-            bytestring += pad
-        return bytestring
-
-    def intToHex(self,param,bytes=1):
-        # Convert the integer to a hexadecimal string, with the specified number of bytes
-        hex_str = int(self.config[param]).to_bytes(bytes, 'big')
-        return hex_str
-
 ########## File routines
     def readFile(self):
         # read the config string from the file in to self.raw
@@ -89,8 +516,13 @@ class x1c3:
     def writeFile(self):
         # write the raw config string from the self.raw to the file
         try:
+            if self.history is not None and os.path.isfile(self.file):
+                # keep what is about to be overwritten, unless it is already the file's last snapshot
+                with open(self.file, "rb") as f:
+                    self.history.add(f.read(), os.path.abspath(self.file), 'file')
             with open(self.file, "wb") as f:
                 f.write(self.raw)
+            if self.history is not None: self.history.add(self.raw, os.path.abspath(self.file), 'file', self.version)
             return True
         except Exception as e:
             print("An error occurred:", e)
@@ -98,26 +530,44 @@ class x1c3:
 
 ########## Menu tools
     def menuHeader(self):
-        os.system('clear')
+        if not self.headless: os.system('clear')
         print("--------------------------------")
         print("X1C3 Configuration Tool - KG7KMV")
         print("")
         print("Device FW Version:", self.version)
         print("   Device Voltage:", self.voltage)
+        print("     Device Model:", self.model.name)
         print("    Config loaded:", self.hasConfig())
         print("--------------------------------")
 
-    def printEnum(self,param,options=['Disable','Enable']):
+    def options(self,param):
+        # the labels for an enum field, from the layout table
+        return self.model.codec.options(param)
+
+    def printEnum(self,param,options=None):
+        if options is None: options = self.options(param)
         num = int(self.config[param])
         return options[num]
 
-    def inputChar(self,param,length):
+    def checkField(self,param,value):
+        # what is wrong with a value for a field, or None if it is fine
+        # a value that only breaks a rule is taken, with a warning, unless strictFlag is set
+        errors = validate.checkConfig({param: value}, self.model, self.strictFlag)
+        if errors: return errors[0][2]
+        for line in validate.describe(validate.warnConfig({param: value}, self.model)): print("Warning:", line)
+        return None
+
+    def inputChar(self,param,length=None):
         # ask the user for free form input with character limitation
+        if length is None: length = self.model.codec.info[param][1]   # default to the field width
         prompt = param + " (<="+str(length)+" characters):"
         # keep asking for user input until they have the right input
         while True:
             response = input(prompt)
-            if len(response) <= length: break
+            if len(response) > length: continue
+            error = self.checkField(param, response)
+            if error is None: break
+            print("Invalid:", error)
 
         self.config[param] = response
         return response
@@ -133,8 +583,15 @@ class x1c3:
         prompt = param + " (<="+str(length)+"):"
         # keep asking for user input until they have the right input
         while True:
-            response = int(input(prompt))
-            if response <= length: break
+            try:
+                response = int(input(prompt))
+            except ValueError:
+                print("Enter a number")
+                continue
+            if not 0 <= response <= length: continue
+            error = self.checkField(param, response)
+            if error is None: break
+            print("Invalid:", error)
 
         self.config[param] = response
         return response
@@ -151,23 +608,28 @@ class x1c3:
         # ask for the user input
         response = input(prompt)
         # this allows multiuse: for a general menu and a menu for a dictionary item. Don't change it if the user doesn't enter anything
-        if param != '' and response !='' : self.config[param] = response
+        if param != '' and response !='' :
+            if response.isdigit() and int(response) < len(options): self.config[param] = int(response)
+            else: input("Not one of the options, continue?")
         return response
 
 ########## Menus
     def editMenu(self):
         # create a user menu to run the program
+        # sub menus are only offered when the model has the settings in them
+        menus = [('Setup', self.menu_setup, 'CALLSIGN'),
+                 ('Beacon', self.menu_beacon, 'Smart'),
+                 ('Bluetooth', self.menu_bluetooth, 'BT Enable'),
+                 ('Fixed', self.menu_fixed, 'Latitude'),
+                 ('WiFi', self.menu_wifi, 'Wifi Enable'),
+                 ('Digpeater', self.menu_digi, 'DIGI 1'),
+                 ('Audio', self.menu_audio, 'Volume TX'),
+                 ('RF Module', self.menu_rfmodule, 'Module Power'),
+                 ('X1C5', self.menu_x1c5, 'Brightness')]
+        menus = [m for m in menus if self.model.supports(m[2])]
         while True:
-            response = self.inputMenu('',"Selection:",['Setup','Beacon','Bluetooth','Fixed','WiFi','Digpeater','Audio','RF Module','X1C5'],True)
-            if response == '0': self.menu_setup()
-            elif response == '1': self.menu_beacon()
-            elif response == '2': self.menu_bluetooth()
-            elif response == '3': self.menu_fixed()
-            elif response == '4': self.menu_wifi()
-            elif response == '5': self.menu_digi()
-            elif response == '6': self.menu_audio()
-            elif response == '7': self.menu_rfmodule()
-            elif response == '8': self.menu_x1c5()
+            response = self.inputMenu('',"Selection:",[m[0] for m in menus],True)
+            if response.isdigit() and int(response) < len(menus): menus[int(response)][1]()
             else: break
 
     def menu_setup(self):
@@ -175,7 +637,7 @@ class x1c3:
             response = self.inputMenu('',"Selection:",
                 ['       Callsign: '+self.config['CALLSIGN'],
                 '           SSID: '+str(self.config['SSID']),
-                '      Site Type: '+self.printEnum('Site Type',['Fixed','Mobile','Weather']),
+                '      Site Type: '+self.printEnum('Site Type'),
                 '      Data Type: '+self.config['Type'],
                 '            GPS: '+self.printEnum('GPS Enable'),
                 '         Icon 1: '+self.config['Icon 1'],
@@ -183,19 +645,19 @@ class x1c3:
                 'Icon 2 Time (s): '+str(self.config['Icon 2 Time'])],
                 True)
             if response == '0': self.inputChar('CALLSIGN',7)
-            elif response == '1': self.inputMenu('SSID','',['0','1','2','3','4','5','6','7','8','9','10','11','12','13','14','15'])
-            elif response == '2': self.inputMenu('Site Type','',['Fixed','Mobile','Weather'])
+            elif response == '1': self.inputMenu('SSID','',self.options('SSID'))
+            elif response == '2': self.inputMenu('Site Type','',self.options('Site Type'))
             elif response == '3': self.inputChar('Type')
-            elif response == '3': self.toggleVal('GPS Enable')
-            elif response == '4': self.inputChar('Icon 1',2)
-            elif response == '5': self.inputChar('Icon 2',2)
-            elif response == '6': self.inputNums('Icon 2 Time',999)
+            elif response == '4': self.toggleVal('GPS Enable')
+            elif response == '5': self.inputChar('Icon 1',2)
+            elif response == '6': self.inputChar('Icon 2',2)
+            elif response == '7': self.inputNums('Icon 2 Time',999)
             else: break
 
     def menu_beacon(self):
         while True:
             response = self.inputMenu('',"Selection:",
-            ['    Smart Beacon: '+self.printEnum('Smart',['Off','1-Car (20s)','2-Bicycle (40s)','3-Walking (60s)','4-Climbing (90s)','5-Barely moving (120s)']),
+            ['    Smart Beacon: '+self.printEnum('Smart'),
             '   Manual Enable: '+self.printEnum('Manual Enable'),
             '        GPS Save: '+self.printEnum('GPS Save'),
             '    Queue Enable: '+self.printEnum('Queue Enable'),
@@ -203,7 +665,7 @@ class x1c3:
             '     Time Enable: '+self.printEnum('Time Enable'),
             '        Time (s): '+str(self.config['Time Value']),
             '    MIC-E Enable: '+self.printEnum('MIC-E Enable'),
-            '      MIC-E Code: '+self.printEnum('MIC-E Code',['Off Duty','En Route','In Service','Returning','Committed','Special','Priority','Emergency']),
+            '      MIC-E Code: '+self.printEnum('MIC-E Code'),
             '         Message: '+self.config['Message'],
             '    Add Mileage: '+self.printEnum('Mileage Enable'),
             '   Add Pressure: '+self.printEnum('Pressure Enable'),
@@ -211,9 +673,9 @@ class x1c3:
             'Add Temperature: '+self.printEnum('Temperature Enable'),
             ' Add Satellites: '+self.printEnum('Satellite Enable'),
             '  Save Odometer: '+self.printEnum('Odometer Enable'),
-            ' Beacon Channel: '+self.printEnum('Beacon Channel',['CH A','CH B','CH A+B','Bluetooth'])],
+            ' Beacon Channel: '+self.printEnum('Beacon Channel')],
             True)
-            if response == '0': self.inputMenu('Smart','',['Off','1-Car (20s)','2-Bicycle (40s)','3-Walking (60s)','4-Climbing (90s)','5-Barely moving (120s)'])
+            if response == '0': self.inputMenu('Smart','',self.options('Smart'))
             elif response == '1': self.toggleVal('Manual Enable')
             elif response == '2': self.toggleVal('GPS Save')
             elif response == '3': self.toggleVal('Queue Enable')
@@ -221,7 +683,7 @@ class x1c3:
             elif response == '5': self.toggleVal('Time Enable')
             elif response == '6': self.inputNums('Time Value',9999)
             elif response == '7': self.toggleVal('MIC-E Enable')
-            elif response == '8': self.inputMenu('MIC-E Code','',['Off Duty','En Route','In Service','Returning','Committed','Special','Priority','Emergency'])
+            elif response == '8': self.inputMenu('MIC-E Code','',self.options('MIC-E Code'))
             elif response == '9': self.inputChar('Message',60)
             elif response == '10': self.toggleVal('Mileage Enable')
             elif response == '11': self.toggleVal('Pressure Enable')
@@ -229,18 +691,18 @@ class x1c3:
             elif response == '13': self.toggleVal('Temperature Enable')
             elif response == '14': self.toggleVal('Satellite Enable')
             elif response == '15': self.toggleVal('Odometer Enable')
-            elif response == '5': self.inputMenu('Beacon Channel','',['CH A','CH B','CH A+B','Bluetooth'])
+            elif response == '16': self.inputMenu('Beacon Channel','',self.options('Beacon Channel'))
             else: break
 
     def menu_bluetooth(self):
         while True:
             response = self.inputMenu('',"Selection:",
-            [' BT Out 1: '+self.printEnum('BT Out 1',['Off','KISS hex','UI','GPWPL','KISS ascii']),
-            ' BT Out 2: '+self.printEnum('BT Out 2',['Off','GPS','Rotator']),
+            [' BT Out 1: '+self.printEnum('BT Out 1'),
+            ' BT Out 2: '+self.printEnum('BT Out 2'),
             'BT Enable: '+self.printEnum('BT Enable')],
             True)
-            if response == '0': self.inputMenu('BT Out 1','',['Off','KISS hex','UI','GPWPL','KISS ascii'])
-            elif response == '1': self.inputMenu('BT Out 2','',['Off','GPS','Rotator'])
+            if response == '0': self.inputMenu('BT Out 1','',self.options('BT Out 1'))
+            elif response == '1': self.inputMenu('BT Out 2','',self.options('BT Out 2'))
             elif response == '2': self.toggleVal('BT Enable')
             else: break
 
@@ -264,14 +726,14 @@ class x1c3:
             'Digi 2 Enable: '+self.printEnum('DIGI 2 Enable'),
             '  Digi 2 PATH: '+self.config['DIGI 2'],
             '   Digi Delay: '+str(self.config['DIGI Delay']),
-            ' Digi Channel: '+self.printEnum('DIGI Channel',['CH A','CH B','CH A+B','Bluetooth'])],
+            ' Digi Channel: '+self.printEnum('DIGI Channel')],
             True)
             if response == '0': self.toggleVal('DIGI 1 Enable')
             elif response == '1': self.inputChar('DIGI 1',6)
             elif response == '2': self.toggleVal('DIGI 2 Enable')
             elif response == '3': self.inputChar('DIGI 2',6)
-            elif response == '4': self.inputMenu('DIGI Delay','',['0s','1s','2s','3s','4s','5s'])
-            elif response == '5': self.inputMenu('DIGI Channel','',['CH A','CH B','CH A+B','Bluetooth'])
+            elif response == '4': self.inputMenu('DIGI Delay','',self.options('DIGI Delay'))
+            elif response == '5': self.inputMenu('DIGI Channel','',self.options('DIGI Channel'))
             else: break
 
     def menu_wifi(self):
@@ -283,26 +745,26 @@ class x1c3:
             '  WiFi Enable: '+self.printEnum('Wifi Enable'),
             '   IP Address: '+str(self.config['IP Address']),
             '      IP Port: '+str(self.config['IP Port']),
-            '  IP Protocol: '+self.printEnum('IP Protocol',['UDP','TCP'])],
+            '  IP Protocol: '+self.printEnum('IP Protocol')],
             True)
             if response == '0': self.inputChar('Wifi Name',16)
             elif response == '1': self.inputChar('Wifi Code',16)
             elif response == '2': self.toggleVal('Wifi Enable')
             elif response == '3': self.inputChar('IP Address',31)
             elif response == '4': self.inputChar('IP Port',6)
-            elif response == '5': self.inputMenu('IP Protocol','',['TCP','UDP'])
+            elif response == '5': self.inputMenu('IP Protocol','',self.options('IP Protocol'))
             else: break
 
     def menu_audio(self):
         while True:
             response = self.inputMenu('',"Selection:",
-            ['Tx Volume: '+self.printEnum('Volume TX',['-10.5dB','-9.0dB','-7.5dB','-6.0dB','-4.5dB','-3.0dB','-1.5dB','0dB']),
-            'Rx Volume: '+self.printEnum('Volume RX',['-10.5dB','-9.0dB','-7.5dB','-6.0dB','-4.5dB','-3.0dB','-1.5dB','0dB']),
+            ['Tx Volume: '+self.printEnum('Volume TX'),
+            'Rx Volume: '+self.printEnum('Volume RX'),
             '  Tx Beep: '+self.printEnum('Beep TX'),
             '  Rx Beep: '+self.printEnum('Beep RX')],
             True)
-            if response == '0': self.inputMenu('Volume TX','',['-10.5dB','-9.0dB','-7.5dB','-6.0dB','-4.5dB','-3.0dB','-1.5dB','0dB'])
-            elif response == '1': self.inputMenu('Volume RX','',['-10.5dB','-9.0dB','-7.5dB','-6.0dB','-4.5dB','-3.0dB','-1.5dB','0dB'])
+            if response == '0': self.inputMenu('Volume TX','',self.options('Volume TX'))
+            elif response == '1': self.inputMenu('Volume RX','',self.options('Volume RX'))
             elif response == '2': self.toggleVal('Beep TX')
             elif response == '3': self.toggleVal('Beep RX')
             else: break
@@ -310,15 +772,15 @@ class x1c3:
     def menu_rfmodule(self):
         while True:
             response = self.inputMenu('',"Selection:",
-            ['      Power: '+self.printEnum('Module Power',['Off','On','Tx Only','Rx Only']),
+            ['      Power: '+self.printEnum('Module Power'),
             'Frequency 1: '+str(self.config['Frequency 1']),
             'Frequency 2: '+str(self.config['Frequency 2']),
             '     Volume: '+str(self.config['Module Volume']),
             '   Mic Gain: '+str(self.config['Module Mic'])],
             True)
-            if response == '0': self.inputMenu('Module Power','',['Off','On','Tx Only','Rx Only'])
+            if response == '0': self.inputMenu('Module Power','',self.options('Module Power'))
             elif response == '1': self.inputChar('Frequency 1',8)
-            elif response == '1': self.inputChar('Frequency 2',8)
+            elif response == '2': self.inputChar('Frequency 2',8)
             elif response == '3': self.inputNums('Module Volume',9)
             elif response == '4': self.inputNums('Module Mic',8)
             else: break
@@ -326,7 +788,7 @@ class x1c3:
     def menu_x1c5(self):
         while True:
             response = self.inputMenu('',"Selection:",
-            ['Display Brightness: '+self.printEnum('Brightness',['Normal','Auto','High']),
+            ['Display Brightness: '+self.printEnum('Brightness'),
             ' Backlight Timeout: '+str(self.config['Backlight Timeout']),
             '      Alert Enable: '+self.printEnum('Alert Enable'),
             '     Last Position: '+self.printEnum('Last Position'),
@@ -334,8 +796,8 @@ class x1c3:
             ' 30 min stop Alarm: '+self.printEnum('Stop 30m Alarm'),
             '  60 min Emergency: '+self.printEnum('Stop 60m Emergency')],
             True)
-            if response == '0': self.inputMenu('Brightness', 'Brightness',['Normal','Auto','High'])
-            elif response == '1': self.inputNums('Backlight Time',255)
+            if response == '0': self.inputMenu('Brightness','Brightness',self.options('Brightness'))
+            elif response == '1': self.inputNums('Backlight Timeout',255)
             elif response == '2': self.toggleVal('Alert Enable')
             elif response == '3': self.toggleVal('Last Position')
             elif response == '4': self.toggleVal('Six Knots')
@@ -345,263 +807,374 @@ class x1c3:
 
 
 ########## Device routines
+    def session(self):
+        # the shared, persistent session for the current port
+        return self.pool.get(self.port)
+
+    def serialError(self, e):
+        self.lastError = str(e)
+        self.status("Error opening or using serial port: "+str(e))
+        return False
+
     def readSerialVersion(self):
-        print("Reading Version...")  #debug print
+        self.status("Reading Version...")
+        def job(ser):
+            self.debug("Port open, reading")  #debug print
+            # Send the command
+            command = "AT+VER=?\r\n"
+            ser.write(command.encode('utf-8'))
+            # listen for the response, it ends with a newline
+            return readLine(ser, self.firstTimeout, self.byteTimeout)
         try:
-            #open the serial port
-            with serial.Serial(self.port, 9600, timeout=1) as ser:
-                self.debug("Port open, reading")  #debug print
-                # Send the command
-                command = "AT+VER=?\r\n"
-                ser.write(command.encode('utf-8'))
-                # listen for the response
-                byteString = ser.readline()
-                response = byteString.decode('utf-8').split("|")
-                self.debug("Response: "+str(response))  #debug print
-
-                if len(byteString) < 10: return False
-                self.version = response[0][6:]
-                self.voltage = response[2][10:]
-                return True
-
+            with METRICS.span('version_query', port=self.port) as span:
+                byteString = self.session().run(job, timeout=1)
+                span.bytes = len(byteString)
+                if not byteString.endswith(b'\n'): span.error = 'timeout'
         except serial.SerialException as e:
-            print("Error opening or using serial port:",e)
+            return self.serialError(e)
+
+        self.debug("Response: "+str(byteString))  #debug print
+        if len(byteString) < 10: return False
+        # 'VER = <firmware>|<vendor>|VOLTAGE = <volts>', anything else is some other device (a GPS, a modem...)
+        response = byteString.decode('utf-8', 'replace').split("|")
+        if not response[0].startswith('VER = ') or len(response) < 3 or not response[2].startswith('VOLTAGE = '):
+            self.lastError = "Not an X1C3, it answered "+repr(byteString[:40])
+            self.status(self.lastError)
             return False
+        self.version = response[0][6:].strip()
+        self.voltage = response[2][10:].strip()
+        self.model = layout.detect(self.version)
+        self.debug("Model: "+self.model.name)  #debug print
+        return True
 
     def readSerialDevice(self):
-        print("Reading device...")  #debug print
+        self.status("Reading device...")
+        def job(ser):
+            self.debug("Port open, reading")  #debug print
+            # Send the read command
+            command = "AT+SET=READ\r\n\n"
+            ser.write(command.encode('utf-8'))
+            # listen for the response, stop as soon as the whole frame is in
+            return readFrame(ser, firstTimeout=self.firstTimeout, byteTimeout=self.byteTimeout, progress=self.progress)
         try:
-            #open the serial port
-            with serial.Serial(self.port, 9600, timeout=3) as ser:
-                self.debug("Port open, reading")  #debug print
-                # Send the read command
-                command = "AT+SET=READ\r\n\n"
-                ser.write(command.encode('utf-8'))
-                # listen for the response
-                self.raw = ser.read(517)  # read 517 bytes
-                return True
+            with METRICS.span('image_read', port=self.port) as span:
+                self.raw = self.session().run(job, timeout=3)
+                span.bytes = len(self.raw)
+            if self.version: self.cache.put(self.port, self.version, self.raw)
+            if self.history is not None: self.history.add(self.raw, self.port, 'read', self.version)
+            return True
         except serial.SerialException as e:
-            print("Error opening or using serial port:",e)
+            return self.serialError(e)
+        except frameError as e:
+            METRICS.inc('timeouts_total', port=self.port)
+            self.lastError = str(e)
+            self.status("Error reading device: "+str(e))
             return False
 
+    def writeSettings(self):
+        # (chunk, gap) for this port: what was set, else what --tune found, else the defaults
+        tuned = TUNING.get(self.port) or (64, 0.0)
+        return (self.writeChunk if self.writeChunk is not None else tuned[0],
+                self.writeGap if self.writeGap is not None else tuned[1])
+
     def writeSerialDevice(self):
-        print("Writing device...")  #debug print
+        self.status("Writing device...")
+        if self.validateFlag:
+            errors = validate.checkImage(self.raw, self.model, self.strictFlag)
+            if errors:
+                self.lastError = "Image failed validation: " + '; '.join(validate.describe(errors))
+                self.status(self.lastError)
+                return False
+            warnings = [] if self.strictFlag else validate.warnImage(self.raw, self.model)
+            if warnings: self.status("Warning: " + '; '.join(validate.describe(warnings)))
+        payload = bytes(self.raw[5:])   # exclude the 'HELLO' header
+        chunk, gap = self.writeSettings()
+        rate = None if isNetworkPort(self.port) else self.session().baud / 10.0   # 8N1
+        def job(ser):
+            self.debug("Port open, writing "+str(chunk)+" byte chunks, gap "+str(gap)+"s")  #debug print
+            # Send the write command
+            ser.write(bytes("AT+SET=WRITE",'utf-8'))
+            writePaced(ser, payload, chunk, gap, rate)
+            return readAck(ser, self.ackTimeout)
+        for attempt in range(self.writeRetries + 1):
+            if attempt:
+                METRICS.inc('write_retries_total', port=self.port)
+                self.status("Retrying write: "+self.lastError)
+                time.sleep(self.writeBackoff * 2 ** (attempt - 1))
+            start = time.perf_counter()
+            session = self.session()
+            try:
+                with METRICS.span('image_write', port=self.port) as span:
+                    span.bytes = len(payload)
+                    ack = session.run(job, timeout=3)
+                    if ack == 'error' or (ack is None and session.ackSeen): span.error = 'unacknowledged' if ack is None else 'rejected'
+            except serial.SerialException as e:
+                return self.serialError(e)
+            except writeError as e:
+                self.lastError = str(e)
+                continue
+            if ack == 'error':
+                self.lastError = "Device rejected the write"
+                continue
+            if ack is None and session.ackSeen:
+                self.lastError = "No acknowledgement from device"
+                continue
+            if ack == 'ok': session.ackSeen = True
+            self.lastWriteRate = len(payload) / (time.perf_counter() - start)
+            self.debug("Wrote "+str(len(payload))+" bytes at "+format(self.lastWriteRate, '.0f')+" bytes/s"+(", acknowledged" if ack else ""))  #debug print
+            if self.history is not None: self.history.add(self.raw, self.port, 'write', self.version)
+            return True
+        self.status("Error writing device: "+self.lastError)
+        return False
+
+    def tuneWrite(self, trials=2, steps=TUNING_STEPS):
+        # find the fastest chunk size and gap that write and verify reliably on this port
+        # the device's own image is written back, so its config doesn't change
+        # returns [(chunk, gap, bytes/second or None if it failed)], fastest setting first
+        if not (self.version or self.readSerialVersion()) or not self.readSerialDevice(): return []
+        image = bytes(self.raw)
+        saved = (self.writeChunk, self.writeGap, self.writeRetries, self.quietFlag, self.validateFlag)
+        self.writeRetries = 0
+        self.quietFlag = True
+        self.validateFlag = False   # it is the device's own image going back
+        results = []
+        chosen = None
         try:
-            #open the serial port
-            with serial.Serial(self.port, 9600, timeout=3) as ser:
-                self.debug("Port open, writing")  #debug print
-                # Send the read command
-                ser.write(bytes("AT+SET=WRITE",'utf-8'))
-                ser.write(self.raw[5:])   # exclude the 'HELLO' header
-                return True
-        except serial.SerialException as e:
-            print("Error opening or using serial port:",e)
+            for chunk, gap in steps:
+                self.writeChunk, self.writeGap = chunk, gap
+                rates = []
+                for trial in range(trials):
+                    self.raw = image
+                    if not self.writeSerialDevice(): break
+                    rate = self.lastWriteRate
+                    if not self.readSerialDevice() or not layout.sameImage(self.raw, image): break
+                    rates.append(rate)
+                if len(rates) < trials:
+                    results.append((chunk, gap, None))
+                    time.sleep(self.writeBackoff)   # let the device drop what it half received
+                    continue
+                results.append((chunk, gap, min(rates)))
+                chosen = (chunk, gap, min(rates))
+                break
+        finally:
+            self.writeChunk, self.writeGap, self.writeRetries, self.quietFlag, self.validateFlag = saved
+            self.raw = image
+        if chosen is None:
+            # leave the device with its own image, at the slowest setting
+            self.writeChunk, self.writeGap = steps[-1]
+            self.validateFlag = False
+            self.writeSerialDevice()
+            self.validateFlag = saved[4]
+            self.writeChunk, self.writeGap = saved[:2]
+            return results
+        TUNING.put(self.port, *chosen)
+        return results
+
+    def writeSerialDeviceChecked(self, useCache=True, verify=True):
+        # write self.raw only if the device doesn't already have it, then read it back
+        # returns 'skipped', 'written' or False
+        image = bytes(self.raw)
+        if not self.version and not self.readSerialVersion(): return False
+
+        current = self.cache.get(self.port, self.version) if useCache else None
+        if current is None:
+            self.debug("No cached image, reading device first")  #debug print
+            if not self.readSerialDevice(): return False
+            current = bytes(self.raw)
+            self.raw = image
+        if layout.sameImage(current, image):
+            self.status("Device already up to date")
+            self.cache.put(self.port, self.version, current)
+            return 'skipped'
+
+        for attempt in range(self.writeRetries + 1):
+            if attempt:
+                # the frame got garbled on the way, send the whole thing again
+                METRICS.inc('write_retries_total', port=self.port)
+                self.status("Retrying write")
+                time.sleep(self.writeBackoff * 2 ** (attempt - 1))
+            self.raw = image
+            if not self.writeSerialDevice(): return False
+            if not verify: break
+            if not self.readSerialDevice():
+                self.cache.drop(self.port, self.version)
+                return False
+            readback = bytes(self.raw)
+            self.raw = image
+            if layout.sameImage(readback, image): break
+            self.lastError = "Verify failed: device image differs from what was written"
+            self.status(self.lastError)
+            self.cache.drop(self.port, self.version)
+        else:
             return False
+        self.cache.put(self.port, self.version, image)
+        return 'written'
+
+########## Scripted editing
+    def applySettings(self, settings):
+        # set fields from a {name: value} dictionary, checked against the layout table
+        # nothing is changed unless every value is good; returns a list of errors
+        errors = []
+        values = {}
+        for name, value in settings.items():
+            try:
+                values[name] = self.model.parseValue(name, value)
+            except ValueError as e:
+                errors.append(str(e))
+        if not errors:
+            # the layout checks parseValue doesn't make, and the syntax and range rules if strict
+            errors = validate.describe(validate.checkConfig(values, self.model, self.strictFlag))
+        if not errors:
+            # stderr, so a --json-out - on stdout stays clean
+            if not self.strictFlag:
+                for line in validate.describe(validate.warnConfig(values, self.model)): print("Warning:", line, file=sys.stderr)
+            self.config.update(values)
+        return errors
+
+    def diffConfig(self, old):
+        # (field, old value, new value) for every field that differs from old
+        return [(k, old.get(k), v) for k, v in self.config.items() if old.get(k) != v]
 
     def readIPDevice(self):
-        # possible future feature!
-        return
+        # read the config from a tcp:// or udp:// port, the protocol is the same as over serial
+        if not isNetworkPort(self.port): return self.serialError("Not a network port: "+self.port)
+        return self.readSerialDevice()
+
     def writeIPDevice(self):
-        # possible future feature!
-        return
+        # write the config to a tcp:// or udp:// port
+        if not isNetworkPort(self.port): return self.serialError("Not a network port: "+self.port)
+        return self.writeSerialDevice()
 
 ########## Manipulating routines
+    def patch(self, image=None):
+        # write the edited fields into image, leaving every other byte as it was read
+        # into self.image by default, which uses the edits up; any other image (a copy) leaves them pending
+        # returns the (name, start, end) ranges written
+        codec = self.model.codec
+        target = self.image if image is None else image
+        written = [(name,) + codec.encodeField(target, name, self.config[name])
+                   for name in sorted(self.config.changed) if name in codec.info]
+        if image is None: self.config.changed.clear()
+        return written
+
     def compressConfig(self):
-        # rebuild the bytestream from the dictionary, ensuring exact byte count and position
-        # the bytestream is exactly 517 bytes of hexadecimal
+        # turn the dictionary back into the bytestream, ensuring exact byte count and position
+        # after ExpandConfig only the edited fields are patched in, so bytes the layout doesn't
+        # decode keep whatever the device had; without an expanded image the whole 517 bytes
+        # are packed from the layout table
         # once compressed it can be sent to the device or a file
-        bytestring = b"HELLO"
-        bytestring += self.intToHex('Time Value',2)
-        bytestring += self.intToHex('Time Enable')
-        bytestring += self.intToHex('Manual Enable')
-        bytestring += self.intToHex('Smart')
-        bytestring += self.intToHex('Queue Enable')
-        bytestring += self.intToHex('Queue Time')
-        bytestring += self.intToHex('PTT Delay')
-        bytestring += self.encodeHex('CALLSIGN',7)
-        bytestring += self.intToHex('SSID')
-        bytestring += self.intToHex('MIC-E Enable')
-        bytestring += self.intToHex('MIC-E Code')
-        bytestring += self.encodeHex('Type',1)
-        bytestring += self.encodeHex('Icon 1',2)
-        bytestring += self.intToHex('BT Out 2')
-        bytestring += self.intToHex('BT Out 1')
-        bytestring += b'\x01\x00\x01\x01\x01\x01\x01\x01w' # 9
-        bytestring += self.encodeHex('Latitude',10)
-        bytestring += self.intToHex('Site Type')
-        bytestring += self.intToHex('GPS Enable')
-        bytestring += self.intToHex('Timezone Offset')
-        bytestring += self.intToHex('GPS Save')
-        bytestring += self.intToHex('Beep RX')
-        bytestring += self.intToHex('Beep TX')
-        bytestring += self.encodeHex('Longitude',10)
-        bytestring += self.intToHex('BT Enable')
-        bytestring += self.intToHex('Pressure Enable')
-        bytestring += self.intToHex('Voltage Enable')
-        bytestring += self.intToHex('Temperature Enable')
-        bytestring += self.intToHex('Mileage Enable')
-        bytestring += self.intToHex('Satellite Enable')
-        bytestring += self.encodeHex('Message',62,)
-        bytestring += b"\xff\xff" # 2
-        bytestring += bytes('1,'+self.config['Frequency 1']+','+self.config['Frequency 2']+',0,3,0,0\r\n','utf-8')
-        bytestring += b"\x00\xff\xff" # the tail end of the frequency string
-        bytestring += self.intToHex('Module Power')
-        bytestring += self.intToHex('Module Volume')
-        bytestring += self.intToHex('Module Mic')
-        bytestring += b'\x00'   # 1
-        bytestring += self.intToHex('Auto Poweroff')
-        bytestring += b'\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01' # 10
-        bytestring += b'\x01\x01\x01\x01' # 4
-        bytestring += self.intToHex('IP Protocol')
-        bytestring += self.intToHex('IP Port',2)
-        bytestring += b'\x00\x00\x00\x00\x00' # 5
-        bytestring += self.intToHex('Odometer Enable')
-        bytestring += self.encodeHex('Icon 2',2)
-        bytestring += self.intToHex('Icon 2 Time',2)
-        bytestring += self.encodeHex('IP Address',33)
-        bytestring += b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'   # 10
-        bytestring += b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'   # 10
-        bytestring += b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'   # 10
-        bytestring += b'\xff'   # 1
-        bytestring += self.encodeHex('Wifi Name',16,b'\x00')
-        bytestring += self.encodeHex('Wifi Code',16,b'\x00')
-        bytestring += b'START1\x00\x01\x00' # 
-        bytestring += self.intToHex('Altitude',2)
-        bytestring += b'\xff\xff\xff'
-        bytestring += self.intToHex('Last Position')
-        bytestring += self.intToHex('Six Knots')
-        bytestring += self.intToHex('Stop 30m Alarm')
-        bytestring += self.intToHex('Stop 60m Emergency')
-        bytestring += b'\x01\x01\xff\xff\xff\xff\xff\xff\xff\xff' # no idea what these bytes mean, but they don't change
-        bytestring += b'\x08\x08\x08\x08\xc0\xa8\x01\x9b\xc0\xa8' # 126
-        bytestring += b'\x01\x01\xff\xff\xff\x00\xdc\x01\x02\t'
-        bytestring += b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
-        bytestring += b'\xff\xff\xff\xff\xff\xffo(\x9b\x7f'
-        bytestring += b'\x11\x08E \xbd*\xad\x8eB^'
-        bytestring += b'\x00\x00\xff\xff\xff\xff\xff\xff\xff\xff'
-        bytestring += b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
-        bytestring += b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
-        bytestring += b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
-        bytestring += b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
-        bytestring += b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
-        bytestring += b'\xff\xff\xff\xff\xff\xff'
-        bytestring += self.encodeHex('Emergency Message',32)
-        bytestring += b'\x00' # 1
-        bytestring += self.intToHex('Brightness')
-        bytestring += self.intToHex('Alert Enable')
-        bytestring += self.intToHex('Volume TX')
-        bytestring += self.intToHex('Volume RX')
-        bytestring += self.intToHex('DIGI Delay')
-        bytestring += self.intToHex('DIGI Channel')
-        bytestring += self.intToHex('Beacon Channel')
-        bytestring += self.encodeHex('Remote Code',7)
-        bytestring += self.intToHex('Backlight Timeout')
-        bytestring += self.encodeHex('PATH 1',7)
-        bytestring += self.intToHex('PATH 1 Hops')
-        bytestring += self.encodeHex('PATH 2',7)
-        bytestring += self.intToHex('PATH 2 Hops')
-        bytestring += self.encodeHex('DIGI 1',7)
-        bytestring += self.intToHex('DIGI 1 Enable')
-        bytestring += self.encodeHex('DIGI 2',7)
-        bytestring += self.intToHex('DIGI 2 Enable')
-        self.raw = bytestring
-        return bytestring
+        with METRICS.span('compress_config'):
+            if self.image is not None:
+                self.patch()
+                self.raw = bytes(self.image)
+            else:
+                self.raw = bytes(self.model.codec.encode(self.config))
+        return self.raw
+
+    def changes(self):
+        # (field, start, end) for every field that now differs from the image as expanded,
+        # '' for bytes outside the decoded fields
+        # worked out on a copy, so listing the changes (--dry-run, -v) changes nothing
+        if self.image is None: return []
+        image = bytearray(self.image)
+        self.patch(image)
+        return layout.diffImages(self.original, image, self.model.codec)
 
 
     def ExpandConfig(self):
-        # parse the dictionary
-        if True:
-            # parse out all the bytes into their parts
-            try:
-                #self.config['Header'] = self.raw[0:5].decode('utf-8')
-
-                self.config['CALLSIGN'] = self.raw[13:20].decode('utf-8')
-                self.config['SSID'] = ord(self.raw[20:21])
-                self.config['MIC-E Enable'] = ord(self.raw[21:22])
-                self.config['MIC-E Code'] = ord(self.raw[22:23])
-                self.config['Site Type'] = ord(self.raw[47:48])
-                self.config['Type'] = self.raw[23:24].decode('utf-8')
-
-                self.config['Icon 1'] = self.raw[24:26].decode('utf-8')
-                self.config['Icon 2'] = self.raw[193:195].decode('utf-8')
-                self.config['Icon 2 Time'] = int.from_bytes(self.raw[195:197])
-
-                self.config['BT Out 2'] = ord(self.raw[26:27])
-                self.config['BT Out 1'] = ord(self.raw[27:28])
-                self.config['BT Enable'] = ord(self.raw[62:63])
-
-                self.config['GPS Enable'] = ord(self.raw[48:49])
-                self.config['GPS Save'] = ord(self.raw[50:51])
-                self.config['Latitude'] = self.raw[37:46].decode('utf-8')
-                self.config['Longitude'] = self.raw[53:62].decode('utf-8')
-                self.config['Altitude'] = int.from_bytes(self.raw[302:304], "big")
-
-                self.config['Pressure Enable'] = ord(self.raw[63:64])
-                self.config['Voltage Enable'] = ord(self.raw[64:65])
-                self.config['Temperature Enable'] = ord(self.raw[65:66])
-                self.config['Mileage Enable'] = ord(self.raw[66:67])
-                self.config['Satellite Enable'] = ord(self.raw[67:68])
-                self.config['Odometer Enable'] = ord(self.raw[192:193])
-                self.config['Message'] = self.raw[69:132].strip(b'\xff\x00').decode('utf-8')
-                self.config['Emergency Message'] = self.raw[436:468].strip(b'\xff\x00').decode('utf-8')
-                self.config['Beacon Channel'] = ord(self.raw[476:477])
-
-                self.config['Time Value'] = int.from_bytes(self.raw[5:7])
-                self.config['Time Enable'] = ord(self.raw[7:8])
-                self.config['Manual Enable'] = ord(self.raw[8:9])
-                self.config['Smart'] = ord(self.raw[9:10])
-                self.config['Queue Enable'] = ord(self.raw[10:11])
-                self.config['Queue Time'] = ord(self.raw[11:12])
-                self.config['PTT Delay'] = ord(self.raw[12:13])
-
-                self.config['Wifi Name'] = self.raw[261:277].strip(b'\xff').decode('utf-8')
-                self.config['Wifi Code'] = self.raw[277:293].strip(b'\x00').decode('utf-8')
-                self.config['Wifi Enable'] = ord(self.raw[180:181])
-                self.config['IP Address'] = self.raw[197:227].strip(b'').decode('utf-8')
-                self.config['IP Protocol'] = ord(self.raw[184:185])
-                self.config['IP Port'] = int.from_bytes(self.raw[185:187])
-
-                self.config['Remote Code'] = self.raw[477:484].strip(b'\x00').decode('utf-8')
-                self.config['PATH 1'] = self.raw[485:492].strip(b'\x00').decode('utf-8')
-                self.config['PATH 1 Hops'] = ord(self.raw[492:493])
-                self.config['PATH 2'] = self.raw[493:500].strip(b'\x00').decode('utf-8')
-                self.config['PATH 2 Hops'] = ord(self.raw[500:501])
-                self.config['DIGI 1'] = self.raw[501:508].strip(b'\x00').decode('utf-8')
-                self.config['DIGI 1 Enable'] = ord(self.raw[508:509])
-                self.config['DIGI 2'] = self.raw[509:516].strip(b'\x00').decode('utf-8')
-                self.config['DIGI 2 Enable'] = ord(self.raw[516:517])
-                self.config['DIGI Delay'] = ord(self.raw[474:475])
-                self.config['DIGI Channel'] = ord(self.raw[475:476])
-
-                self.config['Frequency 1'] = self.raw[135:143].decode('utf-8')
-                self.config['Frequency 2'] = self.raw[144:152].decode('utf-8')
-                self.config['Module Power'] = ord(self.raw[165:166])
-                self.config['Module Volume'] = ord(self.raw[166:167])
-                self.config['Module Mic'] = ord(self.raw[167:168])
-                self.config['Beep RX'] = ord(self.raw[51:52])
-                self.config['Beep TX'] = ord(self.raw[52:53])
-                self.config['Volume TX'] = ord(self.raw[472:473])
-                self.config['Volume RX'] = ord(self.raw[473:474])
-                self.config['Beacon Channel'] = ord(self.raw[475:476])
-                self.config['Auto Poweroff'] = ord(self.raw[169:170])
-
-                self.config['Last Position'] = ord(self.raw[307:308])
-                self.config['Six Knots'] = ord(self.raw[308:309])
-                self.config['Stop 30m Alarm'] = ord(self.raw[309:310])
-                self.config['Stop 60m Emergency'] = ord(self.raw[310:311])
-                self.config['Brightness'] = ord(self.raw[470:471])
-                self.config['Alert Enable'] = ord(self.raw[471:472])
-                self.config['Backlight Timeout'] = ord(self.raw[484:485])
-                self.config['Timezone Offset'] = ord(self.raw[49:50])
-
-                self.parsed = True
-            except UnicodeDecodeError as e:
-                print("Config didn't expand correctly:", e)
-                self.printRaw()
-                time.sleep(2)
-                self.parsed = False
+        # parse out all the bytes into their parts, using the layout table
+        try:
+            with METRICS.span('expand_config'):
+                self.config.load(self.model.codec.decode(self.raw))
+                self.original = bytes(self.raw)
+                self.image = bytearray(self.original)
+            self.parsed = True
+        except (UnicodeDecodeError, struct.error) as e:
+            # say which fields are bad rather than dumping the bytes
+            print("Config didn't expand correctly:", e)
+            for line in validate.describe(validate.checkImage(self.raw, self.model)): print("   ", line)
+            self.parsed = False
+            self.image = None
         return
 
+def finish(device):
+    # close the ports we kept open and say how much opening them cost
+    device.debug(POOL.report())  #debug print
+    POOL.closeAll()
+    if device.metricsFile: METRICS.dump(device.metricsFile)
+
+def parseSettings(items):
+    # --set KEY=VALUE arguments as a {name: value} dictionary, raising ValueError for a malformed one
+    settings = {}
+    for item in items:
+        name, sep, value = item.partition('=')
+        if not sep: raise ValueError("--set needs KEY=VALUE, got: "+item)
+        settings[name] = value
+    return settings
+
+def headless(device, args):
+    # load, change and save a config with no menus, prompts or delays; returns the exit code
+    device.headless = True
+    out = sys.stdout
+    if args.json_out == '-':
+        # keep stdout clean for the JSON
+        device.quietFlag = True
+        out = sys.stderr
+
+    if args.edit_device: ok = device.readSerialVersion() and device.readSerialDevice()
+    else: ok = device.readFile()
+    if not ok:
+        print("Can't read "+("device" if args.edit_device else "file")+"!", file=sys.stderr)
+        return 1
+    device.ExpandConfig()
+    if not device.parsed: return 1
+    old = dict(device.config)
+
+    settings = {}
+    if args.json_in:
+        try:
+            if args.json_in == '-': settings.update(json.load(sys.stdin))
+            else:
+                with open(args.json_in) as f:
+                    settings.update(json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            print("Can't load JSON:", e, file=sys.stderr)
+            return 2
+    try:
+        settings.update(parseSettings(args.set))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    errors = device.applySettings(settings)
+    if errors:
+        for error in errors: print("Invalid:", error, file=sys.stderr)
+        return 2
+
+    changes = device.diffConfig(old)
+    if args.dry_run or args.verbose:
+        ranges = {name: (start, end) for name, start, end in device.changes()}
+        for name, before, after in changes:
+            where = " [bytes "+str(ranges[name][0])+"-"+str(ranges[name][1] - 1)+"]" if name in ranges else " [no bytes change]"
+            print(name+": "+repr(before)+" -> "+repr(after)+where, file=out)
+        print(len(changes), "field(s) changed", file=out)
+
+    if args.json_out:
+        if args.json_out == '-':
+            json.dump(device.fields(), sys.stdout, indent=2)
+            print("")
+        else:
+            with open(args.json_out, 'w') as f:
+                json.dump(device.fields(), f, indent=2)
+
+    if args.dry_run or not changes: return 0
+    device.compressConfig()
+    if args.edit_device:
+        if args.check: ok = device.writeSerialDeviceChecked(not args.no_cache)
+        else: ok = device.writeSerialDevice()
+    else:
+        ok = device.writeFile()
+    return 0 if ok else 1
+
 def main():
 
     # create the device object
@@ -610,27 +1183,64 @@ def main():
     # get the command line arguments
     parser = argparse.ArgumentParser(description='A tool to read and write configuration to the X1C3 APRS device')
     parser.add_argument("-v", "--verbose", action='store_true')
-    parser.add_argument("-p", "--port", nargs='?', default='/dev/ttyUSB0', help = "Set the port")
+    parser.add_argument("-p", "--port", nargs='?', default='/dev/ttyUSB0', help = "Set the port, a serial device or tcp://host:port / udp://host:port")
     parser.add_argument("-f", "--file", nargs='?', default='settings.sav', help = "Set the file")
     parser.add_argument("-r", "--read", action='store_true', help = "Read the settings from the device into the file, non-interactive")
     parser.add_argument("-w", "--write", action='store_true', help = "Write the settings from the file to the device, non-interactive")
+    parser.add_argument("-c", "--check", action='store_true', help = "With --write: skip devices that already have the image, verify after writing")
+    parser.add_argument("--no_cache", action='store_true', help = "With --check: always read the device instead of using the image cache")
+    parser.add_argument("--no_history", action='store_true', help = "Don't record the images read, written or saved in the snapshot store (snapshots.py)")
     parser.add_argument("-ef", "--edit_file", action='store_true', help = "Load the file and parse it, go straight into edit menu")
     parser.add_argument("-ed", "--edit_device", action='store_true', help = "Load the device and parse it, go straight into edit menu")
+    parser.add_argument("--set", action='append', default=[], metavar='KEY=VALUE', help = "Change a field without the menus (repeatable), then save back to the file, or the device with -ed")
+    parser.add_argument("--json-in", dest='json_in', metavar='FILE', help = "Apply the fields in a JSON file ('-' for stdin), like --set")
+    parser.add_argument("--json-out", dest='json_out', metavar='FILE', help = "Write the whole config as JSON ('-' for stdout)")
+    parser.add_argument("--dry-run", dest='dry_run', action='store_true', help = "With --set/--json-in: show what would change, save nothing")
     parser.add_argument("--device_dump", action='store_true', help = "Read the settings from the device and dump to screen, non-interactive")
     parser.add_argument("--file_dump", action='store_true', help = "Read the settings from the device and dump to screen, non-interactive")
+    parser.add_argument("--model", help = "Device model for files ("+', '.join(m.name for m in layout.MODELS)+"), devices are detected from their firmware")
+    parser.add_argument("--no_validate", action='store_true', help = "Write images even if they fail the validation checks")
+    parser.add_argument("--strict", action='store_true', help = "Refuse values and images that break the syntax and range rules too, not just the layout")
+    parser.add_argument("--tune", action='store_true', help = "Find the fastest reliable write chunk size/gap for the port (rewrites the device's own config)")
+    parser.add_argument("--chunk", type=int, help = "Bytes per chunk when writing, overrides --tune's result")
+    parser.add_argument("--gap", type=float, help = "Extra seconds between write chunks, overrides --tune's result")
+    parser.add_argument("--metrics", metavar='FILE', help = "On exit, write timings and counters to FILE (JSON, or Prometheus text for .prom)")
 
     args = parser.parse_args()
 
     device.setFile(args.file)
     device.setPort(args.port)
     device.debugFlag = args.verbose
+    device.metricsFile = args.metrics
+    if args.model and not device.setModel(args.model): sys.exit(2)
+    device.writeChunk = args.chunk
+    device.validateFlag = not args.no_validate
+    device.strictFlag = args.strict
+    if args.no_history: device.history = None
+    device.writeGap = args.gap
+    device.progress = showProgress
 
     device.debug("Using file: "+str(args.file))  #debug print
     device.debug("Using port: "+str(args.port))  #debug print
     device.debug("Read: "+str(args.read))        #debug print
     device.debug("Write: "+str(args.write))      #debug print
 
+    # scripted editing, no menus at all
+    if args.set or args.json_in or args.json_out:
+        code = headless(device, args)
+        finish(device)
+        sys.exit(code)
+
     action = ''
+    if args.tune:
+        results = device.tuneWrite()
+        if not results: print("Can't read device!")
+        for chunk, gap, rate in results:
+            print(f"chunk {chunk:4d}  gap {gap:.3f}s  " + (format(rate, '.0f') + " bytes/s" if rate else "failed"))
+        if results and results[-1][2]: print("Using", results[-1][0], "byte chunks for", device.getPort())
+        finish(device)
+        sys.exit(0 if results and results[-1][2] else 1)
+
     # if the user passed args to read or write the config non-interactivly, just do that and exit
     # but first test that we can read the version from the device!
     if args.read:
@@ -640,15 +1250,21 @@ def main():
             action = 'q'       # exit the program
         else:
             print("Failed to connect to device!")
+        finish(device)
         sys.exit()
 
     # command line only to read config from file and write to device
     if args.write:
         if device.readSerialVersion():
             device.readFile()    # read the config from file
-            device.writeSerialDevice() # write the config to device
+            if args.check:
+                result = device.writeSerialDeviceChecked(not args.no_cache)
+                print("Write result:", result if result else "failed")
+            else:
+                device.writeSerialDevice() # write the config to device
         else:
             print("Failed to connect to device!")
+        finish(device)
         sys.exit()
 
     # read the device, print it, and exit
@@ -657,6 +1273,7 @@ def main():
             print('bytes read=',len(device.raw))
             device.printRaw()
         else: print("Can't read device!")
+        finish(device)
         sys.exit()
 
     # read the file, print it, and exit
@@ -665,6 +1282,7 @@ def main():
             print('bytes read=',len(device.raw))
             device.printRaw()
         else: print("Can't read file!")
+        finish(device)
         sys.exit()
 
     # Open a device, the parse it autmoatically before going to the main menu
@@ -694,7 +1312,7 @@ def main():
                 device.ExpandConfig()
             else:
                 print("Failed to connect to device!")
-                time.sleep(2)
+                device.pause(2)
 
         if action == '1':   #write device
             if device.hasConfig():
@@ -703,7 +1321,7 @@ def main():
                 print("Written!")
             else:
                 print("No Config loaded!")
-            time.sleep(2)
+            device.pause(2)
 
         if action == '2':   #read file
             if device.readFile():
@@ -712,7 +1330,7 @@ def main():
                 print("File read!")
             else:
                 print("Could not read file!")
-            time.sleep(2)
+            device.pause(2)
 
         if action == '3':   #write file
             if device.hasConfig():
@@ -722,15 +1340,24 @@ def main():
                 print("Written!")
             else:
                 print("No Config loaded!")
-            time.sleep(2)
+            device.pause(2)
 
         if action == '4':   #set the port
+            # offer what discover.py found, a number picks one of those
+            found = DISCOVERED.load()
+            ports = sorted(found)
+            for i, port in enumerate(ports):
+                print(i, '-', port, found[port].get('version', ''), found[port].get('callsign', ''))
             response = input("Port:"+device.getPort())
+            if response == '':
+                response = device.getPort()
+            elif response.isdigit() and int(response) < len(ports):
+                response = ports[int(response)]
             if not device.setPort(response):
                 # invalid port
                 device.setPort("Invalid")
                 print("Invalid port!")
-                time.sleep(2)
+                device.pause(2)
 
         if action == '5':   #set the file
             response = input("File:"+device.getFile())
@@ -738,27 +1365,28 @@ def main():
                 # invalid file
                 device.setFile("Invalid")
                 print("Invalid file!")
-                time.sleep(2)
+                device.pause(2)
 
         if action == '6':   #edit menu
             if device.hasConfig():
                 device.editMenu()
             else:
                 print("No Config loaded!")
-                time.sleep(2)
+                device.pause(2)
 
         if action == '7':   #print config
             if device.hasConfig():
                 device.printConfig()
             else:
                 print("No Config loaded!")
-                time.sleep(2)
+                device.pause(2)
 
         if action == "q": break
         action = ''   #reset the next action
     # end of menu while
 
     device.debug("End of program")  #debug print
+    finish(device)
     print("")
 
 
@@ -0,0 +1,125 @@
+import argparse
+import os
+import sys
+import numpy as np
+import layout
+import archive
+
+##########
+#
+# Fleet analytics on NumPy structured arrays
+#
+# N images are loaded into one structured array whose dtype is generated
+# from the layout table: numbers become u1/>u2 columns and text fields
+# become (width,) byte arrays. Loading is a straight copy of the raw bytes
+# (or no copy at all, for archives), so audits over a whole fleet are
+# vectorized NumPy expressions instead of Python loops over dictionaries.
+#
+##########
+
+def imageDtype(codec=layout.CODEC, before=0, after=0):
+    # the structured dtype for one image, optionally inside a bigger record
+    names, formats, offsets = [], [], []
+    for name in codec.names:
+        start, width, kind, pad, options = codec.info[name]
+        names.append(name)
+        if kind == layout.U8: formats.append('u1')
+        elif kind == layout.U16: formats.append('>u2')
+        else: formats.append(('u1', (width,)))
+        offsets.append(before + start)
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                     'itemsize': before + codec.size + after})
+
+DTYPE = imageDtype()
+
+def fromBytes(data):
+    # images packed back to back in one bytes-like object, no copy
+    return np.frombuffer(data, dtype=DTYPE)
+
+def fromFiles(paths):
+    # read every file straight into its slot of a preallocated array
+    images = np.zeros(len(paths), dtype=DTYPE)
+    rows = images.view(np.uint8).reshape(len(paths), layout.IMAGE_SIZE)
+    good = np.ones(len(paths), dtype=bool)
+    for i, path in enumerate(paths):
+        with open(path, 'rb') as f:
+            if f.readinto(rows[i]) != layout.IMAGE_SIZE: good[i] = False
+    return images[good]
+
+def fromArchive(arc):
+    # a zero copy array over an open archive's records (metadata is skipped)
+    if len(arc) == 0: return np.zeros(0, dtype=DTYPE)
+    dtype = imageDtype(before=arc.metaSize)
+    return np.ndarray(shape=(len(arc),), dtype=dtype, buffer=arc.map, offset=archive.HEADER.size)
+
+def text(images, name):
+    # a text field as (n, width) bytes with everything from the first 0x00 on cleared,
+    # and the padding before it, like layout.decodeStr: a pad byte inside the text stays
+    data = np.array(images[name], dtype=np.uint8)
+    data[np.cumsum(data == 0, axis=1) > 0] = 0
+    pad = layout.CODEC.info[name][3]
+    if pad != b'\x00':
+        # the trailing run of pad (or already cleared) bytes: true from some column to the end
+        blank = (data == pad[0]) | (data == 0)
+        data[np.flip(np.cumprod(np.flip(blank, axis=1), axis=1), axis=1).astype(bool)] = 0
+    return data
+
+def asStr(row):
+    return bytes(row).split(b'\x00', 1)[0].decode('utf-8', 'replace')
+
+
+########## Audits
+def beaconHistogram(images):
+    # beacon interval (Time Value) -> number of units
+    values, counts = np.unique(images['Time Value'], return_counts=True)
+    return dict(zip(values.tolist(), counts.tolist()))
+
+def ssidCollisions(images):
+    # (callsign, ssid) pairs used by more than one unit, with the count
+    keys = np.zeros((len(images), 8), dtype=np.uint8)
+    keys[:, :7] = text(images, 'CALLSIGN')
+    keys[:, 7] = images['SSID']
+    keys = np.ascontiguousarray(keys).view('V8').ravel()
+    values, counts = np.unique(keys, return_counts=True)
+    found = []
+    for value, count in zip(values[counts > 1], counts[counts > 1]):
+        raw = bytes(value)
+        found.append((asStr(raw[:7]), raw[7], int(count)))
+    return found
+
+def wifiWithoutName(images):
+    # indices of units with WiFi enabled but no WiFi name set
+    name = text(images, 'Wifi Name')
+    return np.nonzero((images['Wifi Enable'] == 1) & (name[:, 0] == 0))[0]
+
+def report(images):
+    print("Units:", len(images))
+    print("Beacon intervals (Time Value: units):")
+    for value, count in beaconHistogram(images).items():
+        print("  ", value, ":", count)
+    collisions = ssidCollisions(images)
+    print("Callsign/SSID collisions:", len(collisions))
+    for call, ssid, count in collisions[:20]:
+        print("  ", call + '-' + str(ssid), "used by", count, "units")
+    print("WiFi enabled without a WiFi name:", len(wifiWithoutName(images)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Vectorized audits over many X1C3 config images')
+    parser.add_argument("files", nargs='*', help = "Image files")
+    parser.add_argument("-a", "--archive", help = "Read the images from an archive instead")
+    args = parser.parse_args()
+
+    if args.archive:
+        with archive.archive(args.archive) as arc:
+            images = fromArchive(arc)
+            report(images)
+            del images          # the array must go before the archive's mmap closes
+    elif args.files:
+        report(fromFiles([f for f in args.files if os.path.isfile(f)]))
+    else:
+        parser.print_usage()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
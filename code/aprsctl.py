@@ -0,0 +1,93 @@
+import argparse
+import http.client
+import json
+import sys
+import urllib.parse
+
+##########
+#
+# Thin client for daemon.py
+#
+# Only the standard library, so a field query costs a Python start and one
+# localhost request rather than a pyserial import, a port open and a serial
+# read.
+#
+#   aprsctl.py get CALLSIGN
+#   aprsctl.py -p /dev/ttyUSB1 set CALLSIGN=N0CALL SSID=9
+#   aprsctl.py read > config.json
+#   aprsctl.py image -o backup.sav
+#   aprsctl.py write backup.sav
+#   aprsctl.py devices
+#
+##########
+
+DEFAULT_SERVER = '127.0.0.1:8517'
+
+def request(server, method, path, params=None, body=None):
+    # one request to the daemon, returns (status, content type, body bytes)
+    host, sep, port = server.rpartition(':')
+    query = urllib.parse.urlencode({k: v for k, v in (params or {}).items() if v is not None})
+    conn = http.client.HTTPConnection(host or '127.0.0.1', int(port), timeout=120)
+    try:
+        conn.request(method, path + ('?' + query if query else ''), body=body)
+        response = conn.getresponse()
+        return response.status, response.getheader('Content-Type', ''), response.read()
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Talk to the X1C3 daemon')
+    parser.add_argument("-s", "--server", default=DEFAULT_SERVER, metavar='HOST:PORT', help = "Where daemon.py is listening")
+    parser.add_argument("-p", "--port", help = "Device port, needed when the daemon has more than one")
+    parser.add_argument("-r", "--refresh", action='store_true', help = "Read the device instead of using the daemon's copy")
+    parser.add_argument("-o", "--output", help = "With image: save to this file instead of stdout")
+    parser.add_argument("command", choices=['devices','read','get','set','image','write','metrics'])
+    parser.add_argument("args", nargs='*', help = "get: field names; set: KEY=VALUE pairs; write: image file")
+    args = parser.parse_args()
+
+    params = {'port': args.port, 'refresh': '1' if args.refresh else None}
+    try:
+        if args.command == 'get':
+            if not args.args: parser.error("get needs a field name")
+            for name in args.args:
+                status, kind, data = request(args.server, 'GET', '/get', dict(params, name=name))
+                if status != 200: break
+                print(json.loads(data)['value'] if len(args.args) == 1 else name + ' = ' + str(json.loads(data)['value']))
+            if status == 200: return
+        elif args.command == 'set':
+            settings = {}
+            for item in args.args:
+                key, sep, value = item.partition('=')
+                if not sep: parser.error("Expected KEY=VALUE, got '" + item + "'")
+                settings[key.strip()] = value
+            status, kind, data = request(args.server, 'POST', '/set', {'port': args.port}, json.dumps(settings).encode('utf-8'))
+        elif args.command == 'write':
+            if len(args.args) != 1: parser.error("write needs an image file")
+            with open(args.args[0], 'rb') as f:
+                status, kind, data = request(args.server, 'POST', '/write', {'port': args.port}, f.read())
+        elif args.command == 'metrics':
+            status, kind, data = request(args.server, 'GET', '/metrics')
+        else:
+            status, kind, data = request(args.server, 'GET', '/' + args.command, params)
+    except (OSError, http.client.HTTPException) as e:
+        print("Can't reach the daemon at " + args.server + ":", e, file=sys.stderr)
+        sys.exit(2)
+
+    if status != 200:
+        try: message = json.loads(data)['error']
+        except (ValueError, KeyError): message = data.decode('utf-8', 'replace')
+        print("Error:", message, file=sys.stderr)
+        sys.exit(1)
+    if args.command == 'image':
+        if args.output:
+            with open(args.output, 'wb') as f: f.write(data)
+        else:
+            sys.stdout.buffer.write(data)
+    elif kind.startswith('application/json'):
+        print(json.dumps(json.loads(data), indent=2))
+    else:
+        sys.stdout.write(data.decode('utf-8'))
+
+
+if __name__ == "__main__":
+    main()
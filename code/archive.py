@@ -0,0 +1,210 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+import layout
+
+##########
+#
+# Packed archive of fixed size config images
+#
+# File layout:
+#   header  32 bytes: magic 'X1C3ARCH', version, record size, metadata size, count
+#   records count * (metadata size + 517 bytes)
+#
+# The file is read through mmap and records are handed out as memoryview
+# slices, so reading one field of record k touches only those bytes and
+# the memory footprint stays flat however many images the archive holds.
+#
+##########
+
+MAGIC = b'X1C3ARCH'
+VERSION = 1
+HEADER = struct.Struct('<8sHHHxxQ8x')   # magic, version, image size, metadata size, count
+META = struct.Struct('<d56s')           # the default metadata: time added, source name
+META_SIZE = META.size
+
+def packMeta(source='', added=None):
+    # default per-record metadata
+    if added is None: added = time.time()
+    return META.pack(added, source.encode('utf-8')[:56])
+
+def unpackMeta(data):
+    added, source = META.unpack(bytes(data))
+    return added, source.rstrip(b'\x00').decode('utf-8', 'replace')
+
+class archiveError(Exception):
+    pass
+
+class archive:
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        self.file = open(path, 'r+b' if writable else 'rb')
+        header = self.file.read(HEADER.size)
+        if len(header) != HEADER.size: raise archiveError(path + " is not an archive")
+        magic, version, size, metaSize, count = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION: raise archiveError(path + " is not an archive")
+        if size != layout.IMAGE_SIZE: raise archiveError(path + " holds " + str(size) + " byte images")
+        self.metaSize = metaSize
+        self.recordSize = metaSize + size
+        self.count = count
+        self.map = None
+        self.view = None
+        self.retired = []       # earlier maps that image()/config() views still point into
+        self.remap()
+
+    @classmethod
+    def create(cls, path, meta=True):
+        # start an empty archive, with or without per-record metadata
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, layout.IMAGE_SIZE, META_SIZE if meta else 0, 0))
+        return cls(path, writable=True)
+
+    def retire(self):
+        # let go of the current map; one that records handed out still point into is kept until they are gone
+        if self.map is not None: self.retired.append((self.map, self.view))
+        self.map = self.view = None
+        kept = []
+        for m, view in self.retired:
+            try:
+                if view is not None: view.release()
+                if self.writable: m.flush()
+                m.close()
+            except BufferError:
+                kept.append((m, view))
+        self.retired = kept
+
+    def remap(self):
+        # (re)map the file after it has grown
+        self.retire()
+        if self.count == 0: return
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+        self.map = mmap.mmap(self.file.fileno(), HEADER.size + self.count * self.recordSize, access=access)
+        self.view = memoryview(self.map)
+
+    def close(self):
+        # maps still in use elsewhere are closed when the last view of them goes
+        self.retire()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def offset(self, k):
+        # where record k's image starts in the file
+        if k < 0: k += self.count
+        if not 0 <= k < self.count: raise IndexError("record " + str(k) + " out of range")
+        return HEADER.size + k * self.recordSize + self.metaSize
+
+    def image(self, k):
+        # record k's image as a zero copy memoryview
+        start = self.offset(k)
+        return self.view[start:start + layout.IMAGE_SIZE]
+
+    def meta(self, k):
+        # record k's metadata as (time added, source), or None without metadata
+        if not self.metaSize: return None
+        start = self.offset(k)
+        return unpackMeta(self.view[start - self.metaSize:start])
+
+    def field(self, k, name):
+        # decode a single field of record k without touching the rest of it
+        return layout.CODEC.decodeField(self.view, name, self.offset(k))
+
+    def config(self, k):
+        # a lazy, dictionary-like view of record k, writable if the archive is
+        return layout.configView(self.image(k))
+
+    def patch(self, k, name, value):
+        # rewrite a single field of record k in place
+        if not self.writable: raise archiveError("archive is open read-only")
+        return layout.CODEC.encodeField(self.view, name, value, self.offset(k))
+
+    def append(self, images, sources=None):
+        # add images (any bytes-like, 517 bytes each) to the end, returns the new count
+        if not self.writable: raise archiveError("archive is open read-only")
+        self.file.seek(HEADER.size + self.count * self.recordSize)
+        added = 0
+        now = time.time()
+        for i, image in enumerate(images):
+            if len(image) != layout.IMAGE_SIZE: raise archiveError("image " + str(i) + " is " + str(len(image)) + " bytes")
+            if self.metaSize: self.file.write(packMeta(sources[i] if sources else '', now))
+            self.file.write(image)
+            added += 1
+        self.count += added
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, layout.IMAGE_SIZE, self.metaSize, self.count))
+        self.file.flush()
+        self.remap()
+        return self.count
+
+    def __iter__(self):
+        for k in range(self.count):
+            yield self.image(k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Packed archives of X1C3 config images')
+    parser.add_argument("archive", help = "Archive file")
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help = "Append image files, creating the archive if needed")
+    add.add_argument("files", nargs='+')
+    add.add_argument("--no_meta", action='store_true', help = "Don't keep per-record metadata (new archives only)")
+    sub.add_parser('list', help = "List the records")
+    get = sub.add_parser('get', help = "Print one field of one record")
+    get.add_argument("record", type=int)
+    get.add_argument("field")
+    put = sub.add_parser('patch', help = "Change one field of one record in place")
+    put.add_argument("record", type=int)
+    put.add_argument("setting", help = "FIELD=VALUE")
+    out = sub.add_parser('extract', help = "Write one record out as a .sav file")
+    out.add_argument("record", type=int)
+    out.add_argument("file")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'add':
+            if os.path.exists(args.archive): arc = archive(args.archive, writable=True)
+            else: arc = archive.create(args.archive, meta=not args.no_meta)
+            with arc:
+                images = []
+                sources = []
+                for name in args.files:
+                    with open(name, 'rb') as f:
+                        images.append(f.read())
+                    sources.append(os.path.basename(name))
+                print(arc.append(images, sources), "record(s)")
+        elif args.command == 'list':
+            with archive(args.archive) as arc:
+                for k in range(len(arc)):
+                    meta = arc.meta(k)
+                    source = meta[1] if meta else ''
+                    config = arc.config(k)
+                    print(k, layout.callsign(config), source)
+        elif args.command == 'get':
+            with archive(args.archive) as arc:
+                print(arc.field(args.record, args.field))
+        elif args.command == 'patch':
+            name, sep, value = args.setting.partition('=')
+            with archive(args.archive, writable=True) as arc:
+                arc.patch(args.record, name.strip(), layout.parseValue(name.strip(), value))
+        elif args.command == 'extract':
+            with archive(args.archive) as arc:
+                with open(args.file, 'wb') as f:
+                    f.write(arc.image(args.record))
+    except (archiveError, IndexError, KeyError, OSError, ValueError, struct.error) as e:
+        print("Error:", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import layout
+from APRStool import x1c3, POOL
+
+##########
+#
+# Benchmark suite
+#
+#   codec    ExpandConfig/compressConfig on settings.sav and synthetic images
+#   files    readFile/writeFile over a large batch of image files
+#   serial   whole read/write cycles against simulated devices paced at 9600 baud
+#   analytics  dict loop versus NumPy for fleet audits (needs numpy)
+#
+# --json writes the results with the commit they were taken on, and
+# --compare checks them against an earlier run, so a slowdown in the codec
+# or the I/O paths shows up as soon as it lands:
+#
+#   python benchmark.py --json before.json
+#   ... change things ...
+#   python benchmark.py --compare before.json
+#
+##########
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLE = os.path.join(HERE, 'settings.sav')
+
+def timeit(func, count, repeat=3):
+    # run func count times, best of repeat, and return the per-call cost in microseconds
+    best = None
+    for r in range(repeat):
+        start = time.perf_counter()
+        for x in range(count):
+            func()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best: best = seconds
+    return best / count * 1e6
+
+def loadSample():
+    with open(SAMPLE, 'rb') as f:
+        return f.read()
+
+def synthetic(count, seed=1):
+    # count varied images built from the bundled settings.sav, packed back to back
+    rand = random.Random(seed)
+    config = layout.CODEC.decode(loadSample())
+    data = bytearray(count * layout.IMAGE_SIZE)
+    for i in range(count):
+        config['CALLSIGN'] = 'K' + str(rand.randrange(10000)) + 'X'
+        config['SSID'] = rand.randrange(16)
+        config['Time Value'] = rand.choice((60, 120, 300, 600, 1800))
+        config['Wifi Enable'] = rand.randrange(2)
+        config['Wifi Name'] = rand.choice(('', 'club'))
+        layout.CODEC.encode(config, memoryview(data)[i * layout.IMAGE_SIZE:(i + 1) * layout.IMAGE_SIZE])
+    return bytes(data)
+
+def split(data):
+    size = layout.IMAGE_SIZE
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+########## Codec
+def benchCodec(count, images=1000):
+    # time the decode/encode paths on the bundled settings.sav and on varied synthetic images
+    raw = loadSample()
+    device = x1c3()
+    device.raw = raw
+    device.ExpandConfig()
+    config = dict(device.config)
+    buf = bytearray(layout.IMAGE_SIZE)
+
+    results = {}
+    results['ExpandConfig'] = (timeit(device.ExpandConfig, count), 'us/image')
+    # compressConfig only encodes what was edited, so edit a field before every call
+    ssids = [1, 2]
+    def editOne():
+        ssids.reverse()
+        device.config['SSID'] = ssids[0]
+        device.compressConfig()
+    def encodeAll():
+        device.image = None     # no image to patch: the whole config is encoded
+        device.compressConfig()
+    results['compressConfig (one edit)'] = (timeit(editOne, count), 'us/image')
+    results['compressConfig (full encode)'] = (timeit(encodeAll, count), 'us/image')
+    results['codec.decode'] = (timeit(lambda: layout.CODEC.decode(raw), count), 'us/image')
+    results['codec.encode (reused buffer)'] = (timeit(lambda: layout.CODEC.encode(config, buf), count), 'us/image')
+
+    # synthetic images, so the strings and enums aren't the same every call
+    batch = split(synthetic(images))
+    def expandAll():
+        for image in batch:
+            device.raw = image
+            device.ExpandConfig()
+    def roundTrip():
+        for image in batch:
+            device.raw = image
+            device.ExpandConfig()
+            device.config['SSID'] = 5
+            device.compressConfig()
+    passes = max(1, count // images)
+    results['ExpandConfig (synthetic)'] = (timeit(expandAll, passes) / len(batch), 'us/image')
+    results['Expand+compress (synthetic)'] = (timeit(roundTrip, passes) / len(batch), 'us/image')
+    return results
+
+
+########## Files
+def benchFiles(count):
+    # write then read back count image files through x1c3.writeFile/readFile
+    batch = split(synthetic(count))
+    directory = tempfile.mkdtemp(prefix='aprstool-bench-')
+    device = x1c3()
+    device.history = None       # not the user's snapshot history
+    names = [os.path.join(directory, str(i) + '.sav') for i in range(count)]
+    try:
+        start = time.perf_counter()
+        for name, image in zip(names, batch):
+            device.setFile(name)
+            device.raw = image
+            device.writeFile()
+        written = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for name, image in zip(names, batch):
+            device.setFile(name)
+            device.readFile()
+            device.ExpandConfig()
+        read = time.perf_counter() - start
+        if device.raw != batch[-1]: print("WARNING: file read back differs")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {'writeFile (' + str(count) + ' files)': (written / count * 1e6, 'us/file'),
+            'readFile+ExpandConfig (' + str(count) + ' files)': (read / count * 1e6, 'us/file')}
+
+
+########## Serial round trips
+def benchSerial(cycles, pace=True):
+    # full version+read and write+verify cycles against a simulated device on a pty
+    import simulator
+    raw = loadSample()
+    results = {}
+    with simulator.simulator() as sim:
+        port = sim.add(raw, pace=pace).port
+        device = x1c3()
+        device.setPort(port)
+        device.quietFlag = True
+        device.progress = None
+        device.history = None
+        label = ' (9600 baud)' if pace else ' (unpaced)'
+
+        reads = []
+        for x in range(cycles):
+            start = time.perf_counter()
+            ok = device.readSerialVersion() and device.readSerialDevice()
+            reads.append(time.perf_counter() - start)
+            if not ok: print("WARNING: simulated read failed:", device.lastError)
+
+        writes = []
+        for x in range(cycles):
+            device.raw = raw
+            start = time.perf_counter()
+            ok = device.writeSerialDevice() and device.readSerialDevice() and device.raw == raw
+            writes.append(time.perf_counter() - start)
+            if not ok: print("WARNING: simulated write/verify failed:", device.lastError)
+
+        results['read cycle' + label] = (min(reads) * 1000, 'ms/cycle')
+        results['write+verify cycle' + label] = (min(writes) * 1000, 'ms/cycle')
+        results['read throughput' + label] = (layout.IMAGE_SIZE / min(reads), 'bytes/s')
+        POOL.closeAll()
+    return results
+
+
+########## Analytics
+def benchAnalytics(count):
+    # fleet audits: per-image dict decode loop versus one NumPy structured array
+    try:
+        import analytics
+    except ImportError:
+        return {}
+    data = synthetic(count)
+    size = layout.IMAGE_SIZE
+
+    def loop():
+        times = {}
+        seen = {}
+        wifi = 0
+        for i in range(count):
+            config = layout.CODEC.decode(data[i * size:(i + 1) * size])
+            times[config['Time Value']] = times.get(config['Time Value'], 0) + 1
+            key = (config['CALLSIGN'], config['SSID'])
+            seen[key] = seen.get(key, 0) + 1
+            if config['Wifi Enable'] == 1 and config['Wifi Name'] == '': wifi += 1
+        return times, [k for k, v in seen.items() if v > 1], wifi
+
+    def vectorized():
+        images = analytics.fromBytes(data)
+        return analytics.beaconHistogram(images), analytics.ssidCollisions(images), len(analytics.wifiWithoutName(images))
+
+    results = {}
+    start = time.perf_counter()
+    slow = loop()
+    results['audit, dict loop (' + str(count) + ' images)'] = ((time.perf_counter() - start) * 1e6 / count, 'us/image')
+    start = time.perf_counter()
+    fast = vectorized()
+    results['audit, numpy (' + str(count) + ' images)'] = ((time.perf_counter() - start) * 1e6 / count, 'us/image')
+    if slow[0] != fast[0] or len(slow[1]) != len(fast[1]) or slow[2] != fast[2]:
+        print("WARNING: numpy and dict audits disagree")
+    return results
+
+
+########## Saving and comparing runs
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+def saveResults(name, results):
+    data = {'commit': commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'results': {k: {'value': v, 'unit': u} for k, (v, u) in results.items()}}
+    with open(name, 'w') as f:
+        json.dump(data, f, indent=2)
+
+def compareResults(name, results, threshold):
+    # print old versus new for every benchmark in both runs, return the regressions
+    with open(name) as f:
+        old = json.load(f)
+    print("--------------------------------")
+    print("Compared with " + name + " (commit " + (old.get('commit') or '?') + ")")
+    regressions = []
+    for key, (value, unit) in results.items():
+        if key not in old['results']: continue
+        before = old['results'][key]['value']
+        if not before: continue
+        # throughput is better when higher, everything else when lower
+        change = (value - before) / before
+        worse = -change if unit.endswith('/s') else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print(f"{key:44s} {before:10.2f} -> {value:10.2f} {unit:9s} {change * 100:+6.1f}%{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the X1C3 config tool')
+    parser.add_argument("-n", "--count", type=int, default=20000, help = "Iterations per codec benchmark")
+    parser.add_argument("--images", type=int, default=100000, help = "Synthetic images for the analytics benchmark")
+    parser.add_argument("--files", type=int, default=5000, help = "Files for the readFile/writeFile benchmark")
+    parser.add_argument("--cycles", type=int, default=3, help = "Serial read/write cycles (each takes about a second at 9600 baud)")
+    parser.add_argument("--only", action='append', choices=['codec','files','serial','analytics'], help = "Run just these parts (repeatable)")
+    parser.add_argument("--json", metavar='FILE', help = "Save the results as JSON")
+    parser.add_argument("--compare", metavar='FILE', help = "Compare with results saved by --json, exit 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=10.0, help = "Percent slowdown counted as a regression")
+    args = parser.parse_args()
+
+    parts = args.only or ['codec', 'files', 'serial', 'analytics']
+    results = {}
+    if 'codec' in parts: results.update(benchCodec(args.count))
+    if 'files' in parts: results.update(benchFiles(args.files))
+    if 'serial' in parts and args.cycles > 0: results.update(benchSerial(args.cycles))
+    if 'analytics' in parts: results.update(benchAnalytics(args.images))
+    for name, (value, unit) in results.items():
+        print(f"{name:44s} {value:10.2f} {unit}")
+
+    if args.json: saveResults(args.json, results)
+    if args.compare and compareResults(args.compare, results, args.threshold / 100):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
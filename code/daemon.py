@@ -0,0 +1,305 @@
+import argparse
+import http.server
+import json
+import queue
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import layout
+import validate
+from APRStool import x1c3, POOL
+from fleet import expandPorts
+from metrics import METRICS
+
+##########
+#
+# Daemon: keep the device ports open behind a localhost HTTP API
+#
+# Each configured port gets one worker thread with its own request queue and
+# x1c3 object, so its serial session stays open and the last image and
+# version read from it are kept in memory. Requests for the same port run one
+# at a time in arrival order; different ports run in parallel. Reads are
+# answered from memory unless refresh=1 is given or the image is older than
+# --max_age.
+#
+#   GET  /devices                               every port and what is known about it
+#   GET  /read?port=P[&refresh=1]               version, voltage and the whole config
+#   GET  /image?port=P[&refresh=1]              the raw 517 byte image
+#   GET  /get?port=P&name=N[&refresh=1]         one field
+#   POST /set?port=P[&name=N&value=V]           change fields (or a JSON object body) and write
+#   POST /write?port=P                          write a raw image (the request body)
+#   GET  /metrics, /metrics.json                timings, see metrics.py
+#
+# The port can be left out when only one is configured. aprsctl.py is a
+# client that doesn't import pyserial, so it starts in milliseconds.
+#
+##########
+
+DEFAULT_PORT = 8517
+
+class daemonError(Exception):
+    def __init__(self, message, code=500):
+        Exception.__init__(self, message)
+        self.code = code
+
+class portWorker:
+    # one device: a queue of requests and a thread that works through them
+    def __init__(self, port, maxAge=0, verify=True, debug=False):
+        self.device = x1c3()
+        self.device.setPort(port)
+        self.device.quietFlag = True
+        self.device.headless = True
+        self.device.debugFlag = debug
+        self.maxAge = maxAge        # seconds a cached image is good for, 0 is forever
+        self.verify = verify
+        self.loaded = 0.0           # when the image in memory was read, 0 if there isn't one
+        self.requests = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None: return
+            future, func, args = job
+            if not future.set_running_or_notify_cancel(): continue
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def call(self, func, *args, timeout=60):
+        # queue func(*args) behind whatever this port is already doing and wait for it
+        future = Future()
+        self.requests += 1
+        METRICS.inc('daemon_requests_total', port=self.device.port)
+        self.queue.put((future, func, args))
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            future.cancel()     # if it is still queued it won't run at all
+            METRICS.inc('daemon_timeouts_total', port=self.device.port)
+            raise daemonError(self.device.port + " didn't finish the request within " + str(timeout) + "s", 504)
+
+    def stop(self):
+        self.queue.put(None)
+
+    ########## These run on the worker thread
+    def failed(self, what):
+        return daemonError(what + " failed on " + self.device.port
+                           + (": " + self.device.lastError if self.device.lastError else ""), 502)
+
+    def version(self, refresh=False):
+        if refresh or not self.device.version:
+            if not self.device.readSerialVersion(): raise self.failed("Version read")
+        return self.device.version
+
+    def image(self, refresh=False):
+        stale = self.maxAge and time.monotonic() - self.loaded > self.maxAge
+        if refresh or stale or not self.loaded:
+            self.version(refresh)
+            if not self.device.readSerialDevice():
+                self.loaded = 0.0
+                raise self.failed("Read")
+            self.device.ExpandConfig()
+            if not self.device.parsed:
+                self.loaded = 0.0
+                raise daemonError("Image from " + self.device.port + " didn't parse", 502)
+            self.loaded = time.monotonic()
+            METRICS.inc('daemon_device_reads_total', port=self.device.port)
+        else:
+            METRICS.inc('daemon_cache_hits_total', port=self.device.port)
+        return bytes(self.device.raw)
+
+    def info(self):
+        return {'port': self.device.port, 'version': self.device.version, 'voltage': self.device.voltage,
+                'model': self.device.model.name,
+                'cached': bool(self.loaded),
+                'age': round(time.monotonic() - self.loaded, 1) if self.loaded else None,
+                'queued': self.queue.qsize(), 'requests': self.requests}
+
+    def read(self, refresh=False):
+        self.image(refresh)
+        return dict(self.info(), config=self.device.fields())
+
+    def get(self, name, refresh=False):
+        self.image(refresh)
+        if not self.device.model.supports(name):
+            raise daemonError("No field '" + name + "' on " + self.device.model.name, 404)
+        return {'name': name, 'value': self.device.config[name]}
+
+    def set(self, settings):
+        # change some fields in the cached image and write it, if anything changed
+        self.image()
+        old = dict(self.device.config)
+        errors = self.device.applySettings(settings)
+        if errors: raise daemonError('; '.join(errors), 400)
+        changes = self.device.diffConfig(old)
+        if changes:
+            self.device.compressConfig()
+            self.store()
+        return {'port': self.device.port, 'changes': [{'name': k, 'old': a, 'new': b} for k, a, b in changes]}
+
+    def write(self, image):
+        if len(image) != layout.IMAGE_SIZE or not image.startswith(layout.HEADER):
+            raise daemonError("An image is " + str(layout.IMAGE_SIZE) + " bytes starting with " + layout.HEADER.decode(), 400)
+        self.version()
+        errors = validate.checkImage(image, self.device.model)
+        if errors: raise daemonError('; '.join(validate.describe(errors)), 400)
+        self.device.raw = bytes(image)
+        self.store()
+        self.device.ExpandConfig()
+        return {'port': self.device.port, 'written': True}
+
+    def store(self):
+        # write self.device.raw, skipping it if the device already has it
+        result = self.device.writeSerialDeviceChecked(True, self.verify)
+        if not result:
+            self.loaded = 0.0       # don't trust what's in memory any more
+            raise self.failed("Write")
+        self.loaded = time.monotonic()
+        METRICS.inc('daemon_writes_total', port=self.device.port, result=result)
+
+
+class daemon:
+    def __init__(self, ports, maxAge=0, verify=True, debug=False):
+        self.workers = {port: portWorker(port, maxAge, verify, debug) for port in ports}
+        self.server = None
+
+    def worker(self, port):
+        if port is None:
+            if len(self.workers) != 1: raise daemonError("Say which port, one of: " + ', '.join(self.workers), 400)
+            return next(iter(self.workers.values()))
+        if port not in self.workers: raise daemonError("Not a configured port: " + port, 404)
+        return self.workers[port]
+
+    def preload(self):
+        # read every device once, in parallel, so the first requests are answered from memory
+        waits = []
+        for w in self.workers.values():
+            future = Future()
+            w.queue.put((future, w.image, ()))
+            waits.append((w, future))
+        for w, future in waits:
+            try:
+                future.result()
+                print("Loaded", w.device.port, w.device.version)
+            except daemonError as e:
+                print(e)
+
+    def handle(self, method, path, params, body):
+        # one API request, returns (content type, bytes)
+        port = params.get('port')
+        refresh = params.get('refresh', '0') not in ('0', '', 'false')
+        if path == '/devices' and method == 'GET':
+            return self.reply([w.info() for w in self.workers.values()])
+        if path == '/read' and method == 'GET':
+            w = self.worker(port)
+            return self.reply(w.call(w.read, refresh))
+        if path == '/image' and method == 'GET':
+            w = self.worker(port)
+            return 'application/octet-stream', w.call(w.image, refresh)
+        if path == '/get' and method == 'GET':
+            if 'name' not in params: raise daemonError("Need a field name", 400)
+            w = self.worker(port)
+            return self.reply(w.call(w.get, params['name'], refresh))
+        if path == '/set' and method == 'POST':
+            if 'name' in params:
+                settings = {params['name']: params.get('value', '')}
+            else:
+                try:
+                    settings = json.loads(body.decode('utf-8') or '{}')
+                except ValueError as e:
+                    raise daemonError("Bad JSON: " + str(e), 400)
+                if not isinstance(settings, dict): raise daemonError("Expected a JSON object of field: value", 400)
+            w = self.worker(port)
+            return self.reply(w.call(w.set, settings))
+        if path == '/write' and method == 'POST':
+            w = self.worker(port)
+            return self.reply(w.call(w.write, body))
+        if path == '/metrics' and method == 'GET':
+            return 'text/plain; version=0.0.4', METRICS.toPrometheus().encode('utf-8')
+        if path == '/metrics.json' and method == 'GET':
+            return self.reply(METRICS.toJSON())
+        raise daemonError("No such request: " + method + " " + path, 404)
+
+    def reply(self, data):
+        return 'application/json', json.dumps(data).encode('utf-8')
+
+    def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        owner = self
+        class handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'   # keep-alive, so a client can send many requests cheaply
+
+            def respond(self, method):
+                url = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                try:
+                    with METRICS.span('daemon_request', path=url.path):
+                        kind, data = owner.handle(method, url.path, params, body)
+                    code = 200
+                except daemonError as e:
+                    kind, data, code = 'application/json', json.dumps({'error': str(e)}).encode('utf-8'), e.code
+                except Exception as e:
+                    kind, data, code = 'application/json', json.dumps({'error': repr(e)}).encode('utf-8'), 500
+                self.send_response(code)
+                self.send_header('Content-Type', kind)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.respond('GET')
+
+            def do_POST(self):
+                self.respond('POST')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        return self.server
+
+    def stop(self):
+        # after serve_forever() has returned
+        if self.server is not None: self.server.server_close()
+        for w in self.workers.values(): w.stop()
+        POOL.closeAll()
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep X1C3 devices open behind a localhost HTTP API')
+    parser.add_argument("ports", nargs='+', help = "Ports or globs, serial or tcp://host:port / udp://host:port, or @ for the ports discover.py found")
+    parser.add_argument("--listen", default='127.0.0.1:' + str(DEFAULT_PORT), metavar='HOST:PORT', help = "Where to serve the API")
+    parser.add_argument("--max_age", type=float, default=0, metavar='SECONDS', help = "Re-read a device when its cached image is older than this, 0 keeps it until a write")
+    parser.add_argument("--preload", action='store_true', help = "Read every device at startup")
+    parser.add_argument("--no_verify", action='store_true', help = "Don't read the image back after writing")
+    parser.add_argument("-v", "--verbose", action='store_true')
+    args = parser.parse_args()
+
+    ports = expandPorts(args.ports)
+    if not ports:
+        print("No ports found!")
+        sys.exit(1)
+    host, sep, port = args.listen.rpartition(':')
+    service = daemon(ports, args.max_age, not args.no_verify, args.verbose)
+    if args.preload: service.preload()
+    try:
+        server = service.serve(host or '127.0.0.1', int(port))
+    except OSError as e:
+        print("Can't listen on " + args.listen + ":", e)
+        sys.exit(1)
+    print("Serving", len(ports), "port(s) on http://" + args.listen, "Ctrl-C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import glob
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import serial.tools.list_ports
+import layout
+from APRStool import x1c3, CACHE, DISCOVERED
+
+##########
+#
+# Discover: which radio is on which port
+#
+# Every candidate port is probed with AT+VER=? at the same time, each with a
+# short deadline, so a hub full of adapters takes about as long as a single
+# probe. Callsigns come from the image cache, or from the devices themselves
+# with --read. What was found is saved for the other tools: fleet.py and
+# daemon.py take '@' for "every discovered port" and the port menu lists them.
+#
+##########
+
+# looked at as well as whatever pyserial lists
+PATTERNS = ('/dev/ttyUSB*', '/dev/ttyACM*', '/dev/rfcomm*', '/dev/tty.usbserial*', '/dev/cu.usbserial*')
+
+def candidates(patterns=()):
+    # the ports to probe: the ones given, or everything that looks like a USB/Bluetooth serial port
+    ports = []
+    if patterns:
+        for pattern in patterns:
+            ports += sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+    else:
+        ports += [p.device for p in serial.tools.list_ports.comports()]
+        for pattern in PATTERNS:
+            ports += sorted(glob.glob(pattern))
+    return list(dict.fromkeys(ports))      # in order, without repeats
+
+def probe(port, timeout=0.3, readImage=False):
+    # ask one port for its version, and its callsign if the image is cached (or readImage)
+    record = {'port': port, 'version': '', 'voltage': '', 'model': '', 'callsign': '', 'status': 'no device'}
+    device = x1c3()
+    device.setPort(port)
+    device.quietFlag = True
+    device.headless = True
+    device.firstTimeout = timeout
+    device.byteTimeout = min(device.byteTimeout, timeout)
+    start = time.perf_counter()
+    try:
+        if not device.readSerialVersion():
+            if device.lastError: record['status'] = 'error: ' + device.lastError
+            return record
+        record.update(version=device.version, voltage=device.voltage, model=device.model.name, status='ok')
+        image = None
+        if readImage:
+            device.firstTimeout = max(timeout, 0.5)
+            if device.readSerialDevice(): image = device.raw
+            else: record['status'] = 'read failed'
+        else:
+            image = CACHE.get(port, device.version)
+        if image is not None:
+            record['callsign'] = layout.callsign(layout.configView(bytes(image), codec=device.model.codec))
+        return record
+    except Exception as e:
+        record['status'] = 'error: ' + str(e)
+        return record
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 3)
+        device.session().close()    # don't hold on to every port on the hub
+
+def discover(ports, timeout=0.3, readImage=False, jobs=64, deadline=None, grace=2.0):
+    # probe all ports at once; anything still going after deadline seconds is reported as such
+    # a probe that is late still owns its session and closes it itself when it ends, so nothing
+    # here closes ports: stragglers get up to grace seconds more, then are left to finish on their own
+    if deadline is None: deadline = timeout + (1.5 if readImage else 0.5) + 1.0
+    results = {}
+    pool = ThreadPoolExecutor(max_workers=max(1, min(jobs, len(ports))))
+    futures = {pool.submit(probe, port, timeout, readImage): port for port in ports}
+    done, late = wait(futures, timeout=deadline)
+    for future in done:
+        results[futures[future]] = future.result()
+    for future in late:
+        port = futures[future]
+        results[port] = {'port': port, 'version': '', 'voltage': '', 'model': '', 'callsign': '', 'status': 'timed out'}
+    pool.shutdown(wait=False, cancel_futures=True)     # the ones that never started don't open their port at all
+    if late: wait(late, timeout=grace)
+    return [results[port] for port in ports]
+
+def remember(records, keep=False):
+    # save the ports a device answered on, for fleet.py/daemon.py '@' and the port menu
+    found = DISCOVERED.load() if keep else {}
+    for r in records:
+        if r['status'] == 'ok' or r['version']:
+            found[r['port']] = {'version': r['version'], 'voltage': r['voltage'], 'model': r['model'],
+                                'callsign': r['callsign'], 'seen': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    DISCOVERED.save(found)
+    return found
+
+def printTable(records, elapsed):
+    print("--------------------------------")
+    print(f"{'Port':24s} {'Firmware':20s} {'Model':8s} {'Voltage':8s} {'Callsign':10s} Status")
+    for r in records:
+        print(f"{r['port']:24s} {r['version']:20s} {r['model']:8s} {r['voltage']:8s} {r['callsign']:10s} {r['status']}")
+    print("--------------------------------")
+    found = sum(1 for r in records if r['version'])
+    print(f"{found}/{len(records)} port(s) answered in {elapsed:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description='Find which device is on which serial port')
+    parser.add_argument("ports", nargs='*', help = "Ports or globs to probe, default is every USB/Bluetooth serial port")
+    parser.add_argument("-t", "--timeout", type=float, default=0.3, help = "Seconds each port has to answer")
+    parser.add_argument("-r", "--read", action='store_true', help = "Also read each image for the callsign (slower)")
+    parser.add_argument("-j", "--jobs", type=int, default=64, help = "Ports probed at once")
+    parser.add_argument("--keep", action='store_true', help = "Add to the saved results instead of replacing them")
+    parser.add_argument("--cached", action='store_true', help = "Show the saved results without probing")
+    parser.add_argument("--json", action='store_true', help = "Print the results as JSON")
+    args = parser.parse_args()
+
+    if args.cached:
+        found = DISCOVERED.load()
+        if args.json: print(json.dumps(found, indent=2))
+        else:
+            for port in sorted(found):
+                print(f"{port:24s} {found[port]['version']:20s} {found[port]['model']:8s} {found[port]['callsign']:10s} seen {found[port]['seen']}")
+        return
+
+    ports = candidates(args.ports)
+    if not ports:
+        print("No serial ports found!")
+        sys.exit(1)
+    start = time.perf_counter()
+    records = discover(ports, args.timeout, args.read, args.jobs)
+    elapsed = time.perf_counter() - start
+    remember(records, args.keep)
+    if args.json: print(json.dumps(records, indent=2))
+    else: printTable(records, elapsed)
+    sys.exit(0 if any(r['version'] for r in records) else 1)
+
+
+if __name__ == "__main__":
+    main()
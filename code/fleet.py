@@ -0,0 +1,186 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import layout
+from APRStool import x1c3, POOL, DISCOVERED, parseSettings
+from metrics import METRICS
+
+##########
+#
+# Fleet mode: run the same job against many serial ports at once
+#
+# Every port gets its own x1c3 object and runs in its own worker thread, so
+# the blocking serial timeouts overlap and the total time is set by the
+# slowest device rather than the sum of all of them.
+#
+##########
+
+def expandPorts(patterns):
+    # turn a list of port names and/or globs ('/dev/ttyUSB*') into port names
+    # '@' stands for every port discover.py last found a device on
+    ports = []
+    for pattern in patterns:
+        if pattern == '@': matches = DISCOVERED.ports()
+        elif glob.has_magic(pattern): matches = sorted(glob.glob(pattern))
+        else: matches = [pattern]
+        for port in matches:
+            if port not in ports: ports.append(port)
+    return ports
+
+def portFile(directory, port):
+    # the per-port file name used when reading a fleet, e.g. out/ttyUSB0.sav
+    return os.path.join(directory, os.path.basename(port) + '.sav')
+
+class result:
+    def __init__(self, port):
+        self.port = port
+        self.version = ''
+        self.voltage = ''
+        self.model = ''
+        self.status = 'ok'
+        self.seconds = 0.0
+
+def provision(port, image=None, readDir=None, verify=True, debug=False, check=False, useCache=True, settings=None):
+    # version-check, then optionally read and/or write+verify a single port
+    # settings ({name: value}) are applied to what the device already has, using its own model's layout
+    res = result(port)
+    start = time.perf_counter()
+    device = x1c3()
+    device.setPort(port)
+    device.quietFlag = True
+    device.debugFlag = debug
+    try:
+        if not device.readSerialVersion():
+            res.status = 'no device' + (': ' + device.lastError if device.lastError else '')
+            return res
+        res.version = device.version
+        res.voltage = device.voltage
+        res.model = device.model.name
+
+        if readDir is not None:
+            if not device.readSerialDevice() or len(device.raw) != 517:
+                res.status = 'read failed'
+                return res
+            device.setFile(portFile(readDir, port))
+            if not device.writeFile():
+                res.status = 'save failed'
+                return res
+
+        if settings:
+            if not device.readSerialDevice():
+                res.status = 'read failed'
+                return res
+            device.ExpandConfig()
+            if not device.parsed:
+                res.status = 'parse failed'
+                return res
+            # fields this model doesn't have are left alone
+            missing = [k for k in settings if not device.model.supports(k)]
+            errors = device.applySettings({k: v for k, v in settings.items() if k not in missing})
+            if errors:
+                res.status = 'invalid: ' + '; '.join(errors)
+                return res
+            device.compressConfig()
+            written = device.writeSerialDeviceChecked(True, verify)
+            if not written: res.status = 'write failed' + (': ' + device.lastError if device.lastError else '')
+            elif written == 'skipped': res.status = 'ok (unchanged)'
+            if written and missing: res.status += ' (no ' + ', '.join(missing) + ' on ' + device.model.name + ')'
+            return res
+
+        if image is not None and check:
+            # only write devices that don't already have the image
+            device.raw = image
+            written = device.writeSerialDeviceChecked(useCache, verify)
+            if not written: res.status = 'write failed' + (': ' + device.lastError if device.lastError else '')
+            elif written == 'skipped': res.status = 'ok (unchanged)'
+            return res
+
+        if image is not None:
+            device.raw = image
+            if not device.writeSerialDevice():
+                res.status = 'write failed'
+                return res
+            if verify:
+                if not device.readSerialDevice():
+                    res.status = 'verify read failed'
+                    return res
+                if not layout.sameImage(bytes(device.raw), bytes(image)):   # as the --check path compares
+                    res.status = 'verify mismatch'
+                    return res
+        return res
+    except Exception as e:
+        # one misbehaving device must not take down the rest of the fleet
+        res.status = 'error: ' + str(e)
+        return res
+    finally:
+        res.seconds = time.perf_counter() - start
+        METRICS.observe('provision_seconds', res.seconds)
+        METRICS.inc('provision_total', status=res.status.split(':')[0])
+
+def runFleet(ports, image=None, readDir=None, verify=True, jobs=8, debug=False, check=False, useCache=True, settings=None):
+    # run provision() on every port, at most jobs at a time, results in port order
+    if readDir is not None: os.makedirs(readDir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [pool.submit(provision, port, image, readDir, verify, debug, check, useCache, settings) for port in ports]
+        return [f.result() for f in futures]
+
+def printResults(results, elapsed):
+    print("--------------------------------")
+    print(f"{'Port':20s} {'Firmware':20s} {'Model':8s} {'Voltage':8s} {'Time':>6s}  Result")
+    for r in results:
+        print(f"{r.port:20s} {r.version:20s} {r.model:8s} {r.voltage:8s} {r.seconds:6.2f}  {r.status}")
+    print("--------------------------------")
+    good = sum(1 for r in results if r.status.startswith('ok'))
+    print(f"{good}/{len(results)} ok in {elapsed:.2f}s wall time")
+
+def main():
+    parser = argparse.ArgumentParser(description='Read/write many X1C3 devices in parallel')
+    parser.add_argument("ports", nargs='+', help = "Ports or globs, e.g. /dev/ttyUSB*, or @ for the ports discover.py found")
+    parser.add_argument("-v", "--verbose", action='store_true')
+    parser.add_argument("-j", "--jobs", type=int, default=8, help = "Maximum devices to talk to at once")
+    parser.add_argument("-r", "--read", nargs='?', const='.', metavar='DIR', help = "Read every device into DIR/<port>.sav")
+    parser.add_argument("-w", "--write", metavar='FILE', help = "Write FILE to every device")
+    parser.add_argument("--set", action='append', default=[], metavar='KEY=VALUE', help = "Change a field on every device, keeping the rest of its config (repeatable)")
+    parser.add_argument("-c", "--check", action='store_true', help = "Skip devices that already have the image")
+    parser.add_argument("--no_cache", action='store_true', help = "With --check: always read the device instead of using the image cache")
+    parser.add_argument("--no_verify", action='store_true', help = "Don't read the image back after writing")
+    parser.add_argument("--metrics", metavar='FILE', help = "Write timings and counters to FILE when done (JSON, or Prometheus text for .prom)")
+    parser.add_argument("--metrics_port", type=int, metavar='PORT', help = "Serve Prometheus metrics on localhost:PORT/metrics while running")
+    args = parser.parse_args()
+
+    ports = expandPorts(args.ports)
+    if not ports:
+        print("No ports found!")
+        sys.exit(1)
+
+    image = None
+    if args.write:
+        device = x1c3()
+        device.setFile(args.write)
+        if not device.readFile(): sys.exit(1)
+        image = device.raw
+
+    try:
+        settings = parseSettings(args.set)
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+    if settings and image is not None:
+        print("Use either --write or --set")
+        sys.exit(2)
+
+    if args.metrics_port: METRICS.serve(args.metrics_port)
+    start = time.perf_counter()
+    results = runFleet(ports, image, args.read, not args.no_verify, args.jobs, args.verbose, args.check, not args.no_cache, settings)
+    printResults(results, time.perf_counter() - start)
+    print(POOL.report())
+    POOL.closeAll()
+    if args.metrics: METRICS.dump(args.metrics)
+    sys.exit(0 if all(r.status.startswith('ok') for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import layout
+import validate
+
+##########
+#
+# Generate per-unit images from one base image and a table of overrides
+#
+# Each row of a CSV (header = field names) or JSONL file ({field: value})
+# gives the fields that differ for one unit; empty cells keep the base value.
+# Two extra columns are understood: 'file' names the output file and 'port'
+# is the device the image is written to with --devices.
+#
+# Rows are handed to a process pool in batches. Every worker holds its own
+# copy of the base image and only patches the override fields into a copy of
+# it, and only a few batches are in flight at once, so memory stays flat
+# however long the table is. Images come back in row order and are streamed
+# to files, an archive (archive.py) and/or devices.
+#
+#   python generate.py settings.sav club.csv -o out/
+#   python generate.py settings.sav club.jsonl -a club.arc
+#   python generate.py settings.sav units.csv --devices
+#
+##########
+
+EXTRA = ('file', 'port')    # columns that aren't fields
+
+def readRows(name):
+    # the override rows of a .csv or .jsonl file, one dictionary at a time
+    with open(name, newline='') as f:
+        if name.endswith(('.jsonl', '.json')):
+            for line in f:
+                if line.strip(): yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                yield {k.strip(): v for k, v in row.items() if k is not None and v is not None and v != ''}
+
+########## Runs in the workers
+BASE = None
+MODEL = None
+
+def setup(base, modelName):
+    global BASE, MODEL
+    BASE = bytes(base)
+    MODEL = layout.byName(modelName)
+
+def build(rows):
+    # patch each row's fields into a copy of the base image
+    # returns the images that built, back to back, and (row number, errors) for the ones that didn't
+    images = bytearray()
+    failed = []
+    codec = MODEL.codec
+    for number, row in rows:
+        if not isinstance(row, dict):
+            # valid JSON, but a list or a number rather than {field: value}
+            failed.append((number, ["expected an object of field: value, got " + type(row).__name__]))
+            continue
+        image = bytearray(BASE)
+        errors = []
+        values = {}
+        for name, value in row.items():
+            if name in EXTRA: continue
+            try:
+                values[name] = MODEL.parseValue(name, value)
+                codec.encodeField(image, name, values[name])
+            except ValueError as e:
+                errors.append(str(e))
+        # the values first (encodeField cuts text to fit, so too long only shows here), then the finished image
+        if not errors: errors = validate.describe(validate.checkConfig(values, MODEL))
+        if not errors: errors = validate.describe(validate.checkImage(image, MODEL))
+        if errors: failed.append((number, errors))
+        else: images += image
+    return bytes(images), failed
+
+########## Driving the pool
+def batches(rows, size):
+    batch = []
+    for number, row in enumerate(rows, 1):
+        batch.append((number, row))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch: yield batch
+
+def generate(rows, base, modelName='generic', jobs=None, batchSize=500):
+    # yield (row number, row, image or None, errors) in row order
+    jobs = jobs if jobs is not None else (os.cpu_count() or 1)
+    size = layout.IMAGE_SIZE
+
+    def unpack(batch, result):
+        images, failed = result
+        errors = dict(failed)
+        pos = 0
+        for number, row in batch:
+            if number in errors:
+                yield number, row, None, errors[number]
+            else:
+                yield number, row, images[pos:pos + size], []
+                pos += size
+
+    if jobs <= 1:
+        setup(base, modelName)
+        for batch in batches(rows, batchSize):
+            yield from unpack(batch, build(batch))
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=setup, initargs=(bytes(base), modelName)) as pool:
+        pending = deque()
+        for batch in batches(rows, batchSize):
+            pending.append((batch, pool.submit(build, batch)))
+            # a couple of batches per worker in flight, no more
+            if len(pending) >= jobs * 2:
+                batch, future = pending.popleft()
+                yield from unpack(batch, future.result())
+        while pending:
+            batch, future = pending.popleft()
+            yield from unpack(batch, future.result())
+
+def outputName(number, row, image, codec):
+    if row.get('file'): return row['file']
+    config = layout.configView(image, codec=codec)
+    call = layout.callsign(config)
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in call) + '_' + str(number) + '.sav'
+
+def main():
+    parser = argparse.ArgumentParser(description='Build per-unit images from a base image and a CSV/JSONL of overrides')
+    parser.add_argument("base", help = "Base image, e.g. settings.sav")
+    parser.add_argument("table", help = "CSV with field names as the header, or JSONL of {field: value}")
+    parser.add_argument("-o", "--output", metavar='DIR', help = "Write each image to DIR (named by the 'file' column, else CALLSIGN-SSID_row.sav)")
+    parser.add_argument("-a", "--archive", help = "Append the images to this archive (created if needed)")
+    parser.add_argument("--devices", action='store_true', help = "Write each image to the device in its row's 'port' column")
+    parser.add_argument("--model", default='generic', help = "Model whose fields may be set (default: every field)")
+    parser.add_argument("-j", "--jobs", type=int, help = "Worker processes (default: one per CPU, 1 = none)")
+    parser.add_argument("--batch", type=int, default=500, help = "Rows per worker task")
+    parser.add_argument("--no_verify", action='store_true', help = "With --devices: don't read the image back")
+    args = parser.parse_args()
+
+    try:
+        with open(args.base, 'rb') as f:
+            base = f.read()
+        model = layout.byName(args.model)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(2)
+    if len(base) != layout.IMAGE_SIZE:
+        print(args.base, "is not a", layout.IMAGE_SIZE, "byte image")
+        sys.exit(2)
+
+    if args.output: os.makedirs(args.output, exist_ok=True)
+    arc = None
+    if args.archive:
+        import archive
+        arc = archive.archive(args.archive, writable=True) if os.path.exists(args.archive) else archive.archive.create(args.archive)
+    devices = None
+    results = []
+    if args.devices:
+        import fleet
+        devices = ThreadPoolExecutor(max_workers=8)
+
+    start = time.perf_counter()
+    good = bad = 0
+    pendingImages, pendingNames = [], []
+    try:
+        for number, row, image, errors in generate(readRows(args.table), base, model.name, args.jobs, args.batch):
+            if errors:
+                bad += 1
+                print("Row", number, ":", '; '.join(errors), file=sys.stderr)
+                continue
+            good += 1
+            name = outputName(number, row, image, model.codec) if args.output or arc is not None else None
+            if args.output:
+                with open(os.path.join(args.output, name), 'wb') as f:
+                    f.write(image)
+            if arc is not None:
+                pendingImages.append(image)
+                pendingNames.append(name)
+                if len(pendingImages) >= args.batch:
+                    arc.append(pendingImages, pendingNames)
+                    pendingImages, pendingNames = [], []
+            if devices is not None:
+                if not row.get('port'):
+                    print("Row", number, ": no port to write to", file=sys.stderr)
+                    continue
+                results.append(devices.submit(fleet.provision, row['port'], image, None, not args.no_verify))
+        if arc is not None and pendingImages: arc.append(pendingImages, pendingNames)
+    except (OSError, ValueError, csv.Error) as e:
+        print("Stopped:", e, file=sys.stderr)
+        bad += 1
+    finally:
+        if arc is not None: arc.close()
+    elapsed = time.perf_counter() - start
+
+    if devices is not None:
+        devices.shutdown(wait=True)
+        fleet.printResults([r.result() for r in results], time.perf_counter() - start)
+        if any(not r.result().status.startswith('ok') for r in results): bad += 1
+    print(good, "image(s) generated,", bad, "failed, in", format(elapsed, '.2f') + "s")
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
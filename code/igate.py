@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import random
+import sys
+import threading
+import time
+import serial
+import kiss
+import layout
+from APRStool import x1c3, POOL
+
+##########
+#
+# APRS-IS iGate over TCP
+#
+# Packets heard by the TNC (its KISS output, see kiss.py) are forwarded to an
+# APRS-IS style server. The server defaults to the device's own 'IP Address'
+# and 'IP Port' settings and the login to its CALLSIGN-SSID.
+#
+# The serial reader runs in a thread and hands packets to the asyncio side
+# through a bounded queue. When the queue is full the reader waits (up to
+# --max_wait) before the packet is dropped and counted; the uplink logs in,
+# sends keepalives and reconnects with exponential backoff.
+#
+##########
+
+VERSION = 'APRStool 1.0'
+NOGATE = ('TCPIP', 'TCPXX', 'NOGATE', 'RFONLY')
+
+def passcode(call):
+    # the standard APRS-IS passcode for a callsign (without SSID)
+    call = call.split('-')[0].upper()
+    code = 0x73e2
+    for i in range(0, len(call), 2):
+        code ^= ord(call[i]) << 8
+        if i + 1 < len(call): code ^= ord(call[i + 1])
+    return code & 0x7fff
+
+def tnc2(record, gateway):
+    # a received frame as an APRS-IS line with our q-construct, or None if it must not be gated
+    path = [p for p in record['path']]
+    if any(p.rstrip('*').split('-')[0] in NOGATE for p in path): return None
+    if record['payload'].startswith('?'): return None           # queries stay on RF
+    return record['src'] + '>' + ','.join([record['dest']] + path + ['qAR', gateway]) + ':' + record['payload']
+
+class igateStats:
+    def __init__(self):
+        self.received = 0       # packets handed to the iGate
+        self.forwarded = 0      # lines written to the server
+        self.dropped = 0        # packets dropped because the queue stayed full
+        self.skipped = 0        # packets not gated (NOGATE/RFONLY/TCPIP/queries)
+        self.reconnects = 0
+        self.latency = 0.0      # total seconds between receive and send, for the average
+        self.maxLatency = 0.0
+
+    def report(self, queue):
+        average = self.latency / self.forwarded * 1000 if self.forwarded else 0.0
+        return ("queue="+str(queue.qsize())+"/"+str(queue.maxsize)+" received="+str(self.received)
+                +" forwarded="+str(self.forwarded)+" dropped="+str(self.dropped)+" skipped="+str(self.skipped)
+                +" reconnects="+str(self.reconnects)+" latency avg="+format(average, '.1f')
+                +"ms max="+format(self.maxLatency * 1000, '.1f')+"ms")
+
+class igate:
+    def __init__(self, host, port, call, code=None, queueSize=1000, keepalive=60.0, maxWait=1.0, debug=False):
+        self.host = host
+        self.port = port
+        self.call = call
+        self.code = passcode(call) if code is None else code
+        self.queue = asyncio.Queue(maxsize=queueSize)
+        self.keepalive = keepalive
+        self.maxWait = maxWait  # how long a producer may be held up by a full queue
+        self.debugFlag = debug
+        self.stats = igateStats()
+        self.running = True
+        self.pending = None     # (time heard, line) being sent
+        self.connected = asyncio.Event()
+
+    def debug(self, message):
+        if self.debugFlag: print(message, file=sys.stderr)
+
+    async def submit(self, record, heard=None):
+        # queue one received frame, waiting for room if the uplink is behind
+        self.stats.received += 1
+        line = tnc2(record, self.call)
+        if line is None:
+            self.stats.skipped += 1
+            return False
+        try:
+            await asyncio.wait_for(self.queue.put((heard or time.monotonic(), line)), self.maxWait)
+            return True
+        except asyncio.TimeoutError:
+            self.stats.dropped += 1
+            return False
+
+    async def login(self, reader, writer):
+        writer.write(('user ' + self.call + ' pass ' + str(self.code) + ' vers ' + VERSION + '\r\n').encode('ascii'))
+        await writer.drain()
+        # the server greets with '# ...' lines, then a '# logresp' once we're in
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 10)
+            if not line: raise ConnectionError("server closed during login")
+            self.debug("< " + line.decode('utf-8', 'replace').rstrip())
+            if b'logresp' in line:
+                if b'unverified' in line: print("Warning: login unverified, packets won't be gated", file=sys.stderr)
+                return
+
+    async def drain(self, reader):
+        # read and discard what the server sends us, noticing when it hangs up
+        while True:
+            line = await reader.readline()
+            if not line: raise ConnectionError("server closed the connection")
+            self.debug("< " + line.decode('utf-8', 'replace').rstrip())
+
+    async def send(self, writer):
+        # a packet taken off the queue stays in self.pending until it has been written,
+        # so a dropped connection doesn't lose it
+        last = time.monotonic()
+        while True:
+            if self.pending is None:
+                try:
+                    self.pending = await asyncio.wait_for(self.queue.get(), max(0.1, self.keepalive - (time.monotonic() - last)))
+                except asyncio.TimeoutError:
+                    writer.write(b'#keepalive\r\n')
+                    await writer.drain()
+                    last = time.monotonic()
+                    continue
+            heard, line = self.pending
+            writer.write(line.encode('utf-8') + b'\r\n')
+            await writer.drain()
+            self.pending = None
+            last = time.monotonic()
+            waited = last - heard
+            self.stats.forwarded += 1
+            self.stats.latency += waited
+            self.stats.maxLatency = max(self.stats.maxLatency, waited)
+
+    async def run(self):
+        backoff = 1.0
+        while self.running:
+            writer = None
+            try:
+                self.debug("Connecting to " + self.host + ":" + str(self.port))
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), 10)
+                await self.login(reader, writer)
+                self.connected.set()
+                backoff = 1.0
+                tasks = [asyncio.ensure_future(self.drain(reader)), asyncio.ensure_future(self.send(writer))]
+                try:
+                    # both run until either one fails, which means the connection is gone
+                    await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                finally:
+                    for task in tasks: task.cancel()
+                    results = await asyncio.gather(*tasks, return_exceptions=True)
+                errors = [r for r in results if isinstance(r, Exception) and not isinstance(r, asyncio.CancelledError)]
+                if errors: raise errors[0]
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+                self.debug("Uplink error: " + str(e))
+            finally:
+                self.connected.clear()
+                if writer is not None: writer.close()
+            if not self.running: break
+            self.stats.reconnects += 1
+            delay = backoff * random.uniform(0.5, 1.0)
+            self.debug("Reconnecting in " + format(delay, '.1f') + "s")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, 60.0)
+
+
+########## Local stand-in for an APRS-IS server
+class standInServer:
+    # accepts logins and collects every line sent after them, for testing
+    def __init__(self):
+        self.lines = []
+        self.logins = []
+        self.writers = []       # the open client connections
+        self.server = None
+        self.port = None
+
+    async def handle(self, reader, writer):
+        self.writers.append(writer)
+        writer.write(b'# stand-in aprsc\r\n')
+        await writer.drain()
+        login = await reader.readline()
+        self.logins.append(login.decode('utf-8', 'replace').strip())
+        call = login.split()[1].decode('ascii', 'replace') if len(login.split()) > 1 else '?'
+        writer.write(('# logresp ' + call + ' verified, server STANDIN\r\n').encode('ascii'))
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line: break
+            self.lines.append(line.decode('utf-8', 'replace').rstrip('\r\n'))
+        writer.close()
+        if writer in self.writers: self.writers.remove(writer)
+
+    def kick(self):
+        # hang up on every client, as a server restart would
+        for writer in self.writers: writer.close()
+        self.writers = []
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    def close(self):
+        self.server.close()
+
+
+########## Feeding the iGate from the TNC
+def readerThread(gate, loop, stream, hexMode):
+    # blocking serial reads in a thread, each frame handed to the event loop
+    for record in kiss.receive(stream, hexMode):
+        heard = time.monotonic()
+        future = asyncio.run_coroutine_threadsafe(gate.submit(record, heard), loop)
+        future.result()         # this is the back pressure: wait until the queue took it
+        if not gate.running: break
+
+async def runGate(gate, stream, hexMode, statsEvery, drainTimeout=30.0):
+    # runs until the input ends and the queue is sent, or drainTimeout seconds after
+    # the input ends if the server won't take what is left
+    loop = asyncio.get_running_loop()
+    uplink = asyncio.ensure_future(gate.run())
+    reader = threading.Thread(target=readerThread, args=(gate, loop, stream, hexMode), daemon=True)
+    reader.start()
+    ended = None            # when the input ran out
+    printed = time.monotonic()
+    try:
+        while reader.is_alive() or not gate.queue.empty() or gate.pending is not None:
+            await asyncio.sleep(0.1)
+            now = time.monotonic()
+            if statsEvery and now - printed >= statsEvery:
+                print(gate.stats.report(gate.queue), file=sys.stderr)
+                printed = now
+            if reader.is_alive(): continue
+            if ended is None: ended = now
+            if now - ended > drainTimeout:
+                left = gate.queue.qsize() + (gate.pending is not None)
+                gate.stats.dropped += left
+                print("Gave up on", left, "queued packet(s), the server didn't take them", file=sys.stderr)
+                break
+    finally:
+        gate.running = False
+        uplink.cancel()
+        await asyncio.gather(uplink, return_exceptions=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Forward packets from the TNC to APRS-IS')
+    parser.add_argument("-p", "--port", default='/dev/ttyUSB0', help = "TNC serial port (KISS output)")
+    parser.add_argument("-f", "--file", default='settings.sav', help = "Config image to take the server and callsign from")
+    parser.add_argument("--replay", help = "Read KISS frames from a capture file instead of the port")
+    parser.add_argument("--server", help = "host:port, default is the config's IP Address/IP Port")
+    parser.add_argument("--call", help = "Login callsign, default is the config's CALLSIGN-SSID")
+    parser.add_argument("--passcode", type=int, help = "APRS-IS passcode, default is computed from the callsign")
+    parser.add_argument("--hex", action='store_true', help = "The TNC is sending 'KISS hex' text")
+    parser.add_argument("--queue", type=int, default=1000, help = "Outbound queue size")
+    parser.add_argument("--max_wait", type=float, default=1.0, help = "Seconds to wait for room in the queue before dropping")
+    parser.add_argument("--keepalive", type=float, default=60.0, help = "Seconds between keepalives")
+    parser.add_argument("--drain", type=float, default=30.0, metavar='SECONDS', help = "When the input ends, how long to keep trying to send what is queued")
+    parser.add_argument("--stats", type=float, default=0, metavar='SECONDS', help = "Print counters to stderr this often")
+    parser.add_argument("-v", "--verbose", action='store_true')
+    args = parser.parse_args()
+
+    host, port, call = None, None, args.call
+    device = x1c3()
+    device.setFile(args.file)
+    if device.readFile():
+        config = layout.configView(device.raw)
+        host, port = config['IP Address'], config['IP Port']
+        if call is None: call = layout.callsign(config)
+    if args.server:
+        host, sep, port = args.server.rpartition(':')
+        port = int(port)
+    if not host or not port or not call:
+        print("Need a server and callsign, from --server/--call or the config file")
+        sys.exit(1)
+
+    if args.replay:
+        stream = kiss.fileStream(args.replay)
+    else:
+        try:
+            stream = POOL.get(args.port).open()
+        except serial.SerialException as e:
+            print("Error opening or using serial port:", e)
+            sys.exit(1)
+        stream.timeout = 0.5
+
+    gate = igate(host, port, call, args.passcode, args.queue, args.keepalive, args.max_wait, args.verbose)
+    try:
+        asyncio.run(runGate(gate, stream, args.hex, args.stats, args.drain))
+    except KeyboardInterrupt:
+        pass
+    print(gate.stats.report(gate.queue), file=sys.stderr)
+    POOL.closeAll()
+
+
+if __name__ == "__main__":
+    main()
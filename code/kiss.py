@@ -0,0 +1,215 @@
+import argparse
+import json
+import sys
+import time
+import serial
+from APRStool import POOL
+
+##########
+#
+# KISS / AX.25 receiver for the TNC's KISS output ('BT Out 1' = KISS hex/ascii)
+#
+# Bytes are read from the port into one reused buffer, so a read allocates
+# nothing, and each chunk is copied once to hand to an incremental KISS
+# deframer, which finds frame boundaries with bytes.find and unescapes with
+# bytes.replace rather than looking at every byte in Python. Complete frames
+# are decoded as AX.25 UI frames and yielded as small dictionaries (or
+# printed as JSON lines).
+#
+##########
+
+FEND = 0xc0
+FESC = 0xdb
+TFEND = 0xdc
+TFESC = 0xdd
+
+# the two escape sequences: FEND and FESC inside a frame are sent as these
+ESC_FEND = bytes([FESC, TFEND])
+ESC_FESC = bytes([FESC, TFESC])
+
+class ax25Error(Exception):
+    pass
+
+class rxStats:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.bytes = 0          # bytes read from the port
+        self.frames = 0         # AX.25 frames decoded
+        self.errors = 0         # KISS escape or AX.25 decode errors
+        self.ignored = 0        # non-data KISS frames and non-UI AX.25 frames
+
+    def rate(self):
+        seconds = time.monotonic() - self.start
+        return self.frames / seconds if seconds > 0 else 0.0
+
+    def report(self):
+        return ("frames="+str(self.frames)+" errors="+str(self.errors)+" ignored="+str(self.ignored)
+                +" bytes="+str(self.bytes)+" rate="+format(self.rate(), '.1f')+" frames/s")
+
+
+########## KISS framing
+class kissDecoder:
+    # incremental KISS deframer: feed() any chunk of bytes, get back complete frames
+    def __init__(self, stats=None):
+        self.partial = bytearray()  # an unfinished frame carried between feeds
+        self.inFrame = False
+        self.stats = stats or rxStats()
+
+    def feed(self, data):
+        if not isinstance(data, bytes): data = bytes(data)      # the one copy of a chunk from receive()'s buffer
+        frames = []
+        pos = 0
+        end = len(data)
+        while pos < end:
+            fend = data.find(FEND, pos)
+            if fend < 0:
+                if self.inFrame: self.partial += data[pos:]
+                break
+            if self.inFrame:
+                self.partial += data[pos:fend]
+                if self.partial:
+                    frame = self.unescape(self.partial)
+                    if frame is not None: frames.append(frame)
+                    self.partial = bytearray()
+            self.inFrame = True
+            pos = fend + 1
+        return frames
+
+    def unescape(self, data):
+        # undo FESC TFEND / FESC TFESC, count any other escape as an error
+        if FESC not in data: return bytes(data)
+        if data.count(FESC) != data.count(ESC_FEND) + data.count(ESC_FESC):
+            self.stats.errors += 1
+            return None
+        return bytes(data).replace(ESC_FEND, bytes([FEND])).replace(ESC_FESC, bytes([FESC]))
+
+def kissEscape(frame):
+    return bytes(frame).replace(bytes([FESC]), ESC_FESC).replace(bytes([FEND]), ESC_FEND)
+
+def kissFrame(frame, port=0):
+    # wrap an AX.25 frame for sending to/from a KISS TNC
+    return bytes([FEND, port << 4]) + kissEscape(frame) + bytes([FEND])
+
+
+########## AX.25
+def decodeAddress(data):
+    call = bytes(b >> 1 for b in data[:6]).decode('ascii', 'replace').strip()
+    ssid = (data[6] >> 1) & 0x0f
+    return call + ('-' + str(ssid) if ssid else ''), bool(data[6] & 0x80), bool(data[6] & 0x01)
+
+def decodeAX25(frame):
+    # an AX.25 UI frame as {'src', 'dest', 'path', 'payload'}
+    if len(frame) < 16: raise ax25Error("frame too short ("+str(len(frame))+" bytes)")
+    addresses = []
+    pos = 0
+    while True:
+        if pos + 7 > len(frame) or len(addresses) > 9: raise ax25Error("bad address field")
+        address, hbit, last = decodeAddress(frame[pos:pos + 7])
+        addresses.append((address, hbit))
+        pos += 7
+        if last: break
+    if len(addresses) < 2: raise ax25Error("missing source address")
+    if pos + 2 > len(frame): raise ax25Error("missing control/PID")
+    if frame[pos] & 0xef != 0x03 or frame[pos + 1] != 0xf0: return None   # not a UI frame
+    path = [a + ('*' if h else '') for a, h in addresses[2:]]
+    return {'src': addresses[1][0], 'dest': addresses[0][0], 'path': path,
+            'payload': frame[pos + 2:].decode('utf-8', 'replace')}
+
+def encodeAddress(address, last=False, hbit=False):
+    call, sep, ssid = address.rstrip('*').partition('-')
+    data = bytes((ord(c) << 1) & 0xfe for c in call.upper().ljust(6)[:6])
+    return data + bytes([0x60 | (int(ssid or 0) & 0x0f) << 1 | (0x80 if hbit or address.endswith('*') else 0) | (1 if last else 0)])
+
+def encodeAX25(src, dest, path, payload):
+    # build a UI frame, used by tests and the simulator
+    addresses = [dest, src] + list(path)
+    data = b''.join(encodeAddress(a, i == len(addresses) - 1) for i, a in enumerate(addresses))
+    return data + b'\x03\xf0' + payload.encode('utf-8')
+
+
+########## Receiving
+def receive(stream, hexMode=False, stats=None, bufferSize=65536):
+    # read a serial port (or any object with readinto) forever, yielding decoded UI frames
+    stats = stats or rxStats()
+    decoder = kissDecoder(stats)
+    view = memoryview(bytearray(bufferSize))   # every read lands here; the decoder keeps its own copy
+    digits = ''                             # a hex digit left over from the last chunk
+    while True:
+        count = stream.readinto(view)
+        if count is None: continue
+        if count == 0:
+            if getattr(stream, 'eof', False): return
+            continue
+        stats.bytes += count
+        chunk = view[:count]
+        if hexMode:
+            # 'KISS hex' output: the same frames written as hex digits
+            digits += ''.join(c for c in bytes(chunk).decode('ascii', 'ignore') if c in '0123456789abcdefABCDEF')
+            even = len(digits) // 2 * 2
+            chunk = bytes.fromhex(digits[:even])
+            digits = digits[even:]
+        for frame in decoder.feed(chunk):
+            if not frame or frame[0] & 0x0f != 0:   # only KISS data frames carry AX.25
+                stats.ignored += 1
+                continue
+            try:
+                record = decodeAX25(frame[1:])
+            except ax25Error:
+                stats.errors += 1
+                continue
+            if record is None:
+                stats.ignored += 1
+                continue
+            stats.frames += 1
+            yield record
+
+class fileStream:
+    # replay a capture file through receive()
+    def __init__(self, name):
+        self.file = open(name, 'rb')
+        self.eof = False
+
+    def readinto(self, buf):
+        count = self.file.readinto(buf)
+        if count == 0: self.eof = True
+        return count
+
+def main():
+    parser = argparse.ArgumentParser(description='Receive APRS frames from the TNC KISS output')
+    parser.add_argument("-p", "--port", default='/dev/ttyUSB0', help = "Serial port")
+    parser.add_argument("-b", "--baud", type=int, default=9600)
+    parser.add_argument("-f", "--file", help = "Replay a capture file instead of reading the port")
+    parser.add_argument("--hex", action='store_true', help = "The TNC is sending 'KISS hex' text")
+    parser.add_argument("--json", action='store_true', help = "Print frames as JSON lines")
+    parser.add_argument("--stats", type=float, default=0, metavar='SECONDS', help = "Print counters to stderr this often")
+    args = parser.parse_args()
+
+    stats = rxStats()
+    if args.file:
+        stream = fileStream(args.file)
+    else:
+        session = POOL.get(args.port)
+        session.baud = args.baud
+        try:
+            stream = session.open()
+        except serial.SerialException as e:
+            print("Error opening or using serial port:", e)
+            sys.exit(1)
+        stream.timeout = 0.5
+
+    last = time.monotonic()
+    try:
+        for record in receive(stream, args.hex, stats):
+            if args.json: print(json.dumps(record), flush=True)
+            else: print(record['src'] + '>' + ','.join([record['dest']] + record['path']) + ':' + record['payload'], flush=True)
+            if args.stats and time.monotonic() - last >= args.stats:
+                print(stats.report(), file=sys.stderr)
+                last = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    print(stats.report(), file=sys.stderr)
+    POOL.closeAll()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+import re
+import struct
+from collections.abc import MutableMapping
+
+##########
+#
+# X1C3 config image layout
+#
+# One table describes every byte of the 517 byte config image. Both the
+# decoder and the encoder are generated from it and compiled once into a
+# single struct.Struct, so a whole image is packed/unpacked in one call.
+#
+##########
+
+IMAGE_SIZE = 517        # the config image is exactly 517 bytes
+HEADER = b'HELLO'       # every image starts with this
+
+# field kinds
+U8 = 'u8'               # one byte unsigned integer
+U16 = 'u16'             # two byte big endian unsigned integer
+STR = 'str'             # text, 0x00 terminated when short, then padded
+CONST = 'const'         # bytes we don't understand: a full encode writes the table's bytes,
+                        # patching an image (encodeField) leaves whatever was read there
+
+# common enum labels
+ONOFF = ['Disable','Enable']
+CHANNELS = ['CH A','CH B','CH A+B','Bluetooth']
+VOLUMES = ['-10.5dB','-9.0dB','-7.5dB','-6.0dB','-4.5dB','-3.0dB','-1.5dB','0dB']
+
+# (name, offset, width, kind, pad or constant bytes, enum labels)
+# pad is only used by STR fields, CONST entries carry their bytes instead
+FIELDS = (
+    ('Header',             0,   5, CONST, HEADER, None),
+    ('Time Value',         5,   2, U16,   None, None),
+    ('Time Enable',        7,   1, U8,    None, ONOFF),
+    ('Manual Enable',      8,   1, U8,    None, ONOFF),
+    ('Smart',              9,   1, U8,    None, ['Off','1-Car (20s)','2-Bicycle (40s)','3-Walking (60s)','4-Climbing (90s)','5-Barely moving (120s)']),
+    ('Queue Enable',      10,   1, U8,    None, ONOFF),
+    ('Queue Time',        11,   1, U8,    None, None),
+    ('PTT Delay',         12,   1, U8,    None, None),
+    ('CALLSIGN',          13,   7, STR,   b'\xff', None),
+    ('SSID',              20,   1, U8,    None, [str(x) for x in range(16)]),
+    ('MIC-E Enable',      21,   1, U8,    None, ONOFF),
+    ('MIC-E Code',        22,   1, U8,    None, ['Off Duty','En Route','In Service','Returning','Committed','Special','Priority','Emergency']),
+    ('Type',              23,   1, STR,   b'\xff', None),
+    ('Icon 1',            24,   2, STR,   b'\xff', None),
+    ('BT Out 2',          26,   1, U8,    None, ['Off','GPS','Rotator']),
+    ('BT Out 1',          27,   1, U8,    None, ['Off','KISS hex','UI','GPWPL','KISS ascii']),
+    ('',                  28,   9, CONST, b'\x01\x00\x01\x01\x01\x01\x01\x01w', None),
+    ('Latitude',          37,  10, STR,   b'\x00', None),
+    ('Site Type',         47,   1, U8,    None, ['Fixed','Mobile','Weather']),
+    ('GPS Enable',        48,   1, U8,    None, ONOFF),
+    ('Timezone Offset',   49,   1, U8,    None, None),
+    ('GPS Save',          50,   1, U8,    None, ONOFF),
+    ('Beep RX',           51,   1, U8,    None, ONOFF),
+    ('Beep TX',           52,   1, U8,    None, ONOFF),
+    ('Longitude',         53,  10, STR,   b'\x00', None),
+    ('BT Enable',         63,   1, U8,    None, ONOFF),
+    ('Pressure Enable',   64,   1, U8,    None, ONOFF),
+    ('Voltage Enable',    65,   1, U8,    None, ONOFF),
+    ('Temperature Enable',66,   1, U8,    None, ONOFF),
+    ('Mileage Enable',    67,   1, U8,    None, ONOFF),
+    ('Satellite Enable',  68,   1, U8,    None, ONOFF),
+    ('Message',           69,  62, STR,   b'\xff', None),
+    ('',                 131,   4, CONST, b'\xff\xff1,', None),     # the frequency string is '1,F1,F2,0,3,0,0\r\n'
+    ('Frequency 1',      135,   8, STR,   b'\x00', None),
+    ('',                 143,   1, CONST, b',', None),
+    ('Frequency 2',      144,   8, STR,   b'\x00', None),
+    ('',                 152,  13, CONST, b',0,3,0,0\r\n\x00\xff\xff', None),
+    ('Module Power',     165,   1, U8,    None, ['Off','On','Tx Only','Rx Only']),
+    ('Module Volume',    166,   1, U8,    None, None),
+    ('Module Mic',       167,   1, U8,    None, None),
+    ('',                 168,   1, CONST, b'\x00', None),
+    ('Auto Poweroff',    169,   1, U8,    None, None),
+    ('',                 170,  10, CONST, b'\x01' * 10, None),
+    ('Wifi Enable',      180,   1, U8,    None, ONOFF),
+    ('',                 181,   3, CONST, b'\x01\x01\x01', None),
+    ('IP Protocol',      184,   1, U8,    None, ['UDP','TCP']),
+    ('IP Port',          185,   2, U16,   None, None),
+    ('',                 187,   5, CONST, b'\x00' * 5, None),
+    ('Odometer Enable',  192,   1, U8,    None, ONOFF),
+    ('Icon 2',           193,   2, STR,   b'\xff', None),
+    ('Icon 2 Time',      195,   2, U16,   None, None),
+    ('IP Address',       197,  31, STR,   b'\x00', None),
+    ('',                 228,  33, CONST, b'\xff' * 33, None),
+    ('Wifi Name',        261,  16, STR,   b'\x00', None),
+    ('Wifi Code',        277,  16, STR,   b'\x00', None),
+    ('',                 293,   9, CONST, b'START1\x00\x01\x00', None),
+    ('Altitude',         302,   2, U16,   None, None),
+    ('',                 304,   3, CONST, b'\xff\xff\xff', None),
+    ('Last Position',    307,   1, U8,    None, ONOFF),
+    ('Six Knots',        308,   1, U8,    None, ONOFF),
+    ('Stop 30m Alarm',   309,   1, U8,    None, ONOFF),
+    ('Stop 60m Emergency',310,  1, U8,    None, ONOFF),
+    # no idea what these bytes mean, but they don't change
+    ('',                 311, 126, CONST, b'\x01\x01' + b'\xff' * 8
+                                        + b'\x08\x08\x08\x08\xc0\xa8\x01\x9b\xc0\xa8'
+                                        + b'\x01\x01\xff\xff\xff\x00\xdc\x01\x02\t'
+                                        + b'\xff' * 16 + b'o(\x9b\x7f'
+                                        + b'\x11\x08E \xbd*\xad\x8eB^'
+                                        + b'\x00\x00' + b'\xff' * 64, None),
+    ('Emergency Message',437,  32, STR,   b'\xff', None),
+    ('',                 469,   1, CONST, b'\x00', None),
+    ('Brightness',       470,   1, U8,    None, ['Normal','Auto','High']),
+    ('Alert Enable',     471,   1, U8,    None, ONOFF),
+    ('Volume TX',        472,   1, U8,    None, VOLUMES),
+    ('Volume RX',        473,   1, U8,    None, VOLUMES),
+    ('DIGI Delay',       474,   1, U8,    None, ['0s','1s','2s','3s','4s','5s']),
+    ('DIGI Channel',     475,   1, U8,    None, CHANNELS),
+    ('Beacon Channel',   476,   1, U8,    None, CHANNELS),
+    ('Remote Code',      477,   7, STR,   b'\xff', None),
+    ('Backlight Timeout',484,   1, U8,    None, None),
+    ('PATH 1',           485,   7, STR,   b'\xff', None),
+    ('PATH 1 Hops',      492,   1, U8,    None, None),
+    ('PATH 2',           493,   7, STR,   b'\xff', None),
+    ('PATH 2 Hops',      500,   1, U8,    None, None),
+    ('DIGI 1',           501,   7, STR,   b'\xff', None),
+    ('DIGI 1 Enable',    508,   1, U8,    None, ONOFF),
+    ('DIGI 2',           509,   7, STR,   b'\xff', None),
+    ('DIGI 2 Enable',    516,   1, U8,    None, ONOFF),
+)
+
+# byte ranges (start, end) the device changes on its own, ignored when comparing images
+# the floats after the network block look like the last GPS fix/odometer
+VOLATILE = (
+    (357, 371),
+)
+
+
+########## Field conversions
+def decodeStr(data, pad):
+    # text ends at the first 0x00, anything after it is padding
+    text = data.split(b'\x00', 1)[0]
+    if pad != b'\x00': text = text.rstrip(pad)
+    return text.decode('utf-8')
+
+def encodeStr(value, width, pad):
+    # end the string with 0x00 if it is short and pad out to the full width
+    data = str(value).encode('utf-8')[:width]
+    if len(data) < width:
+        data += b'\x00' + pad * (width - len(data) - 1)
+    return data
+
+
+class Codec:
+    # a compiled pack/unpack plan for one image layout
+    def __init__(self, fields, size=IMAGE_SIZE):
+        self.fields = fields
+        self.size = size
+        self.names = []         # field names in image order
+        self.info = {}          # name -> (offset, width, kind, pad, options)
+        self.template = bytearray(size)
+        self._decode = []       # (name, struct index, pad) for every field
+        self._encode = []       # (name, struct index, width, pad) for every field
+        self._values = []       # struct values, constants pre-filled
+        self._fields = {}       # name -> (offset, width, struct or None, pad) for single field access
+
+        fmt = '>'
+        offset = 0
+        for index, (name, start, width, kind, pad, options) in enumerate(fields):
+            # the table must describe every byte, in order, exactly once
+            if start != offset:
+                raise ValueError("Layout gap or overlap at offset " + str(start) + " (" + name + ")")
+            offset += width
+
+            if kind == U8:
+                if width != 1: raise ValueError("U8 field " + name + " must be 1 byte")
+                fmt += 'B'
+            elif kind == U16:
+                if width != 2: raise ValueError("U16 field " + name + " must be 2 bytes")
+                fmt += 'H'
+            elif kind in (STR, CONST):
+                fmt += str(width) + 's'
+            else:
+                raise ValueError("Unknown field kind " + str(kind))
+
+            if kind == CONST:
+                if len(pad) != width: raise ValueError("Constant at offset " + str(start) + " is not " + str(width) + " bytes")
+                self.template[start:start + width] = pad
+                self._values.append(pad)
+                continue
+
+            self.names.append(name)
+            self.info[name] = (start, width, kind, pad, options)
+            self._decode.append((name, index, pad if kind == STR else None))
+            self._encode.append((name, index, width if kind == STR else 0, pad))
+            self._values.append(0 if kind != STR else b'')
+            single = struct.Struct('>B' if kind == U8 else '>H') if kind != STR else None
+            self._fields[name] = (start, width, single, pad)
+
+        if offset != size:
+            raise ValueError("Layout covers " + str(offset) + " bytes, expected " + str(size))
+        self.struct = struct.Struct(fmt)
+        self.template = bytes(self.template)
+
+    def decode(self, raw, config=None):
+        # unpack an image into a config dictionary
+        if config is None: config = {}
+        values = self.struct.unpack_from(raw)
+        for name, index, pad in self._decode:
+            value = values[index]
+            config[name] = value if pad is None else decodeStr(value, pad)
+        return config
+
+    def encode(self, config, buf=None):
+        # pack a config dictionary into buf (a preallocated bytearray) and return it
+        if buf is None: buf = bytearray(self.size)
+        values = self._values[:]
+        for name, index, width, pad in self._encode:
+            if width: values[index] = encodeStr(config[name], width, pad)
+            else: values[index] = int(config[name])
+        self.struct.pack_into(buf, 0, *values)
+        return buf
+
+    def decodeField(self, raw, name, base=0):
+        # decode one field straight from raw (bytes, bytearray, memoryview or mmap) at base
+        start, width, single, pad = self._fields[name]
+        if single is not None: return single.unpack_from(raw, base + start)[0]
+        return decodeStr(bytes(raw[base + start:base + start + width]), pad)
+
+    def encodeField(self, buf, name, value, base=0):
+        # write one field in to a writable buffer at base, leaving every other byte alone
+        start, width, single, pad = self._fields[name]
+        if single is not None: single.pack_into(buf, base + start, int(value))
+        else: buf[base + start:base + start + width] = encodeStr(value, width, pad)
+        return start, start + width
+
+    def options(self, name):
+        # the enum labels for a field, or None for free form fields
+        return self.info[name][4]
+
+
+class configView(MutableMapping):
+    # a dictionary-like view of an image that decodes fields only when they are read
+    # reads are cached, writes go straight back into the buffer (which must be writable)
+    __slots__ = ('buf', 'base', 'codec', 'cache')
+
+    def __init__(self, buf, base=0, codec=None):
+        self.buf = buf                  # bytes (read-only), bytearray, memoryview or mmap
+        self.base = base                # where the image starts in buf
+        self.codec = codec or CODEC
+        self.cache = None               # decoded fields, created on first read
+
+    def __getitem__(self, name):
+        if self.cache is None: self.cache = {}
+        elif name in self.cache: return self.cache[name]
+        value = self.codec.decodeField(self.buf, name, self.base)
+        self.cache[name] = value
+        return value
+
+    def __setitem__(self, name, value):
+        if name not in self.codec.info: raise KeyError(name)
+        if isinstance(self.buf, bytes) or (isinstance(self.buf, memoryview) and self.buf.readonly):
+            raise TypeError("config view is read-only")
+        self.codec.encodeField(self.buf, name, value, self.base)
+        # forget the old value, the next read sees what actually landed in the buffer
+        if self.cache is not None: self.cache.pop(name, None)
+
+    def __delitem__(self, name):
+        raise TypeError("fields can't be removed from an image")
+
+    def __contains__(self, name):
+        return name in self.codec.info
+
+    def __iter__(self):
+        return iter(self.codec.names)
+
+    def __len__(self):
+        return len(self.codec.names)
+
+    def __repr__(self):
+        return 'configView(' + repr(dict(self)) + ')'
+
+
+class trackedConfig(dict):
+    # a config dictionary that remembers which fields were assigned since it was loaded,
+    # so only those need patching back into the image
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.changed = set()
+
+    def __setitem__(self, name, value):
+        dict.__setitem__(self, name, value)
+        self.changed.add(name)
+
+    def update(self, *args, **kwargs):
+        for name, value in dict(*args, **kwargs).items():
+            self[name] = value
+
+    def setdefault(self, name, value=None):
+        if name not in self: self[name] = value
+        return self[name]
+
+    def load(self, values):
+        # replace everything with freshly decoded values, nothing counts as changed
+        dict.clear(self)
+        dict.update(self, values)
+        self.changed.clear()
+
+
+def diffImages(old, new, codec=None):
+    # (field name, start, end) for every field whose bytes differ between two images
+    # bytes outside the decoded fields are reported with the name ''
+    codec = codec or CODEC
+    if old == new: return []
+    changes = []
+    for name, start, width, kind, pad, options in codec.fields:
+        if old[start:start + width] != new[start:start + width]:
+            changes.append((name if kind != CONST else '', start, start + width))
+    return changes
+
+
+def callsign(config):
+    # 'CALLSIGN-SSID' as APRS writes it, no '-0' for SSID 0
+    return config['CALLSIGN'] + ('-' + str(config['SSID']) if config['SSID'] else '')
+
+
+def parseValue(name, value, codec=None):
+    # turn a user supplied value into what the field stores, raising ValueError if it doesn't fit
+    # enum fields take either the index or the label, e.g. 'Site Type'=2 or 'Site Type'=Weather
+    codec = codec or CODEC
+    if name not in codec.info: raise ValueError("Unknown field '" + str(name) + "'")
+    start, width, kind, pad, options = codec.info[name]
+    if kind == STR:
+        value = str(value)
+        if len(value.encode('utf-8')) > width:
+            raise ValueError(name + " must be at most " + str(width) + " characters")
+        return value
+    if options and isinstance(value, str) and not value.strip().isdigit():
+        labels = [o.lower() for o in options]
+        if value.strip().lower() not in labels:
+            raise ValueError(name + " must be one of: " + ', '.join(options))
+        return labels.index(value.strip().lower())
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(name + " must be a number") from None
+    limit = len(options) - 1 if options else (255 if kind == U8 else 65535)
+    if not 0 <= number <= limit:
+        raise ValueError(name + " must be between 0 and " + str(limit))
+    return number
+
+
+def sameImage(a, b, volatile=VOLATILE):
+    # true if two images match apart from the volatile bytes
+    if len(a) != len(b): return False
+    if a == b: return True
+    a = bytearray(a)
+    b = bytearray(b)
+    for start, end in volatile:
+        a[start:end] = b[start:end]
+    return a == b
+
+
+# the layout is compiled once, at import
+CODEC = Codec(FIELDS)
+
+
+########## Models
+# Each model names the firmware it matches, the layout its image follows and
+# the fields its firmware doesn't have. Unsupported fields are still decoded
+# and written back unchanged, so their bytes survive a round trip, but they
+# are left out of the menus and can't be set. Models sharing a layout share
+# one compiled Codec.
+
+# the display and alarm settings only the models with a screen have (the 'X1C5' menu)
+SCREEN_FIELDS = ('Brightness', 'Backlight Timeout', 'Alert Enable', 'Last Position',
+                 'Six Knots', 'Stop 30m Alarm', 'Stop 60m Emergency')
+
+class model:
+    def __init__(self, name, pattern, codec, hidden=()):
+        for field in hidden:
+            if field not in codec.info: raise ValueError(name + ": no field '" + field + "' to hide")
+        self.name = name
+        self.pattern = re.compile(pattern) if pattern else None   # matched against the AT+VER firmware string
+        self.codec = codec
+        self.hidden = frozenset(hidden)
+        self.names = [n for n in codec.names if n not in self.hidden]   # supported fields, in image order
+
+    def supports(self, name):
+        return name in self.codec.info and name not in self.hidden
+
+    def parseValue(self, name, value):
+        if name in self.hidden: raise ValueError(self.name + " has no '" + name + "' setting")
+        return parseValue(name, value, self.codec)
+
+    def __repr__(self):
+        return 'model(' + self.name + ')'
+
+CODECS = {id(FIELDS): CODEC}    # id(field table) -> compiled Codec, the tables hold lists so aren't hashable
+MODELS = []                 # in the order they are tried
+
+def compiled(fields):
+    # the Codec for a field table, compiled the first time it is asked for
+    if id(fields) not in CODECS: CODECS[id(fields)] = Codec(fields)
+    return CODECS[id(fields)]
+
+def register(name, pattern, fields=FIELDS, hidden=()):
+    m = model(name, pattern, compiled(fields), hidden)
+    MODELS.append(m)
+    DETECTED.clear()
+    return m
+
+# what the tool assumes when it hasn't talked to a device (e.g. editing a file): every field
+GENERIC = model('generic', None, CODEC)
+
+DETECTED = {}               # firmware string -> model
+
+def detect(version):
+    # the model for a firmware string such as '51X1C3_20180927A' or 'UV98_868_220430_D4'
+    if not version: return GENERIC
+    if version not in DETECTED:
+        DETECTED[version] = next((m for m in MODELS if m.pattern.search(version)), GENERIC)
+    return DETECTED[version]
+
+def byName(name):
+    for m in MODELS + [GENERIC]:
+        if m.name.lower() == name.lower(): return m
+    raise ValueError("Unknown model '" + name + "', one of: " + ', '.join(m.name for m in MODELS))
+
+# only the X1C3 table has been checked against a real image; the others share it
+register('X1C3', r'X1C3', hidden=SCREEN_FIELDS)
+register('X1C5', r'X1C5')
+register('HG-UV98', r'UV98')
@@ -0,0 +1,221 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import numpy as np
+import layout
+import archive
+from generate import readRows
+
+##########
+#
+# Layout discovery: which bytes of an image mean what
+#
+# Takes a corpus of captured images in capture order and works out, for every
+# offset, how many values it takes and which edits it changes with:
+#
+#   constant     never changes in the corpus, the bytes are listed
+#   field        changes together with a field (score = the fraction of the
+#                offset's changes and the field's edits that coincide)
+#   unexplained  changes, but with nothing in particular
+#
+# The edits come from an --edits CSV/JSONL with 'file' and 'field' columns:
+# the field(s) changed on the device, ';' separated, between the previous
+# capture and this one. Field names are free text, so new firmware can be
+# mapped before layout.py knows anything about it. Without --edits the edits
+# are taken from the fields the current layout already knows, which is how
+# the CONST runs that move with a known field are found.
+#
+# Everything is computed on (captures, 517) byte arrays in blocks, so a large
+# archive is mapped in one pass without Python loops over bytes.
+#
+#   python layoutmap.py captures/*.sav --edits edits.csv
+#   python layoutmap.py -a fleet.arc --model X1C5 --json
+#
+##########
+
+BLOCK = 8192            # captures per block
+
+def imageBytes(paths=(), arc=None):
+    # the corpus as a (n, 517) uint8 array, and a name for each capture
+    if arc is not None:
+        if len(arc) == 0: return np.zeros((0, layout.IMAGE_SIZE), dtype=np.uint8), []
+        records = np.ndarray(shape=(len(arc), arc.recordSize), dtype=np.uint8, buffer=arc.map, offset=archive.HEADER.size)
+        names = [arc.meta(k)[1] if arc.metaSize else '' for k in range(len(arc))]
+        return records[:, arc.metaSize:], [name or '#' + str(k) for k, name in enumerate(names)]
+    # read straight into a plain byte array: analytics.fromFiles' structured array drops the CONST bytes when it is copied
+    paths = [p for p in paths if os.path.isfile(p) and os.path.getsize(p) == layout.IMAGE_SIZE]
+    images = np.zeros((len(paths), layout.IMAGE_SIZE), dtype=np.uint8)
+    for i, path in enumerate(paths):
+        with open(path, 'rb') as f:
+            f.readinto(images[i])
+    return images, paths
+
+def readEdits(name, captures):
+    # capture index -> [fields edited just before it], matched by path, file name or archive source
+    index = {}
+    for k, capture in enumerate(captures):
+        index.setdefault(capture, k)
+        index.setdefault(os.path.basename(capture), k)
+    edits = {}
+    for number, row in enumerate(readRows(name), 1):
+        if not isinstance(row, dict): raise ValueError("row " + str(number) + " is not an object of column: value")
+        key = str(row.get('file', ''))
+        if key not in index: continue
+        fields = [f.strip() for f in str(row.get('field', '')).split(';') if f.strip()]
+        if fields: edits[index[key]] = fields
+    return edits
+
+def layoutNames(codec):
+    # the name layout.py gives each offset, '' for CONST bytes
+    names = [''] * codec.size
+    for name, start, width, kind, pad, options in codec.fields:
+        for offset in range(start, start + width):
+            names[offset] = name if kind != layout.CONST else ''
+    return names
+
+def knownEdits(changed, codec):
+    # (pairs, fields) which known fields changed between captures, from the byte changes
+    ranges = [(name, start, start + width) for name, start, width, kind, pad, options in codec.fields if kind != layout.CONST]
+    return np.stack([changed[:, start:end].any(axis=1) for name, start, end in ranges], axis=1), [r[0] for r in ranges]
+
+def scan(images, edits=None, codec=layout.CODEC):
+    # per-offset statistics over the corpus
+    # edits: capture index -> fields edited, or None to use the fields codec knows
+    n, size = images.shape
+    histogram = np.zeros(size * 256, dtype=np.int64)
+    bases = (np.arange(size, dtype=np.int32) * 256)[None, :]
+    changes = np.zeros(size, dtype=np.int64)
+    fields = sorted({f for names in edits.values() for f in names}) if edits is not None else None
+    together = None         # (fields, offsets): pairs where both the field was edited and the offset changed
+    edited = None           # (fields,): pairs where the field was edited
+
+    for first in range(0, n, BLOCK):
+        block = np.asarray(images[first:first + BLOCK])
+        histogram += np.bincount((block.astype(np.int32) + bases).ravel(), minlength=size * 256)
+        # the pairs that end in this block, the first one starting in the block before
+        rows = np.asarray(images[max(first - 1, 0):first + BLOCK])
+        changed = rows[1:] != rows[:-1]
+        if not len(changed): continue
+        changes += changed.sum(axis=0)
+        if edits is None:
+            which, names = knownEdits(changed, codec)
+            fields = fields or names
+        else:
+            which = np.zeros((len(changed), len(fields)), dtype=bool)
+            column = {f: j for j, f in enumerate(fields)}
+            start = max(first, 1)
+            for k in range(start, start + len(changed)):
+                for f in edits.get(k, ()): which[k - start, column[f]] = True
+        counts = which.T.astype(np.float32) @ changed.astype(np.float32)
+        together = counts if together is None else together + counts
+        edited = which.sum(axis=0) if edited is None else edited + which.sum(axis=0)
+
+    histogram = histogram.reshape(size, 256)
+    stats = {'captures': n, 'distinct': (histogram > 0).sum(axis=1), 'common': histogram.argmax(axis=1),
+             'changes': changes, 'fields': fields or [], 'field': np.full(size, -1), 'score': np.zeros(size)}
+    if together is not None and len(stats['fields']):
+        # Jaccard: the pairs where both happened over the pairs where either did
+        either = edited[:, None] + changes[None, :] - together
+        score = np.divide(together, either, out=np.zeros_like(together), where=either > 0)
+        stats['field'] = score.argmax(axis=0)
+        stats['score'] = score.max(axis=0)
+    return stats
+
+def classify(stats, threshold=0.5):
+    # (kind, field or None) for every offset
+    kinds = []
+    for offset in range(len(stats['changes'])):
+        if stats['distinct'][offset] <= 1: kinds.append(('constant', None))
+        elif stats['fields'] and stats['field'][offset] >= 0 and stats['score'][offset] >= threshold:
+            kinds.append(('field', stats['fields'][stats['field'][offset]]))
+        else: kinds.append(('unexplained', None))
+    return kinds
+
+def layoutMap(stats, codec=layout.CODEC, threshold=0.5):
+    # runs of neighbouring offsets that classify the same and sit in the same layout field
+    kinds = classify(stats, threshold)
+    known = layoutNames(codec)
+    runs = []
+    for offset, (kind, field) in enumerate(kinds):
+        last = runs[-1] if runs else None
+        if last and (last['kind'], last['field'], last['layout']) == (kind, field, known[offset]) and last['end'] == offset:
+            last['end'] += 1
+        else:
+            runs.append({'start': offset, 'end': offset + 1, 'kind': kind, 'field': field, 'layout': known[offset]})
+    for run in runs:
+        span = slice(run['start'], run['end'])
+        run['distinct'] = int(stats['distinct'][span].max())
+        run['changes'] = int(stats['changes'][span].max())
+        run['score'] = round(float(stats['score'][span].min()), 2) if run['kind'] == 'field' else None
+        if run['kind'] == 'constant': run['bytes'] = bytes(stats['common'][span].astype(np.uint8)).hex()
+    return runs
+
+def surprises(runs):
+    # runs that disagree with layout.py: CONST bytes that move, or field bytes that go with another field
+    found = []
+    for run in runs:
+        if run['layout'] == '' and run['kind'] != 'constant': found.append(run)
+        elif run['layout'] and run['kind'] == 'field' and run['field'] != run['layout']: found.append(run)
+    return found
+
+def printMap(runs, stats):
+    print("Captures:", stats['captures'], " fields correlated:", len(stats['fields']))
+    print("--------------------------------")
+    print(f"{'Start':>5s} {'End':>5s} {'Len':>4s}  {'Kind':11s} {'Goes with':20s} {'Score':>5s} {'Values':>6s}  {'layout.py':20s} Bytes")
+    for run in runs:
+        score = format(run['score'], '.2f') if run['score'] is not None else ''
+        print(f"{run['start']:5d} {run['end']:5d} {run['end'] - run['start']:4d}  {run['kind']:11s} {run['field'] or '':20s} "
+              f"{score:>5s} {run['distinct']:6d}  {run['layout'] or '(const)':20s} {run.get('bytes', '')[:32]}")
+    print("--------------------------------")
+    odd = surprises(runs)
+    if odd:
+        print("Disagrees with layout.py:")
+        for run in odd:
+            print(f"  {run['start']}-{run['end']}: layout.py says {run['layout'] or 'CONST'}, corpus says {run['kind']} {run['field'] or ''}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Map which image bytes are constant, which go with a field and which vary with nothing')
+    parser.add_argument("files", nargs='*', help = "Captured images, in capture order")
+    parser.add_argument("-a", "--archive", help = "Read the captures from an archive instead")
+    parser.add_argument("--edits", help = "CSV/JSONL with 'file' and 'field' columns: what was edited before each capture")
+    parser.add_argument("--model", default='generic', help = "Layout to compare against (and to take edits from without --edits)")
+    parser.add_argument("--threshold", type=float, default=0.5, help = "Lowest score that ties an offset to a field")
+    parser.add_argument("--json", action='store_true', help = "Print the map as JSON")
+    args = parser.parse_args()
+
+    try:
+        codec = layout.byName(args.model).codec
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+    if not args.files and not args.archive:
+        parser.print_usage()
+        sys.exit(1)
+
+    try:
+        arc = archive.archive(args.archive) if args.archive else None
+    except (archive.archiveError, OSError) as e:
+        print(e)
+        sys.exit(2)
+    try:
+        images, captures = imageBytes(args.files, arc)
+        if len(images) < 2:
+            print("Need at least two captures of", layout.IMAGE_SIZE, "bytes")
+            sys.exit(1)
+        try:
+            edits = readEdits(args.edits, captures) if args.edits else None
+        except (OSError, ValueError, csv.Error) as e:
+            parser.error("can't read --edits " + args.edits + ": " + str(e))
+        stats = scan(images, edits, codec)
+        del images          # the array must go before the archive's mmap closes
+    finally:
+        if arc is not None: arc.close()
+    runs = layoutMap(stats, codec, args.threshold)
+    if args.json: print(json.dumps({'captures': stats['captures'], 'fields': stats['fields'], 'runs': runs}, indent=2))
+    else: printMap(runs, stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import bisect
+import http.server
+import json
+import threading
+import time
+
+##########
+#
+# In-process timing and counters for the hot paths
+#
+# Spans time an operation (port open, version query, image read/write,
+# ExpandConfig, compressConfig) into a latency histogram and count bytes,
+# errors and timeouts against it. Everything can be dumped as JSON or
+# served as Prometheus text.
+#
+#   with METRICS.span('image_read', port=port) as span:
+#       raw = ...
+#       span.bytes = len(raw)
+#
+##########
+
+# latency buckets in seconds, from codec calls (microseconds) to serial timeouts
+BUCKETS = (0.00001, 0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)    # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+class span:
+    # one timed operation, see registry.span()
+    __slots__ = ('registry', 'name', 'labels', 'start', 'bytes', 'error')
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.bytes = 0          # set by the caller when data moved
+        self.error = None       # set by the caller (or an exception) when it failed
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        seconds = time.perf_counter() - self.start
+        if kind is not None and self.error is None: self.error = kind.__name__
+        self.registry.finish(self, seconds)
+        return False
+
+class registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}      # (name, labels) -> value
+        self.histograms = {}    # (name, labels) -> histogram
+        self.help = {}          # name -> the HELP text for Prometheus, see describe()
+        self.enabled = True
+
+    def describe(self, name, text):
+        # the one line Prometheus shows for a metric; without it the name is spelled out
+        self.help[name] = text
+
+    def key(self, name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled: return
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled: return
+        key = self.key(name, labels)
+        with self.lock:
+            if key not in self.histograms: self.histograms[key] = histogram()
+            self.histograms[key].observe(value)
+
+    def span(self, name, **labels):
+        return span(self, name, labels)
+
+    def finish(self, s, seconds):
+        if not self.enabled: return
+        key = self.key(s.name + '_seconds', s.labels)
+        with self.lock:
+            if key not in self.histograms: self.histograms[key] = histogram()
+            self.histograms[key].observe(seconds)
+            if s.bytes:
+                key = self.key(s.name + '_bytes_total', s.labels)
+                self.counters[key] = self.counters.get(key, 0) + s.bytes
+            if s.error:
+                key = self.key(s.name + '_errors_total', dict(s.labels, error=s.error))
+                self.counters[key] = self.counters.get(key, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def toJSON(self):
+        # counters and histograms, plus bytes/second for every span that moved data
+        with self.lock:
+            counters = [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(self.counters.items())]
+            histograms = []
+            for (n, l), h in sorted(self.histograms.items()):
+                entry = {'name': n, 'labels': dict(l), 'count': h.count, 'sum': h.sum,
+                         'mean': h.sum / h.count if h.count else 0.0,
+                         'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], h.counts))}
+                moved = self.counters.get((n[:-len('_seconds')] + '_bytes_total', l))
+                if moved and h.sum: entry['bytes_per_second'] = moved / h.sum
+                histograms.append(entry)
+        return {'counters': counters, 'histograms': histograms}
+
+    def toPrometheus(self, prefix='aprstool_'):
+        # text exposition format 0.0.4: each metric's # HELP and # TYPE lines, then its samples
+        def labelText(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items: return ''
+            return '{' + ','.join(k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                                  for k, v in items) + '}'
+        def header(n, kind):
+            if n.endswith('_seconds'): text = self.help.get(n, 'Seconds spent in ' + n[:-len('_seconds')].replace('_', ' '))
+            else: text = self.help.get(n, n.replace('_', ' '))
+            lines.append('# HELP ' + prefix + n + ' ' + text.replace('\\', '\\\\').replace('\n', '\\n'))
+            lines.append('# TYPE ' + prefix + n + ' ' + kind)
+        lines = []
+        with self.lock:
+            last = None
+            for (n, l), v in sorted(self.counters.items()):
+                if n != last: header(n, 'counter')
+                last = n
+                lines.append(prefix + n + labelText(l) + ' ' + str(v))
+            last = None
+            for (n, l), h in sorted(self.histograms.items()):
+                if n != last: header(n, 'histogram')
+                last = n
+                total = 0
+                for bound, count in zip([str(b) for b in BUCKETS] + ['+Inf'], h.counts):
+                    total += count
+                    lines.append(prefix + n + '_bucket' + labelText(l, [('le', bound)]) + ' ' + str(total))
+                lines.append(prefix + n + '_sum' + labelText(l) + ' ' + repr(h.sum))
+                lines.append(prefix + n + '_count' + labelText(l) + ' ' + str(h.count))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, name, form=None):
+        # write to a file, Prometheus text for .prom/.txt names unless form says otherwise
+        if form is None: form = 'prometheus' if name.endswith(('.prom', '.txt')) else 'json'
+        with open(name, 'w') as f:
+            if form == 'prometheus': f.write(self.toPrometheus())
+            else: json.dump(self.toJSON(), f, indent=2)
+
+    def serve(self, port, host='127.0.0.1'):
+        # serve /metrics as Prometheus text from a background thread
+        metrics = self
+        class handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] == '/metrics.json':
+                    body, kind = json.dumps(metrics.toJSON()).encode('utf-8'), 'application/json'
+                else:
+                    body, kind = metrics.toPrometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+                self.send_response(200)
+                self.send_header('Content-Type', kind)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        server = http.server.ThreadingHTTPServer((host, port), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+# the default registry, shared by everything in the process
+METRICS = registry()
@@ -0,0 +1,324 @@
+import argparse
+import heapq
+import os
+import random
+import selectors
+import socket
+import threading
+import time
+import tty
+
+##########
+#
+# X1C3 device simulator
+#
+# Every simulated device is a pseudo-terminal; point the tool's --port at the
+# slave name it prints. Devices can also listen on local TCP/UDP ports
+# (--network), standing in for units reached over WiFi. One selector loop
+# serves all of them, so hundreds of devices can run side by side in a
+# single thread.
+#
+# Protocol spoken (the same as x1c3 uses):
+#   AT+VER=?\r\n          -> 'VER = <firmware>|<vendor>|VOLTAGE = <volts>\r\n'
+#   AT+SET=READ\r\n       -> the 517 byte image, starting with 'HELLO'
+#   AT+SET=WRITE<512>     -> replaces the image after the 'HELLO' header
+#                            ('OK\r\n' with --ack, a half-received write is
+#                            dropped after FRAME_TIMEOUT of silence)
+#
+# --fifo emulates a device whose receive buffer overflows when the host
+# sends faster than it can take bytes in, the way cheap adapters overrun it.
+#
+##########
+
+IMAGE_SIZE = 517
+BAUD = 9600
+READ_CMD = b'AT+SET=READ'
+WRITE_CMD = b'AT+SET=WRITE'
+VER_CMD = b'AT+VER=?'
+FRAME_TIMEOUT = 0.5     # seconds of silence after which a partial write is thrown away
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_IMAGE = os.path.join(HERE, 'settings.sav')
+
+
+class simDevice:
+    def __init__(self, image, version='51X1C3_20180927A', voltage='4.12V',
+                 pace=False, baud=BAUD, jitter=0.0, drop=0.0, seed=None, pty=True, fifo=0, ack=False):
+        self.image = bytearray(image)   # the simulated device's config
+        self.version = version
+        self.voltage = voltage
+        self.pace = pace                # emulate the serial wire speed
+        self.baud = baud
+        self.jitter = jitter            # extra random delay per chunk, in seconds
+        self.drop = drop                # probability of losing each outgoing byte
+        self.random = random.Random(seed)
+        self.fifo = fifo                # receive buffer size in bytes, 0 never overflows
+        self.level = 0.0                # bytes waiting in that buffer
+        self.lastRx = 0.0               # when bytes last arrived
+        self.ack = ack                  # answer writes with 'OK'
+        self.overruns = 0               # bytes lost to a full receive buffer
+        self.inbuf = bytearray()        # bytes received but not yet handled
+        self.outbox = []                # heap of (due time, sequence, bytes) to send
+        self.sequence = 0
+        self.busyUntil = 0.0            # when the wire is free again
+        self.reads = 0                  # command counters
+        self.writes = 0
+        self.versions = 0
+
+        self.master = self.slave = None
+        if pty:
+            self.master, self.slave = os.openpty()
+            tty.setraw(self.slave)      # no echo or newline translation
+            os.set_blocking(self.master, False)
+            self.port = os.ttyname(self.slave)
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            if fd is None: continue
+            try: os.close(fd)
+            except OSError: pass
+
+    def output(self, data):
+        return os.write(self.master, data)
+
+    def send(self, data, now):
+        # queue a response, split in to chunks and timed like the real wire
+        if self.drop:
+            data = bytes(b for b in data if self.random.random() >= self.drop)
+        if not self.pace:
+            self.queue(now, data)
+            return
+        perByte = 10.0 / self.baud      # 8N1: ten bits per byte
+        start = max(now, self.busyUntil)
+        for i in range(0, len(data), 16):
+            chunk = data[i:i + 16]
+            start += len(chunk) * perByte
+            if self.jitter: start += self.random.uniform(0, self.jitter)
+            self.queue(start, chunk)
+        self.busyUntil = start
+
+    def queue(self, due, data):
+        self.sequence += 1
+        heapq.heappush(self.outbox, (due, self.sequence, data))
+
+    def receive(self, data, now):
+        # what survives the receive buffer, which empties at the wire speed
+        if self.inbuf and now - self.lastRx > FRAME_TIMEOUT: self.inbuf.clear()
+        if self.fifo:
+            self.level = max(0.0, self.level - (now - self.lastRx) * self.baud / 10.0)
+            room = max(0, int(self.fifo - self.level))
+            if len(data) > room:
+                self.overruns += len(data) - room
+                data = data[:room]
+            self.level += len(data)
+        self.lastRx = now
+        return data
+
+    def feed(self, data, now):
+        # handle whatever complete commands are in the input buffer
+        self.inbuf += self.receive(data, now)
+        while True:
+            # line endings between commands are ignored
+            while self.inbuf[:1] in (b'\r', b'\n'): del self.inbuf[:1]
+            if not self.inbuf: return
+
+            if self.inbuf.startswith(WRITE_CMD):
+                # a write is the command followed by the image minus its header
+                need = len(WRITE_CMD) + IMAGE_SIZE - 5
+                if len(self.inbuf) < need: return
+                self.image[5:] = self.inbuf[len(WRITE_CMD):need]
+                del self.inbuf[:need]
+                self.writes += 1
+                if self.ack: self.send(b'OK\r\n', now)
+                continue
+
+            end = self.inbuf.find(b'\r\n')
+            if end < 0:
+                # wait for the rest of the line, unless it can't be a command
+                if len(self.inbuf) > 64: self.inbuf.clear()
+                return
+            line = bytes(self.inbuf[:end])
+            del self.inbuf[:end + 2]
+            if line == VER_CMD:
+                self.versions += 1
+                self.send(('VER = ' + self.version + '|BH4TDV|VOLTAGE = ' + self.voltage + '\r\n').encode('utf-8'), now)
+            elif line == READ_CMD:
+                self.reads += 1
+                self.send(bytes(self.image), now)
+
+    def flush(self, now):
+        # write out everything that is due, return when the next chunk is due
+        while self.outbox and self.outbox[0][0] <= now:
+            due, seq, data = heapq.heappop(self.outbox)
+            try:
+                written = self.output(data)
+            except BlockingIOError:
+                written = 0
+            if written < len(data):
+                # the pty (or socket) is full, send the rest shortly
+                heapq.heappush(self.outbox, (now + 0.001, seq, data[written:]))
+                break
+        return self.outbox[0][0] if self.outbox else None
+
+
+class netDevice(simDevice):
+    # a simulated device reached over TCP or UDP instead of a pty
+    def __init__(self, image, kind='tcp', host='127.0.0.1', **options):
+        simDevice.__init__(self, image, pty=False, **options)
+        self.kind = kind
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM if kind == 'tcp' else socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, 0))
+        if kind == 'tcp': self.sock.listen(8)
+        self.sock.setblocking(False)
+        self.client = None              # the connected TCP socket
+        self.peer = None                # where UDP replies go
+        self.port = kind + '://' + host + ':' + str(self.sock.getsockname()[1])
+
+    def output(self, data):
+        # with nobody connected the bytes are lost, as on a serial line nobody listens to
+        if self.kind == 'tcp':
+            if self.client is None: return len(data)
+            return self.client.send(data)
+        if self.peer is None: return len(data)
+        return self.sock.sendto(data, self.peer)
+
+    def close(self):
+        for sock in (self.client, self.sock):
+            if sock is not None: sock.close()
+        self.client = None
+
+
+class simulator:
+    # runs any number of simDevices from one background thread
+    def __init__(self):
+        self.devices = []
+        self.selector = selectors.DefaultSelector()
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.wakeRead, self.wakeWrite = os.pipe()
+        self.selector.register(self.wakeRead, selectors.EVENT_READ, None)
+
+    def add(self, image, **options):
+        device = simDevice(image, **options)
+        with self.lock:
+            self.devices.append(device)
+            self.selector.register(device.master, selectors.EVENT_READ, (device, 'pty'))
+        os.write(self.wakeWrite, b'x')
+        return device
+
+    def addNetwork(self, image, kind='tcp', **options):
+        # a device listening on a local TCP or UDP port, for the network transport
+        device = netDevice(image, kind, **options)
+        with self.lock:
+            self.devices.append(device)
+            self.selector.register(device.sock, selectors.EVENT_READ, (device, kind))
+        os.write(self.wakeWrite, b'x')
+        return device
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        os.write(self.wakeWrite, b'x')
+        if self.thread: self.thread.join()
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None: self.selector.unregister(key.fileobj)
+        for device in self.devices:
+            device.close()
+        self.devices = []
+        os.close(self.wakeRead)
+        os.close(self.wakeWrite)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def run(self):
+        timeout = None
+        while self.running:
+            for key, events in self.selector.select(timeout):
+                if key.data is None:
+                    os.read(self.wakeRead, 4096)
+                    continue
+                device, kind = key.data
+                try:
+                    if kind == 'pty':
+                        data = os.read(key.fd, 4096)
+                    elif kind == 'tcp':
+                        # a new connection replaces the old one, like a single serial line
+                        client, address = device.sock.accept()
+                        client.setblocking(False)
+                        if device.client is not None:
+                            self.selector.unregister(device.client)
+                            device.client.close()
+                        device.client = client
+                        self.selector.register(client, selectors.EVENT_READ, (device, 'client'))
+                        continue
+                    elif kind == 'client':
+                        data = device.client.recv(4096)
+                        if not data:
+                            self.selector.unregister(device.client)
+                            device.client.close()
+                            device.client = None
+                            continue
+                    else:
+                        data, device.peer = device.sock.recvfrom(65536)
+                except (BlockingIOError, OSError):
+                    continue
+                device.feed(data, time.monotonic())
+
+            now = time.monotonic()
+            timeout = None
+            with self.lock:
+                devices = list(self.devices)
+            for device in devices:
+                due = device.flush(now)
+                if due is not None:
+                    wait = max(0.0, due - now)
+                    timeout = wait if timeout is None else min(timeout, wait)
+
+
+def loadImage(name):
+    with open(name, 'rb') as f:
+        return f.read()
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate X1C3 devices on pseudo-terminals')
+    parser.add_argument("-n", "--count", type=int, default=1, help = "Number of devices to simulate")
+    parser.add_argument("-f", "--file", default=DEFAULT_IMAGE, help = "Initial config image")
+    parser.add_argument("--version", default='51X1C3_20180927A', help = "Firmware string to report")
+    parser.add_argument("--voltage", default='4.12V', help = "Battery voltage to report")
+    parser.add_argument("--network", choices=['tcp','udp'], help = "Listen on local TCP/UDP ports instead of ptys")
+    parser.add_argument("--pace", action='store_true', help = "Emulate 9600 baud timing")
+    parser.add_argument("--jitter", type=float, default=0.0, help = "Random extra delay per chunk, seconds")
+    parser.add_argument("--drop", type=float, default=0.0, help = "Probability of dropping each byte sent")
+    parser.add_argument("--fifo", type=int, default=0, help = "Receive buffer size, bytes beyond it are lost (0 = unlimited)")
+    parser.add_argument("--ack", action='store_true', help = "Answer writes with 'OK'")
+    args = parser.parse_args()
+
+    image = loadImage(args.file)
+    sim = simulator()
+    for x in range(args.count):
+        options = dict(version=args.version, voltage=args.voltage, pace=args.pace, jitter=args.jitter, drop=args.drop, fifo=args.fifo, ack=args.ack)
+        if args.network: device = sim.addNetwork(image, args.network, **options)
+        else: device = sim.add(image, **options)
+        print(device.port)
+    sim.start()
+    print("Simulating", args.count, "device(s), Ctrl-C to stop")
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+
+
+if __name__ == "__main__":
+    main()
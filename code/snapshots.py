@@ -0,0 +1,284 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+import zlib
+import layout
+
+##########
+#
+# Snapshot history of every image read, written or saved
+#
+# Images are stored once, keyed by their SHA-256, in a SQLite file. The first
+# image is kept whole (zlib) and later ones as the zlib of their XOR against
+# a whole image: the unit's own base if it has one, else the newest base in
+# the store. Near-identical images XOR to almost all zeros, so each costs a
+# few dozen bytes. Deltas are always against a whole image, never another
+# delta, so restoring anything is one decompress and one XOR.
+#
+# A unit is where the image came from or went to: a port, or a file path.
+# Seeing the same image on a unit twice in a row adds nothing.
+#
+#   snapshots.py log /dev/ttyUSB0
+#   snapshots.py diff 41                     (with the unit's previous snapshot)
+#   snapshots.py diff 3f2a9c 41
+#   snapshots.py restore 41 -f settings.sav
+#   snapshots.py restore 41 -p /dev/ttyUSB0
+#   snapshots.py add images/*.sav
+#
+##########
+
+DEFAULT_PATH = os.path.expanduser('~/.local/share/aprstool/snapshots.db')
+DELTA_LIMIT = 0.5       # store a delta only if it is under half the size of the whole image
+
+def xor(a, b):
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+class snapshotError(Exception):
+    pass
+
+class snapshotStore:
+    # objects: one row per distinct image, whole or a delta against a whole one
+    # snapshots: one row per time an image was seen on a unit, pointing at its object
+    ROW = ('SELECT s.id, s.time, s.unit, s.event, lower(hex(o.hash)), s.version, s.callsign '
+           'FROM snapshots s JOIN objects o ON o.id = s.object ')
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.ready = False
+
+    def connect(self):
+        # a connection per call, so the fleet and daemon threads can share the store
+        if not self.ready: os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=10)
+        if not self.ready:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS objects (id INTEGER PRIMARY KEY, hash BLOB UNIQUE, base INTEGER, data BLOB)')
+            db.execute('CREATE TABLE IF NOT EXISTS snapshots ('
+                       'id INTEGER PRIMARY KEY, time REAL, unit TEXT, event TEXT, object INTEGER, version TEXT, callsign TEXT)')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_unit ON snapshots (unit, id)')
+            self.ready = True
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    ########## Storing
+    def add(self, image, unit, event, version=''):
+        # record image as the unit's latest snapshot, returns its hash (None if it isn't an image)
+        image = bytes(image)
+        if len(image) != layout.IMAGE_SIZE or not image.startswith(layout.HEADER): return None
+        digest = hashlib.sha256(image).digest()
+        try:
+            db = self.connect()
+        except (sqlite3.Error, OSError) as e:
+            print("Couldn't record snapshot:", e, file=sys.stderr)
+            return None
+        try:
+            with db:
+                # take the write lock before looking, so two writers can't both miss and insert the same image
+                db.execute('BEGIN IMMEDIATE')
+                row = db.execute('SELECT id FROM objects WHERE hash = ?', (digest,)).fetchone()
+                last = self.latest(db, unit)
+                if row and last and last[0] == row[0]: return digest.hex()
+                number = row[0] if row else self.store(db, image, digest, last)
+                db.execute('INSERT INTO snapshots (time, unit, event, object, version, callsign) VALUES (?, ?, ?, ?, ?, ?)',
+                           (time.time(), unit, event, number, version, self.callsign(image)))
+            return digest.hex()
+        except (sqlite3.Error, snapshotError) as e:
+            print("Couldn't record snapshot:", e, file=sys.stderr)
+            return None
+        finally:
+            db.close()
+
+    def latest(self, db, unit):
+        # (object id, its base) of the unit's last snapshot, or None
+        return db.execute('SELECT o.id, o.base FROM snapshots s JOIN objects o ON o.id = s.object '
+                          'WHERE s.unit = ? ORDER BY s.id DESC LIMIT 1', (unit,)).fetchone()
+
+    def store(self, db, image, digest, last):
+        # the object for a new image, returns its id: a delta if that is worth it, else the whole image
+        # the base is the whole image the unit's last snapshot is (or is a delta of), else the newest whole image
+        whole = zlib.compress(image, 9)
+        if last: base = last[1] or last[0]
+        else:
+            row = db.execute('SELECT id FROM objects WHERE base IS NULL ORDER BY id DESC LIMIT 1').fetchone()
+            base = row[0] if row else None
+        if base is not None:
+            delta = zlib.compress(xor(image, self.load(db, base)), 9)
+            if len(delta) < len(whole) * DELTA_LIMIT:
+                return db.execute('INSERT INTO objects (hash, base, data) VALUES (?, ?, ?)', (digest, base, delta)).lastrowid
+        return db.execute('INSERT INTO objects (hash, base, data) VALUES (?, NULL, ?)', (digest, whole)).lastrowid
+
+    def callsign(self, image):
+        try:
+            return layout.callsign(layout.configView(image))
+        except (UnicodeDecodeError, ValueError):
+            return ''
+
+    ########## Reading
+    def load(self, db, number):
+        # the image of object number
+        row = db.execute('SELECT base, data FROM objects WHERE id = ?', (number,)).fetchone()
+        if row is None: raise snapshotError("No image " + str(number))
+        base, data = row
+        data = zlib.decompress(data)
+        return xor(data, self.load(db, base)) if base else data
+
+    def image(self, digest):
+        # the image with this (hex) hash
+        db = self.connect()
+        try:
+            row = db.execute('SELECT id FROM objects WHERE hash = ?', (bytes.fromhex(digest),)).fetchone()
+            if row is None: raise snapshotError("No image " + digest)
+            return self.load(db, row[0])
+        finally:
+            db.close()
+
+    def resolve(self, ref):
+        # a snapshot row (id, time, unit, event, hash, version, callsign) from an id or a hash prefix
+        db = self.connect()
+        try:
+            if ref.isdigit() and len(ref) < 6:
+                row = db.execute(self.ROW + 'WHERE s.id = ?', (int(ref),)).fetchone()
+            else:
+                found = db.execute('SELECT id FROM objects WHERE lower(hex(hash)) LIKE ?', (ref.lower() + '%',)).fetchall()
+                if len(found) > 1: raise snapshotError("'" + ref + "' matches " + str(len(found)) + " images, give more of the hash")
+                row = db.execute(self.ROW + 'WHERE s.object = ? ORDER BY s.id DESC LIMIT 1', found[0]).fetchone() if found else None
+            if row is None: raise snapshotError("No snapshot '" + ref + "'")
+            return row
+        finally:
+            db.close()
+
+    def previous(self, row):
+        # the snapshot of the same unit before row, or None
+        db = self.connect()
+        try:
+            return db.execute(self.ROW + 'WHERE s.unit = ? AND s.id < ? ORDER BY s.id DESC LIMIT 1', (row[2], row[0])).fetchone()
+        finally:
+            db.close()
+
+    def log(self, unit=None, limit=None):
+        # snapshots newest first, of one unit (a port, a file or a callsign with or without the SSID) or all of them
+        db = self.connect()
+        try:
+            sql = self.ROW
+            params = ()
+            if unit:
+                sql += "WHERE s.unit = ? OR s.callsign = ? OR s.callsign LIKE ? || '-%' "
+                params = (unit, unit, unit)
+            sql += 'ORDER BY s.id DESC'
+            if limit: sql += ' LIMIT ' + str(int(limit))
+            return db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+
+    def stats(self):
+        # (snapshots, images, bytes stored, whole images, bytes the images would take as files)
+        db = self.connect()
+        try:
+            snapshots = db.execute('SELECT COUNT(*) FROM snapshots').fetchone()[0]
+            images, stored, whole = db.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0), '
+                                               'COALESCE(SUM(base IS NULL), 0) FROM objects').fetchone()
+            return snapshots, images, stored, whole, snapshots * layout.IMAGE_SIZE
+        finally:
+            db.close()
+
+# the default store, shared by every x1c3 object
+SNAPSHOTS = snapshotStore()
+
+
+def diff(old, new, model=layout.GENERIC):
+    # (field, old value, new value) for every decoded field that differs, then (start, end) for other changed bytes
+    fields, other = [], []
+    before = layout.configView(old, codec=model.codec)
+    after = layout.configView(new, codec=model.codec)
+    for name, start, end in layout.diffImages(old, new, model.codec):
+        if name and name != 'Header': fields.append((name, before[name], after[name]))
+        else: other.append((start, end))
+    return fields, other
+
+def describe(row):
+    number, when, unit, event, digest, version, callsign = row
+    return f"{number:5d}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))}  {digest[:12]}  {event:6s} {callsign:10s} {unit}"
+
+def restoreDevice(image, port, verify=True):
+    from APRStool import x1c3, POOL
+    device = x1c3()
+    device.setPort(port)
+    device.raw = image
+    try:
+        if not device.readSerialVersion(): return False
+        return device.writeSerialDeviceChecked(True, verify)
+    finally:
+        POOL.closeAll()
+
+def main():
+    parser = argparse.ArgumentParser(description='History of the config images read, written and saved')
+    parser.add_argument("--db", default=DEFAULT_PATH, help = "Snapshot store")
+    commands = parser.add_subparsers(dest='command', required=True)
+    log = commands.add_parser('log', help = "List snapshots, newest first")
+    log.add_argument("unit", nargs='?', help = "Only this port, file or callsign")
+    log.add_argument("-n", "--limit", type=int, default=50)
+    show = commands.add_parser('diff', help = "Field changes between two snapshots")
+    show.add_argument("first", help = "Snapshot id or hash prefix")
+    show.add_argument("second", nargs='?', help = "Compare first with this, default is the same unit's snapshot before first")
+    restore = commands.add_parser('restore', help = "Put a snapshot back")
+    restore.add_argument("ref", help = "Snapshot id or hash prefix")
+    restore.add_argument("-f", "--file", help = "Write the image to this file")
+    restore.add_argument("-p", "--port", help = "Write the image to the device on this port")
+    restore.add_argument("--no_verify", action='store_true', help = "Don't read the device back after writing")
+    add = commands.add_parser('add', help = "Record image files")
+    add.add_argument("files", nargs='+')
+    add.add_argument("--unit", help = "Record them all under this unit instead of their paths")
+    commands.add_parser('stats', help = "How much space the store takes")
+    args = parser.parse_args()
+
+    store = snapshotStore(args.db)
+    try:
+        if args.command == 'log':
+            for row in store.log(args.unit, args.limit): print(describe(row))
+        elif args.command == 'diff':
+            if args.second:
+                old, new = store.resolve(args.first), store.resolve(args.second)
+            else:
+                new = store.resolve(args.first)
+                old = store.previous(new)
+                if old is None: raise snapshotError("Snapshot " + str(new[0]) + " is the first for " + new[2])
+            print("-", describe(old))
+            print("+", describe(new))
+            fields, other = diff(store.image(old[4]), store.image(new[4]), layout.detect(new[5]) if new[5] else layout.GENERIC)
+            for name, a, b in fields: print(f"  {name}: {a!r} -> {b!r}")
+            for start, end in other: print(f"  bytes {start}-{end}")
+            if not fields and not other: print("  identical")
+        elif args.command == 'restore':
+            row = store.resolve(args.ref)
+            image = store.image(row[4])
+            if not args.file and not args.port: parser.error("restore needs -f FILE and/or -p PORT")
+            if args.file:
+                with open(args.file, 'wb') as f:
+                    f.write(image)
+                store.add(image, os.path.abspath(args.file), 'file')
+                print("Restored", row[4][:12], "to", args.file)
+            if args.port:
+                result = restoreDevice(image, args.port, not args.no_verify)
+                if not result: raise snapshotError("Write to " + args.port + " failed")
+                print("Restored", row[4][:12], "to", args.port, "(" + result + ")")
+        elif args.command == 'add':
+            added = 0
+            for name in args.files:
+                with open(name, 'rb') as f:
+                    if store.add(f.read(), args.unit or os.path.abspath(name), 'file'): added += 1
+                    else: print("Not an image:", name)
+            print(added, "image(s) recorded")
+        elif args.command == 'stats':
+            snapshots, images, stored, whole, raw = store.stats()
+            print(snapshots, "snapshots of", images, "images (" + str(whole), "whole, the rest deltas)")
+            print(stored, "bytes stored,", raw, "as files,", os.path.getsize(args.db), "on disk")
+    except (snapshotError, sqlite3.Error, OSError) as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
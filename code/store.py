@@ -0,0 +1,218 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+import layout
+from APRStool import x1c3
+
+##########
+#
+# Indexed SQLite store for config images
+#
+# Every image is kept whole (raw) next to one column per decoded field, so
+# queries such as "all units on 144.39 with DIGI 1 enabled" are plain
+# indexed lookups instead of grepping through .sav files. Text columns hold
+# the text without its padding, and the frequencies are REAL MHz, so
+# frequency_1=144.39 finds units whose image says '144.3900'.
+#
+#   store.py ingest images/ other.sav --port /dev/ttyUSB0
+#   store.py query frequency_1=144.39 digi_1_enable=1
+#
+##########
+
+DEFAULT_DB = 'images.db'
+BATCH = 2000            # rows per transaction when importing
+SCHEMA = 2              # PRAGMA user_version; 1 kept the frequencies as padded TEXT
+
+# fields that get their own index
+INDEXED = ('CALLSIGN', 'SSID', 'Frequency 1', 'Frequency 2', 'DIGI 1', 'DIGI 1 Enable',
+           'DIGI 2', 'DIGI 2 Enable', 'Site Type')
+
+# text fields that hold a number, stored and compared as REAL
+NUMERIC = ('Frequency 1', 'Frequency 2')
+
+def column(name):
+    # 'DIGI 1 Enable' -> 'digi_1_enable'
+    return ''.join(c.lower() if c.isalnum() else '_' for c in name)
+
+COLUMNS = [column(name) for name in layout.CODEC.names]
+NAMES = dict(zip(COLUMNS, layout.CODEC.names))
+
+def columnType(name):
+    if name in NUMERIC: return 'REAL'
+    return 'TEXT' if layout.CODEC.info[name][2] == layout.STR else 'INTEGER'
+
+def connect(path=DEFAULT_DB):
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    old = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'images'").fetchone() is not None
+    if old and db.execute('PRAGMA user_version').fetchone()[0] < SCHEMA:
+        # an older layout of the table: build the new one from the raw images it kept
+        with db:
+            db.execute('DROP INDEX IF EXISTS idx_firmware')
+            for name in INDEXED: db.execute('DROP INDEX IF EXISTS idx_' + column(name))
+            db.execute('ALTER TABLE images RENAME TO images_old')
+            create(db)
+            rows = [row(source, raw, firmware or '', added) for source, firmware, added, raw
+                    in db.execute('SELECT source, firmware, added, raw FROM images_old')]
+            insert(db, [r for r in rows if r is not None])
+            db.execute('DROP TABLE images_old')
+    create(db)
+    return db
+
+def create(db):
+    fields = [column(name) + ' ' + columnType(name) for name in layout.CODEC.names]
+    db.execute('CREATE TABLE IF NOT EXISTS images ('
+               'id INTEGER PRIMARY KEY, source TEXT UNIQUE, firmware TEXT, added REAL, raw BLOB, '
+               + ', '.join(fields) + ')')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_firmware ON images (firmware)')
+    for name in INDEXED:
+        db.execute('CREATE INDEX IF NOT EXISTS idx_' + column(name) + ' ON images (' + column(name) + ')')
+    db.execute('PRAGMA user_version = ' + str(SCHEMA))
+
+def number(text):
+    # a NUMERIC field's text as a float, None if it is empty or not a number
+    try:
+        return round(float(text), 6)
+    except ValueError:
+        return None
+
+def value(name, config):
+    # the column value of a field: padding stripped from text, NUMERIC text as a number
+    v = config[name]
+    if name in NUMERIC: return number(v)
+    return v.strip() if isinstance(v, str) else v
+
+def row(source, raw, firmware='', added=None):
+    # the values for one images row, or None if the image doesn't decode
+    if len(raw) != layout.IMAGE_SIZE or not raw.startswith(layout.HEADER): return None
+    try:
+        config = layout.CODEC.decode(raw)
+    except UnicodeDecodeError:
+        return None
+    return [source, firmware, added or time.time(), raw] + [value(name, config) for name in layout.CODEC.names]
+
+def insert(db, rows):
+    # write a batch of rows in one transaction, replacing earlier images from the same source
+    sql = ('INSERT OR REPLACE INTO images (source, firmware, added, raw, ' + ', '.join(COLUMNS)
+           + ') VALUES (' + ', '.join('?' * (len(COLUMNS) + 4)) + ')')
+    with db:
+        db.executemany(sql, rows)
+
+def imageFiles(paths):
+    # files as given, plus every *.sav below any directory
+    for path in paths:
+        if os.path.isdir(path):
+            for top, dirs, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith('.sav'): yield os.path.join(top, name)
+        else:
+            yield path
+
+def ingestFiles(db, paths):
+    # bulk import, returns (imported, skipped)
+    imported = skipped = 0
+    batch = []
+    for path in imageFiles(paths):
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except OSError as e:
+            print("Can't read", path, e)
+            skipped += 1
+            continue
+        values = row(os.path.abspath(path), raw)
+        if values is None:
+            skipped += 1
+            continue
+        batch.append(values)
+        if len(batch) >= BATCH:
+            insert(db, batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        insert(db, batch)
+        imported += len(batch)
+    return imported, skipped
+
+def ingestDevice(db, port):
+    device = x1c3()
+    device.setPort(port)
+    if not device.readSerialVersion() or not device.readSerialDevice(): return False
+    values = row('port:' + port, bytes(device.raw), device.version)
+    if values is None: return False
+    insert(db, [values])
+    return True
+
+def query(db, filters=(), where=None, limit=None):
+    # filters are 'column=value' strings, ANDed together and passed as parameters; returns sqlite rows
+    # where is raw SQL pasted into the query as it is: for the person running the query, never for data from elsewhere
+    clauses = []
+    params = []
+    for f in filters:
+        key, sep, text = f.partition('=')
+        key, text = key.strip(), text.strip()
+        if not sep or key not in COLUMNS + ['firmware', 'source']:
+            raise ValueError("Unknown filter " + f + ", columns are: " + ', '.join(COLUMNS))
+        kind = columnType(NAMES[key]) if key in COLUMNS else 'TEXT'
+        if kind == 'REAL':
+            if number(text) is None: raise ValueError(key + " takes a number, not " + repr(text))
+            params.append(number(text))
+        elif kind == 'INTEGER':
+            try: params.append(int(text))
+            except ValueError: raise ValueError(key + " takes a whole number, not " + repr(text))
+        else:
+            params.append(text)
+        clauses.append(key + ' = ?')
+    if where: clauses.append('(' + where + ')')
+    sql = 'SELECT source, firmware, callsign, ssid, frequency_1, frequency_2, digi_1_enable, digi_2_enable FROM images'
+    if clauses: sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' ORDER BY callsign, ssid'
+    if limit: sql += ' LIMIT ' + str(int(limit))
+    return db.execute(sql, params).fetchall()
+
+def main():
+    parser = argparse.ArgumentParser(description='Store and query X1C3 config images in SQLite')
+    parser.add_argument("-d", "--db", default=DEFAULT_DB, help = "Database file")
+    sub = parser.add_subparsers(dest='command', required=True)
+    ingest = sub.add_parser('ingest', help = "Import images from files, directories or devices")
+    ingest.add_argument("paths", nargs='*', help = "Image files or directories of *.sav files")
+    ingest.add_argument("-p", "--port", action='append', default=[], help = "Read a device (repeatable)")
+    find = sub.add_parser('query', help = "List images matching column=value filters")
+    find.add_argument("filters", nargs='*', help = "e.g. frequency_1=144.39 digi_1_enable=1")
+    find.add_argument("--where", help = "Extra SQL condition, used as written (e.g. \"frequency_1 BETWEEN 144 AND 146\")")
+    find.add_argument("--limit", type=int)
+    find.add_argument("--count", action='store_true', help = "Only print the number of matches")
+    sub.add_parser('columns', help = "List the queryable columns")
+    args = parser.parse_args()
+
+    db = connect(args.db)
+    if args.command == 'ingest':
+        start = time.perf_counter()
+        imported, skipped = ingestFiles(db, args.paths)
+        for port in args.port:
+            if ingestDevice(db, port): imported += 1
+            else: skipped += 1
+        print("Imported", imported, "image(s), skipped", skipped, "in", format(time.perf_counter() - start, '.2f'), "s")
+    elif args.command == 'query':
+        try:
+            rows = query(db, args.filters, args.where, args.limit)
+        except (ValueError, sqlite3.Error) as e:
+            print("Bad query:", e)
+            sys.exit(1)
+        if args.count:
+            print(len(rows))
+        else:
+            for source, firmware, call, ssid, f1, f2, d1, d2 in rows:
+                f1, f2 = [format(f, '.4f') if f is not None else '' for f in (f1, f2)]
+                print(f"{call + '-' + str(ssid):10s} {f1:9s} {f2:9s} DIGI1={d1} DIGI2={d2} {firmware or '':20s} {source}")
+            print(len(rows), "match(es)")
+    elif args.command == 'columns':
+        print('\n'.join(['source', 'firmware'] + COLUMNS))
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import os
+import sys
+
+# the tools are scripts side by side in code/, not a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'settings.sav')
+
+def sample():
+    with open(SAMPLE, 'rb') as f:
+        return f.read()
+
+import pytest
+
+@pytest.fixture(autouse=True)
+def private_state(tmp_path, monkeypatch):
+    # keep the image cache, tuning, discovered ports and snapshot history out of the user's home
+    import APRStool
+    import snapshots
+    monkeypatch.setattr(APRStool.CACHE, 'directory', str(tmp_path / 'cache'))
+    monkeypatch.setattr(APRStool.DISCOVERED, 'path', str(tmp_path / 'ports.json'))
+    monkeypatch.setattr(APRStool.TUNING, 'path', str(tmp_path / 'tuning.json'))
+    monkeypatch.setattr(snapshots.SNAPSHOTS, 'path', str(tmp_path / 'snapshots.db'))
+    monkeypatch.setattr(snapshots.SNAPSHOTS, 'ready', False)
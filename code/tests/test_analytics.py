@@ -0,0 +1,37 @@
+import collections
+import numpy as np
+import layout
+import analytics
+from conftest import sample
+
+def fleet():
+    # a few units: two share a callsign and SSID, one has WiFi on with no name
+    units = [('K7ABC', 9, 600, 0, ''), ('K7ABC', 9, 300, 1, 'home'), ('K7DEF', 0, 600, 1, ''), ('K7ABC', 1, 600, 0, 'x')]
+    images = []
+    for call, ssid, every, wifi, name in units:
+        config = layout.CODEC.decode(sample())
+        config.update({'CALLSIGN': call, 'SSID': ssid, 'Time Value': every, 'Wifi Enable': wifi, 'Wifi Name': name})
+        images.append(bytes(layout.CODEC.encode(config)))
+    return images
+
+def test_audits_agree_with_a_dictionary_loop():
+    raw = fleet()
+    images = analytics.fromBytes(b''.join(raw))
+    configs = [layout.CODEC.decode(r) for r in raw]
+    assert analytics.beaconHistogram(images) == dict(collections.Counter(c['Time Value'] for c in configs))
+    pairs = collections.Counter((c['CALLSIGN'], c['SSID']) for c in configs)
+    assert analytics.ssidCollisions(images) == [(call, ssid, n) for (call, ssid), n in sorted(pairs.items()) if n > 1]
+    assert analytics.wifiWithoutName(images).tolist() == [k for k, c in enumerate(configs) if c['Wifi Enable'] == 1 and not c['Wifi Name']]
+
+def test_text_only_strips_trailing_padding():
+    start, width, kind, pad = layout.CODEC.info['CALLSIGN'][:4]
+    assert pad == b'\xff'
+    cases = [b'A\xffB\xff\xff\xff\xff', b'AB\x00\xff\xff\xff\xff', b'\xffAB\x00\xffC\xff', b'ABCDEFG', b'\xff' * 7]
+    raw = []
+    for field in cases:
+        image = bytearray(sample())
+        image[start:start + width] = field
+        raw.append(bytes(image))
+    got = analytics.text(analytics.fromBytes(b''.join(raw)), 'CALLSIGN')
+    for row, field in zip(got, cases):
+        assert bytes(row).rstrip(b'\x00') == field.split(b'\x00', 1)[0].rstrip(pad)
@@ -0,0 +1,37 @@
+import archive
+from conftest import sample
+
+def test_views_survive_append(tmp_path):
+    # records handed out before an append keep working, and so does the archive
+    arc = archive.archive.create(str(tmp_path / 'images.arc'))
+    arc.append([sample()])
+    image = arc.image(0)
+    config = arc.config(0)
+    arc.append([sample(), sample()])
+    assert bytes(image) == sample()
+    assert config['CALLSIGN'] == arc.config(2)['CALLSIGN']
+    assert len(arc.retired) == 1
+    del image, config
+    arc.append([sample()])
+    assert arc.retired == []
+    assert len(arc) == 4
+    arc.close()
+
+def test_patch_cli_parses_values(tmp_path, capsys, monkeypatch):
+    path = str(tmp_path / 'images.arc')
+    with archive.archive.create(path) as arc:
+        arc.append([sample()])
+
+    def run(*argv):
+        monkeypatch.setattr('sys.argv', ['archive.py', path] + list(argv))
+        try:
+            archive.main()
+        except SystemExit as e:
+            return e.code
+        return 0
+
+    assert run('patch', '0', 'Site Type=Weather') == 0
+    with archive.archive(path) as arc:
+        assert arc.field(0, 'Site Type') == 2
+    assert run('patch', '0', 'SSID=300') == 1
+    assert 'SSID must be between' in capsys.readouterr().out
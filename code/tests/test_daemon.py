@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+import layout
+import simulator
+import aprsctl
+import daemon
+from conftest import sample
+
+@pytest.fixture
+def served():
+    # a daemon on a free localhost port, in front of one simulated device
+    with simulator.simulator() as sim:
+        unit = sim.add(sample())
+        service = daemon.daemon([unit.port])
+        server = service.serve('127.0.0.1', 0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        address = '127.0.0.1:' + str(server.server_address[1])
+        yield unit, address
+        server.shutdown()
+        service.stop()
+
+def call(address, method, path, params=None, body=None):
+    status, kind, data = aprsctl.request(address, method, path, params, body)
+    return status, json.loads(data) if kind.startswith('application/json') else data
+
+def test_get_is_cached(served):
+    unit, address = served
+    assert call(address, 'GET', '/get', {'name': 'CALLSIGN'}) == (200, {'name': 'CALLSIGN', 'value': 'K7SWI'})
+    assert call(address, 'GET', '/get', {'name': 'SSID'})[0] == 200
+    assert unit.reads == 1
+    assert call(address, 'GET', '/get', {'name': 'SSID', 'refresh': '1'})[0] == 200
+    assert unit.reads == 2
+
+def test_set_writes_only_the_changed_field(served):
+    unit, address = served
+    before = bytes(unit.image)
+    status, reply = call(address, 'POST', '/set', {'name': 'SSID', 'value': '7'})
+    assert status == 200 and [c['name'] for c in reply['changes']] == ['SSID']
+    time.sleep(0.1)
+    start, width = layout.CODEC.info['SSID'][:2]
+    changed = [k for k in range(len(before)) if before[k] != unit.image[k]]
+    assert changed and all(start <= k < start + width for k in changed)
+    assert unit.writes == 1
+    # the same value again changes nothing, so nothing is written
+    assert call(address, 'POST', '/set', {'name': 'SSID', 'value': '7'})[1]['changes'] == []
+    assert unit.writes == 1
+
+def test_unknown_port_and_unsupported_field(served):
+    unit, address = served
+    assert call(address, 'GET', '/get', {'name': 'CALLSIGN', 'port': '/dev/nothing'})[0] == 404
+    # the simulator says it is an X1C3, which has no screen settings
+    status, reply = call(address, 'GET', '/get', {'name': 'Brightness'})
+    assert status == 404 and 'Brightness' in reply['error']
+    assert call(address, 'GET', '/nowhere')[0] == 404
+
+def test_slow_request_is_a_504():
+    worker = daemon.portWorker('/dev/nothing')
+    try:
+        with pytest.raises(daemon.daemonError) as caught:
+            worker.call(time.sleep, 0.5, timeout=0.05)
+        assert caught.value.code == 504
+    finally:
+        worker.stop()
+
+def test_aprsctl_get(served):
+    unit, address = served
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, os.path.join(here, 'aprsctl.py'), '-s', address, 'get', 'CALLSIGN'],
+                            capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0 and result.stdout.strip() == 'K7SWI'
+    result = subprocess.run([sys.executable, os.path.join(here, 'aprsctl.py'), '-s', address, 'get', 'Brightness'],
+                            capture_output=True, text=True, timeout=30)
+    assert result.returncode == 1 and 'Brightness' in result.stderr
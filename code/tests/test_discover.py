@@ -0,0 +1,31 @@
+import os
+import tty
+import pytest
+import simulator
+import discover
+from APRStool import POOL
+from conftest import sample
+
+@pytest.fixture
+def dead():
+    # a serial port with nothing on the other end
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    yield os.ttyname(slave)
+    os.close(master)
+    os.close(slave)
+
+def test_live_device_and_dead_port(dead):
+    with simulator.simulator() as sim:
+        unit = sim.add(sample())
+        records = discover.discover([unit.port, dead], timeout=0.2)
+    assert [r['status'] for r in records] == ['ok', 'no device']
+    assert records[0]['version'] == '51X1C3_20180927A'
+    # each probe closed its own port
+    assert POOL.get(unit.port).ser is None and POOL.get(dead).ser is None
+
+def test_late_probe_closes_its_own_port(dead):
+    # the dead port takes longer than the deadline to give up; discover waits for it rather than closing under it
+    records = discover.discover([dead], timeout=0.4, deadline=0.1)
+    assert records[0]['status'] == 'timed out'
+    assert POOL.get(dead).ser is None
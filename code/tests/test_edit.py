@@ -0,0 +1,35 @@
+import layout
+from APRStool import x1c3
+from conftest import sample
+
+def unusual():
+    # a unit image whose CONST and VOLATILE bytes aren't what the layout table has
+    image = bytearray(sample())
+    image[30] ^= 0x5a                       # inside the CONST run at 28
+    image[layout.VOLATILE[0][0] + 2] ^= 0xa5
+    return bytes(image)
+
+def test_listing_changes_changes_nothing():
+    d = x1c3()
+    d.raw = unusual()
+    d.ExpandConfig()
+    d.config['SSID'] = 5
+    start, width = layout.CODEC.info['SSID'][:2]
+    assert d.changes() == [('SSID', start, start + width)]
+    assert d.changes() == [('SSID', start, start + width)]
+    assert bytes(d.image) == d.original and d.config.changed == {'SSID'}
+
+def test_edit_and_save_keeps_every_other_byte(tmp_path):
+    d = x1c3()
+    d.history = None
+    d.file = str(tmp_path / 'unit.sav')
+    d.raw = unusual()
+    d.ExpandConfig()
+    d.config['SSID'] = 5
+    d.changes()
+    d.compressConfig()
+    assert d.writeFile()
+    saved = (tmp_path / 'unit.sav').read_bytes()
+    start, width = layout.CODEC.info['SSID'][:2]
+    assert saved[start] == 5
+    assert saved[:start] + saved[start + width:] == unusual()[:start] + unusual()[start + width:]
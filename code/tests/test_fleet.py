@@ -0,0 +1,14 @@
+import simulator
+from APRStool import POOL
+from fleet import provision
+from conftest import sample
+
+def test_provision_writes_and_verifies():
+    image = bytearray(sample())
+    image[20] = 9
+    with simulator.simulator() as sim:
+        unit = sim.add(sample())
+        res = provision(unit.port, bytes(image))
+        assert res.status == 'ok'
+        assert unit.image == image
+    POOL.closeAll()
@@ -0,0 +1,27 @@
+import layout
+import generate
+from conftest import sample
+
+def test_bad_rows_are_reported_and_the_rest_built(tmp_path):
+    table = tmp_path / 'units.jsonl'
+    table.write_text('{"CALLSIGN": "K7ABC", "SSID": 9}\n'
+                     '[1, 2]\n'
+                     '42\n'
+                     '{"CALLSIGN": "MUCHTOOLONG"}\n'
+                     '{"CALLSIGN": "K7DEF"}\n')
+    for jobs in (1, 2):
+        results = list(generate.generate(generate.readRows(str(table)), sample(), jobs=jobs, batchSize=2))
+        assert [number for number, row, image, errors in results] == [1, 2, 3, 4, 5]
+        built = {number: image for number, row, image, errors in results if image is not None}
+        assert sorted(built) == [1, 5]
+        assert layout.callsign(layout.configView(built[1])) == 'K7ABC-9'
+        errors = {number: errors for number, row, image, errors in results}
+        assert 'list' in errors[2][0] and 'int' in errors[3][0]
+        assert 'CALLSIGN' in errors[4][0]
+
+def test_finished_image_is_validated():
+    # the overrides are fine but the base has an enum out of range, so no row builds
+    base = bytearray(sample())
+    base[layout.CODEC.info['Site Type'][0]] = 9
+    [(number, row, image, errors)] = generate.generate([{'SSID': 3}], bytes(base), jobs=1)
+    assert image is None and 'Site Type' in errors[0]
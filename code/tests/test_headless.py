@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import pytest
+import layout
+from APRStool import x1c3, parseSettings
+from conftest import sample
+
+TOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'APRStool.py')
+
+def test_parse_settings():
+    assert parseSettings(['SSID=3', 'Message=a=b']) == {'SSID': '3', 'Message': 'a=b'}
+    with pytest.raises(ValueError):
+        parseSettings(['SSID'])
+
+def test_headless_never_prompts(monkeypatch):
+    def prompt(*args):
+        raise AssertionError("prompted")
+    monkeypatch.setattr('builtins.input', prompt)
+    monkeypatch.setattr('os.system', prompt)
+    d = x1c3()
+    d.headless = True
+    d.raw = sample()
+    d.ExpandConfig()
+    assert d.printConfig()
+
+def test_set_from_the_command_line(tmp_path):
+    path = tmp_path / 'settings.sav'
+    path.write_bytes(sample())
+    run = lambda *argv: subprocess.run([sys.executable, TOOL, '-f', str(path), '--no_history'] + list(argv),
+                                       capture_output=True, text=True, stdin=subprocess.DEVNULL)
+    assert run('--set', 'SSID=3').returncode == 0
+    assert layout.configView(path.read_bytes())['SSID'] == 3
+    result = run('--set', 'SSID')
+    assert result.returncode == 2 and 'KEY=VALUE' in result.stderr
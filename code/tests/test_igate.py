@@ -0,0 +1,80 @@
+import asyncio
+import socket
+import igate
+import kiss
+
+CALL = 'N0CALL-10'
+
+def capture(tmp_path, frames):
+    path = tmp_path / 'capture.kiss'
+    path.write_bytes(b''.join(kiss.kissFrame(kiss.encodeAX25(*f)) for f in frames))
+    return kiss.fileStream(str(path))
+
+async def settle(condition, timeout=5.0):
+    # wait for something the other side does
+    for _ in range(int(timeout / 0.02)):
+        if condition(): return True
+        await asyncio.sleep(0.02)
+    return False
+
+def test_forwards_packets_to_stand_in(tmp_path):
+    frames = [('K7ABC-9', 'APRS', ['WIDE1-1'], '!4530.00N/12230.00W>moving'),
+              ('K7DEF', 'APRS', ['TCPIP*'], '>from the internet'),
+              ('K7GHI-1', 'APRS', [], '>status')]
+
+    async def main():
+        server = igate.standInServer()
+        port = await server.start()
+        gate = igate.igate('127.0.0.1', port, CALL)
+        await asyncio.wait_for(igate.runGate(gate, capture(tmp_path, frames), False, 0), 10)
+        assert await settle(lambda: len(server.lines) >= 2)
+        server.close()
+        return server, gate
+
+    server, gate = asyncio.run(main())
+    assert server.logins == ['user ' + CALL + ' pass ' + str(igate.passcode(CALL)) + ' vers ' + igate.VERSION]
+    assert server.lines == ['K7ABC-9>APRS,WIDE1-1,qAR,' + CALL + ':!4530.00N/12230.00W>moving',
+                            'K7GHI-1>APRS,qAR,' + CALL + ':>status']
+    assert (gate.stats.forwarded, gate.stats.skipped, gate.stats.dropped) == (2, 1, 0)
+
+def test_reconnects_after_the_server_hangs_up():
+    record = {'src': 'K7ABC', 'dest': 'APRS', 'path': [], 'payload': '>one'}
+
+    async def main():
+        server = igate.standInServer()
+        port = await server.start()
+        gate = igate.igate('127.0.0.1', port, CALL)
+        uplink = asyncio.ensure_future(gate.run())
+        await asyncio.wait_for(gate.connected.wait(), 5)
+        await gate.submit(record)
+        assert await settle(lambda: len(server.lines) == 1)
+        server.kick()
+        assert await settle(lambda: not gate.connected.is_set())
+        await gate.submit(dict(record, payload='>two'))
+        assert await settle(lambda: len(server.lines) == 2)
+        gate.running = False
+        uplink.cancel()
+        await asyncio.gather(uplink, return_exceptions=True)
+        server.close()
+        return server, gate
+
+    server, gate = asyncio.run(main())
+    assert len(server.logins) == 2
+    assert gate.stats.reconnects == 1
+    assert server.lines[1].endswith(':>two')
+
+def test_gives_up_when_the_server_never_answers(tmp_path):
+    # nothing listens on this port, so the queue can never be sent
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    async def main():
+        gate = igate.igate('127.0.0.1', port, CALL)
+        frames = [('K7ABC', 'APRS', [], '>lost')]
+        await asyncio.wait_for(igate.runGate(gate, capture(tmp_path, frames), False, 0, drainTimeout=0.3), 5)
+        return gate
+
+    gate = asyncio.run(main())
+    assert gate.stats.forwarded == 0 and gate.stats.dropped == 1
@@ -0,0 +1,63 @@
+import pytest
+import kiss
+
+def frames():
+    # two UI frames, the second with a C0 and a DB in its payload
+    first = kiss.encodeAX25('N0CALL-9', 'APRS', ['WIDE1-1*', 'WIDE2-1'], '!4807.03N/01131.00E>hello')
+    second = kiss.encodeAX25('K7SWI', 'APX1C3', [], 'ab') + b'\xc0c\xdb'
+    return [first, second]
+
+class chunks:
+    # a stream that hands out the given pieces, then ends
+    def __init__(self, pieces):
+        self.pieces = list(pieces)
+        self.eof = False
+
+    def readinto(self, buf):
+        if not self.pieces:
+            self.eof = True
+            return 0
+        piece = self.pieces.pop(0)
+        buf[:len(piece)] = piece
+        return len(piece)
+
+def test_frames_split_at_every_byte():
+    stream = b''.join(kiss.kissFrame(f) for f in frames())
+    for cut in range(len(stream) + 1):
+        decoder = kiss.kissDecoder()
+        got = decoder.feed(stream[:cut]) + decoder.feed(stream[cut:])
+        assert got == [b'\x00' + f for f in frames()], cut
+        assert decoder.stats.errors == 0
+
+def test_escapes_round_trip():
+    frame = frames()[1]
+    wrapped = kiss.kissFrame(frame)
+    assert wrapped.count(bytes([kiss.FEND])) == 2
+    assert kiss.ESC_FEND in wrapped and kiss.ESC_FESC in wrapped
+    assert kiss.kissDecoder().feed(wrapped) == [b'\x00' + frame]
+
+def test_invalid_escape_is_counted():
+    decoder = kiss.kissDecoder()
+    bad = bytes([kiss.FEND, 0, 0x41, kiss.FESC, 0x41, kiss.FEND])
+    assert decoder.feed(bad + kiss.kissFrame(frames()[0])) == [b'\x00' + frames()[0]]
+    assert decoder.stats.errors == 1
+
+def test_receive_marks_repeated_path_entries():
+    stats = kiss.rxStats()
+    records = list(kiss.receive(chunks([kiss.kissFrame(frames()[0])]), stats=stats))
+    assert records == [{'src': 'N0CALL-9', 'dest': 'APRS', 'path': ['WIDE1-1*', 'WIDE2-1'], 'payload': '!4807.03N/01131.00E>hello'}]
+    assert stats.frames == 1
+
+def test_receive_hex_mode_split_mid_digit():
+    text = kiss.kissFrame(frames()[0]).hex().upper().encode('ascii') + b'\r\n'
+    pieces = [text[k:k + 7] for k in range(0, len(text), 7)]
+    records = list(kiss.receive(chunks(pieces), hexMode=True))
+    assert [r['src'] for r in records] == ['N0CALL-9']
+
+def test_non_data_and_broken_frames():
+    stats = kiss.rxStats()
+    stream = (bytes([kiss.FEND, 0x06, 0x10, kiss.FEND])             # a KISS command, not data
+              + kiss.kissFrame(b'short')                             # too short for AX.25
+              + kiss.kissFrame(frames()[0]))
+    assert len(list(kiss.receive(chunks([stream]), stats=stats))) == 1
+    assert (stats.ignored, stats.errors, stats.frames) == (1, 1, 1)
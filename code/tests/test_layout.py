@@ -0,0 +1,70 @@
+import layout
+from conftest import sample
+
+def test_sample_decodes_and_encodes_byte_for_byte():
+    config = layout.CODEC.decode(sample())
+    assert config['CALLSIGN'] == 'K7SWI'
+    assert bytes(layout.CODEC.encode(config)) == sample()
+
+def test_full_encode_writes_the_table_constants():
+    # a full encode can't know what a unit had in the CONST bytes, patching can
+    image = bytearray(sample())
+    image[30] ^= 0xff
+    config = layout.CODEC.decode(bytes(image))
+    assert bytes(layout.CODEC.encode(config)) == sample()
+    layout.CODEC.encodeField(image, 'SSID', 4)
+    assert image[30] == sample()[30] ^ 0xff
+
+def test_config_view_decodes_lazily_and_writes_back():
+    buf = bytearray(b'\x00' * 3 + sample())       # the image at an offset, as in an archive record
+    view = layout.configView(memoryview(buf), base=3)
+    assert view.cache is None
+    assert view['CALLSIGN'] == 'K7SWI'
+    assert list(view.cache) == ['CALLSIGN']
+    view['CALLSIGN'] = 'N0CALL'
+    view['SSID'] = 7
+    assert view['CALLSIGN'] == 'N0CALL' and view['SSID'] == 7
+    decoded = layout.CODEC.decode(bytes(buf[3:]))
+    assert decoded['CALLSIGN'] == 'N0CALL' and decoded['SSID'] == 7
+    assert buf[:3] == b'\x00' * 3
+    assert len(view) == len(layout.CODEC.names) and dict(view) == decoded
+
+def test_config_view_over_bytes_is_read_only():
+    import pytest
+    for buf in (sample(), memoryview(sample()), memoryview(bytearray(sample())).toreadonly()):
+        view = layout.configView(buf)
+        with pytest.raises(TypeError):
+            view['SSID'] = 3
+        assert view['SSID'] == layout.CODEC.decode(sample())['SSID']
+    with pytest.raises(KeyError):
+        layout.configView(bytearray(sample()))['No Such Field'] = 1
+
+def test_firmware_strings_pick_their_model():
+    import pytest
+    cases = {'51X1C3_20180927A': 'X1C3', '51X1C5_20210101B': 'X1C5', 'UV98_868_220430_D4': 'HG-UV98'}
+    assert sorted(cases.values()) == sorted(m.name for m in layout.MODELS)
+    for version, name in cases.items():
+        assert layout.detect(version).name == name
+        assert layout.byName(name.lower()) is layout.detect(version)
+    assert layout.detect('') is layout.GENERIC and layout.detect('SOMETHING_ELSE') is layout.GENERIC
+    with pytest.raises(ValueError):
+        layout.byName('X9')
+
+def test_hidden_fields_keep_their_bytes():
+    from APRStool import x1c3
+    x1c3model = layout.byName('X1C3')
+    assert 'Brightness' in x1c3model.hidden and not x1c3model.supports('Brightness')
+    image = bytearray(sample())
+    start = layout.CODEC.info['Brightness'][0]
+    image[start] = (image[start] + 3) % 256
+    for expanded in (True, False):
+        d = x1c3()
+        d.model = x1c3model
+        d.raw = bytes(image)
+        d.ExpandConfig()
+        assert 'Brightness' not in d.fields()
+        if not expanded: d.image = None         # the full encode path
+        d.config['SSID'] = 4
+        d.compressConfig()
+        assert d.raw[start] == image[start]
+        assert layout.CODEC.decode(d.raw)['SSID'] == 4
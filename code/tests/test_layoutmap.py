@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import layout
+import layoutmap
+from conftest import sample
+
+def corpus():
+    # ten captures: SSID edited before every other one, byte 30 (CONST in the table) moving with it,
+    # and byte 200 changing on its own
+    start = layout.CODEC.info['SSID'][0]
+    images = np.tile(np.frombuffer(sample(), dtype=np.uint8), (10, 1))
+    edits = {}
+    for k in range(1, 10):
+        images[k] = images[k - 1]
+        if k % 2:
+            images[k, start] = (images[k - 1, start] + 1) % 16
+            images[k, 30] ^= 1
+            edits[k] = ['SSID']
+        if k % 3 == 0: images[k, 200] ^= 0xff
+    return images, edits, start
+
+def test_fields_constants_and_surprises():
+    images, edits, start = corpus()
+    runs = layoutmap.layoutMap(layoutmap.scan(images, edits))
+    kind = {offset: (run['kind'], run['field']) for run in runs for offset in range(run['start'], run['end'])}
+    assert kind[start] == ('field', 'SSID')
+    assert kind[30] == ('field', 'SSID')
+    assert kind[200] == ('unexplained', None)
+    assert kind[0] == ('constant', None)
+    assert [(r['start'], r['layout']) for r in layoutmap.surprises(runs)] == [(30, '')]
+
+def test_known_fields_without_edits():
+    images, edits, start = corpus()
+    runs = layoutmap.layoutMap(layoutmap.scan(images))
+    assert any(r['start'] <= 30 < r['end'] and r['field'] == 'SSID' for r in runs)
+
+def test_zero_threshold_with_nothing_to_correlate():
+    images, edits, start = corpus()
+    stats = layoutmap.scan(images, {})
+    kinds = layoutmap.classify(stats, threshold=0)
+    assert kinds[start] == ('unexplained', None) and kinds[0] == ('constant', None)
+
+def test_read_edits(tmp_path):
+    table = tmp_path / 'edits.csv'
+    table.write_text('file,field\nb.sav,SSID; CALLSIGN\nnot-captured.sav,SSID\n')
+    assert layoutmap.readEdits(str(table), ['x/a.sav', 'x/b.sav']) == {1: ['SSID', 'CALLSIGN']}
+    bad = tmp_path / 'edits.jsonl'
+    bad.write_text('[1, 2]\n')
+    with pytest.raises(ValueError):
+        layoutmap.readEdits(str(bad), ['a.sav'])
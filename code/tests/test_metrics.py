@@ -0,0 +1,55 @@
+import json
+import re
+import metrics
+
+SAMPLE = re.compile(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+def parse(text):
+    # a small exposition format parser: {family: (type, help, [(name, labels, value)])}
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            name, text = line[7:].split(' ', 1)
+            families[name] = [None, text, []]
+        elif line.startswith('# TYPE '):
+            name, kind = line[7:].split(' ')
+            assert name in families and families[name][0] is None, "TYPE without HELP, or twice: " + line
+            families[name][0] = kind
+            current = name
+        else:
+            match = SAMPLE.match(line)
+            assert match, "not a sample: " + line
+            name, labels, value = match.group(1), dict(LABEL.findall(match.group(3) or '')), float(match.group(4))
+            assert current and name.startswith(current), name + " outside its family " + str(current)
+            families[current][2].append((name, labels, value))
+    return families
+
+def test_json_and_prometheus_output():
+    registry = metrics.registry()
+    for seconds in (0.002, 0.02, 0.2, 20.0):
+        registry.observe('image_read_seconds', seconds, port='/dev/ttyUSB0')
+    registry.observe('image_read_seconds', 0.3, port='tcp://unit:8')
+    registry.inc('retries_total', port='a "quoted"\\ port')
+    registry.describe('retries_total', 'Commands sent again after a port error')
+    with registry.span('image_write', port='/dev/ttyUSB0') as span:
+        span.bytes = 512
+
+    data = json.loads(json.dumps(registry.toJSON()))
+    reads = [h for h in data['histograms'] if h['name'] == 'image_read_seconds' and h['labels'] == {'port': '/dev/ttyUSB0'}][0]
+    assert reads['count'] == 4 and abs(reads['sum'] - 20.222) < 1e-9 and sum(reads['buckets'].values()) == 4
+
+    families = parse(registry.toPrometheus())
+    assert families['aprstool_retries_total'][:2] == ['counter', 'Commands sent again after a port error']
+    [(name, labels, value)] = families['aprstool_retries_total'][2]
+    assert labels == {'port': 'a \\"quoted\\"\\\\ port'} and value == 1
+    assert families['aprstool_image_write_bytes_total'][0] == 'counter'
+    kind, text, samples = families['aprstool_image_read_seconds']
+    assert kind == 'histogram'
+    for port, count in (('/dev/ttyUSB0', 4), ('tcp://unit:8', 1)):
+        buckets = [(float(l['le']), v) for n, l, v in samples if n.endswith('_bucket') and l['port'] == port]
+        assert [b for b, v in buckets] == sorted(b for b, v in buckets) and buckets[-1][0] == float('inf')
+        assert all(a[1] <= b[1] for a, b in zip(buckets, buckets[1:]))
+        total = {n[len('aprstool_image_read_seconds'):]: v for n, l, v in samples if l.get('port') == port and 'le' not in l}
+        assert buckets[-1][1] == total['_count'] == count and set(total) == {'_sum', '_count'}
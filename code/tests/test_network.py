@@ -0,0 +1,43 @@
+import threading
+import pytest
+import simulator
+from APRStool import x1c3, socketPort, POOL
+from conftest import sample
+
+@pytest.mark.parametrize('kind', ['tcp', 'udp'])
+def test_read_and_write_over_the_network(kind):
+    with simulator.simulator() as sim:
+        unit = sim.addNetwork(sample(), kind, ack=True)
+        d = x1c3()
+        d.setPort(unit.port)
+        d.quietFlag = True
+        d.history = None
+        assert d.readSerialVersion() and d.version == unit.version
+        assert d.readIPDevice() and d.raw == sample()
+        image = bytearray(sample())
+        image[20] = 9
+        d.raw = bytes(image)
+        assert d.writeIPDevice()
+        assert d.readIPDevice() and d.raw == bytes(image)
+    POOL.closeAll()
+
+def test_serial_port_is_not_a_network_port():
+    d = x1c3()
+    d.setPort('/dev/ttyUSB9')
+    d.quietFlag = True
+    assert not d.readIPDevice()
+
+def test_reset_input_buffer_with_a_chatty_peer():
+    # a peer that never stops sending mustn't keep reset_input_buffer from returning
+    port = socketPort.__new__(socketPort)
+    port.buffer = bytearray()
+    port.fill = lambda wait: port.buffer.extend(b'x' * 100)
+    done = threading.Event()
+
+    def reset():
+        port.reset_input_buffer()
+        done.set()
+
+    threading.Thread(target=reset, daemon=True).start()
+    assert done.wait(2)
+    assert not port.buffer
@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+import pytest
+import simulator
+from APRStool import x1c3, readFrame, frameError, POOL
+from conftest import sample
+
+class countingPort:
+    # hands out data a few bytes at a time and counts timeout changes
+    def __init__(self, data, step=8):
+        self.data = bytearray(data)
+        self.step = step
+        self.changes = 0
+        self._timeout = None
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.changes += 1
+        self._timeout = value
+
+    @property
+    def in_waiting(self):
+        return min(self.step, len(self.data))
+
+    def read(self, size=1):
+        chunk = bytes(self.data[:size])
+        del self.data[:size]
+        return chunk
+
+def test_read_frame_sets_timeout_once_per_phase():
+    port = countingPort(b'junk' + sample())
+    assert readFrame(port) == sample()
+    assert port.changes == 2
+
+def test_version_from_simulator():
+    with simulator.simulator() as sim:
+        unit = sim.add(sample())
+        d = x1c3()
+        d.setPort(unit.port)
+        d.quietFlag = True
+        assert d.readSerialVersion()
+        assert d.version == '51X1C3_20180927A' and d.voltage == '4.12V'
+        d.history = None
+        assert d.readSerialDevice() and d.raw == sample()
+    POOL.closeAll()
+
+def test_version_from_other_device():
+    # a GPS on the port answers with NMEA, not a version line
+    master, slave = os.openpty()
+    def gps():
+        os.read(master, 64)
+        os.write(master, b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n')
+    talker = threading.Thread(target=gps)
+    talker.start()
+    try:
+        import tty
+        tty.setraw(slave)
+        d = x1c3()
+        d.setPort(os.ttyname(slave))
+        d.quietFlag = True
+        assert not d.readSerialVersion()
+        assert d.lastError.startswith('Not an X1C3')
+    finally:
+        talker.join()
+        POOL.closeAll()
+        os.close(master)
+        os.close(slave)
+
+class chattyPort:
+    # a GPS that never stops sending NMEA, and never sends a frame header
+    def __init__(self, delay=0.0, baudrate=9600):
+        self.delay = delay
+        self.baudrate = baudrate
+        self.timeout = None
+        self.sent = 0
+
+    @property
+    def in_waiting(self):
+        return 64
+
+    def read(self, size=1):
+        if self.delay: time.sleep(self.delay)
+        line = b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n'
+        chunk = (line * (size // len(line) + 1))[:size]
+        self.sent += len(chunk)
+        return chunk
+
+def test_read_frame_gives_up_on_endless_garbage():
+    port = chattyPort()
+    with pytest.raises(frameError, match='No frame header'):
+        readFrame(port)
+    assert port.sent <= 3 * len(sample())
+
+def test_read_frame_gives_up_when_overdue():
+    # too slow to hit the discard limit, so the deadline has to catch it
+    port = chattyPort(delay=0.01, baudrate=115200)
+    start = time.monotonic()
+    with pytest.raises(frameError):
+        readFrame(port, firstTimeout=0.1, discardLimit=10**9)
+    assert time.monotonic() - start < 1.0
@@ -0,0 +1,17 @@
+import simulator
+from conftest import sample
+
+def test_partial_writes_keep_the_rest():
+    # a port that only takes a few bytes at a time still gets the whole frame, in order
+    device = simulator.simDevice(sample(), pty=False)
+    sent = bytearray()
+    def output(data):
+        sent.extend(data[:7])
+        return min(7, len(data))
+    device.output = output
+    device.feed(b'AT+SET=READ\r\n', 0.0)
+    now = 0.0
+    while device.outbox:
+        now += 0.01
+        device.flush(now)
+    assert bytes(sent) == sample()
@@ -0,0 +1,46 @@
+import threading
+import layout
+import snapshots
+from conftest import sample
+
+def test_concurrent_writers_record_every_snapshot(tmp_path):
+    # threads recording the same images on different units at once, as fleet.py and daemon.py do
+    store = snapshots.snapshotStore(str(tmp_path / 'snapshots.db'))
+    store.connect().close()
+    images = []
+    for ssid in range(10):
+        image = bytearray(sample())
+        layout.CODEC.encodeField(image, 'SSID', ssid)
+        images.append(bytes(image))
+    start = threading.Barrier(16)
+    results = []
+
+    def record(k):
+        start.wait()
+        for image in images:
+            results.append(store.add(image, '/dev/ttyUSB' + str(k), 'read'))
+
+    threads = [threading.Thread(target=record, args=(k,)) for k in range(16)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert None not in results
+    count, stored, size, whole, raw = store.stats()
+    assert (count, stored) == (160, 10)
+
+def test_delta_round_trip(tmp_path):
+    store = snapshots.snapshotStore(str(tmp_path / 'snapshots.db'))
+    image = bytearray(sample())
+    store.add(image, 'unit', 'read')
+    layout.CODEC.encodeField(image, 'SSID', 7)
+    digest = store.add(image, 'unit', 'write')
+    assert store.image(digest) == bytes(image)
+    fields, other = snapshots.diff(store.image(store.previous(store.resolve(digest))[4]), store.image(digest))
+    assert [f[0] for f in fields] == ['SSID']
+
+def test_errors_go_to_stderr(tmp_path, capsys):
+    # stdout may be carrying --json-out -
+    (tmp_path / 'file').write_bytes(b'')
+    store = snapshots.snapshotStore(str(tmp_path / 'file' / 'snapshots.db'))
+    assert store.add(sample(), 'unit', 'read') is None
+    out, err = capsys.readouterr()
+    assert out == '' and "Couldn't record snapshot" in err
@@ -0,0 +1,48 @@
+import sqlite3
+import layout
+import store
+from conftest import sample
+
+def image(callsign, frequency):
+    config = layout.CODEC.decode(sample())
+    config.update({'CALLSIGN': callsign, 'Frequency 1': frequency})
+    return layout.CODEC.encode(config)
+
+def test_ingest_then_query(tmp_path):
+    for name, call, freq in (('a', 'K7ABC', '144.3900'), ('b', 'K7DEF', '144.6400'), ('c', 'K7GHI', '')):
+        (tmp_path / (name + '.sav')).write_bytes(image(call, freq))
+    (tmp_path / 'short.sav').write_bytes(b'HELLO')
+    db = store.connect(str(tmp_path / 'images.db'))
+    assert store.ingestFiles(db, [str(tmp_path)]) == (3, 1)
+    # the frequency compares as a number, however it is written
+    for written in ('144.390', '144.39', '144.3900 '):
+        assert [r[2] for r in store.query(db, ['frequency_1=' + written])] == ['K7ABC']
+    assert [r[2] for r in store.query(db, ['callsign=K7DEF'])] == ['K7DEF']
+    # padding is gone from the text columns
+    assert db.execute("SELECT digi_1 FROM images WHERE callsign = 'K7ABC'").fetchone()[0] == 'WIDE1'
+    assert [r[2] for r in store.query(db, [], where='frequency_1 BETWEEN 144.0 AND 144.5')] == ['K7ABC']
+    assert db.execute("SELECT frequency_1 FROM images WHERE callsign = 'K7GHI'").fetchone()[0] is None
+    db.close()
+
+def test_bad_filter_values(tmp_path):
+    db = store.connect(str(tmp_path / 'images.db'))
+    import pytest
+    for bad in ('frequency_1=fast', 'ssid=one', 'nonsense=1'):
+        with pytest.raises(ValueError):
+            store.query(db, [bad])
+    db.close()
+
+def test_old_text_schema_is_rebuilt(tmp_path):
+    path = str(tmp_path / 'images.db')
+    old = sqlite3.connect(path)
+    fields = [store.column(n) + (' TEXT' if layout.CODEC.info[n][2] == layout.STR else ' INTEGER') for n in layout.CODEC.names]
+    old.execute('CREATE TABLE images (id INTEGER PRIMARY KEY, source TEXT UNIQUE, firmware TEXT, added REAL, raw BLOB, '
+                + ', '.join(fields) + ')')
+    config = layout.CODEC.decode(sample())
+    old.execute('INSERT INTO images (source, firmware, added, raw, ' + ', '.join(store.COLUMNS) + ') VALUES ('
+                + ', '.join('?' * (len(store.COLUMNS) + 4)) + ')', ['old.sav', '', 1.0, sample()] + [config[n] for n in layout.CODEC.names])
+    old.commit()
+    old.close()
+    db = store.connect(path)
+    assert [r[0] for r in store.query(db, ['frequency_1=144.64'])] == ['old.sav']
+    db.close()
@@ -0,0 +1,43 @@
+import pytest
+import layout
+import validate
+from conftest import sample
+
+@pytest.mark.parametrize('field, value', [
+    ('Latitude', ''), ('Longitude', ''), ('Frequency 1', ''),
+    ('Latitude', '4807.03N'), ('Frequency 1', '144.3900'),
+    ('PATH 1', 'WIDE1-1'), ('DIGI 1', 'WIDE2'), ('DIGI 2', ''),
+    ('CALLSIGN', 'N0CALLX'), ('Module Volume', 0), ('Module Volume', 9),
+])
+def test_accepted_even_when_strict(field, value):
+    assert validate.checkConfig({field: value}, strict=True) == []
+    assert validate.warnConfig({field: value}) == []
+
+@pytest.mark.parametrize('field, value', [
+    ('Latitude', '4807.03X'), ('Frequency 1', '999.0000'), ('PATH 1', 'wide1-1'),
+    ('CALLSIGN', 'n0call'), ('Module Volume', 10), ('Module Mic', 0),
+])
+def test_rules_only_warn_unless_strict(field, value):
+    assert validate.checkConfig({field: value}) == []
+    assert [name for offset, name, message in validate.warnConfig({field: value})] == [field]
+    assert [name for offset, name, message in validate.checkConfig({field: value}, strict=True)] == [field]
+
+@pytest.mark.parametrize('field, value', [
+    ('CALLSIGN', 'N0CALLXX'), ('Module Volume', 256), ('Module Volume', 'loud'),
+    ('Site Type', 9), ('No Such Field', 1),
+])
+def test_layout_problems_are_errors(field, value):
+    assert [name for offset, name, message in validate.checkConfig({field: value})] == [field]
+
+def test_image_from_a_unit_passes():
+    assert validate.checkImage(sample()) == []
+
+def test_rule_breaking_image_warns_but_layout_breaking_one_fails():
+    image = bytearray(sample())
+    start, width = layout.CODEC.info['PATH 1'][:2]
+    image[start:start + width] = b'wide1\xff\xff'
+    assert validate.checkImage(bytes(image)) == []
+    assert [name for offset, name, message in validate.warnImage(bytes(image))] == ['PATH 1']
+    assert [name for offset, name, message in validate.checkImage(bytes(image), strict=True)] == ['PATH 1']
+    image[:5] = b'HOWDY'
+    assert [name for offset, name, message in validate.checkImage(bytes(image))] == ['Header']
@@ -0,0 +1,129 @@
+import time
+import pytest
+import layout
+import simulator
+from APRStool import x1c3, POOL
+from conftest import sample
+
+@pytest.fixture
+def sim():
+    with simulator.simulator() as s:
+        yield s
+    POOL.closeAll()
+
+def device(port):
+    d = x1c3()
+    d.setPort(port)
+    d.quietFlag = True
+    d.history = None
+    d.raw = sample()
+    return d
+
+def test_ack_is_per_port(sim):
+    # a device that acks writes doesn't make silence from the next one count as a lost write
+    acking = sim.add(sample(), ack=True)
+    silent = sim.add(sample())
+    d = device(acking.port)
+    assert d.writeSerialDevice()
+    d.setPort(silent.port)
+    assert d.writeSerialDevice()
+    time.sleep(0.1)
+    assert (acking.writes, silent.writes) == (1, 1)
+
+def test_stalled_port_sends_nothing_twice():
+    # nobody reads the other end, so the tty fills up and a write times out part way through a chunk
+    import os
+    from APRStool import writePaced, writeError, WRITE_TIMEOUT, serialSession
+    master, slave = os.openpty()
+    try:
+        import tty
+        tty.setraw(slave)
+        session = serialSession(os.ttyname(slave))
+        ser = session.open()
+        assert ser.write_timeout == WRITE_TIMEOUT
+        ser.write_timeout = 0.05
+        data = bytes(range(251)) * 800
+        with pytest.raises(writeError, match='timed out'):
+            writePaced(ser, data, chunk=4096, retries=2, backoff=0.01)
+        received = bytearray()
+        while True:
+            import select
+            if not select.select([master], [], [], 0.05)[0]: break
+            received += os.read(master, 65536)
+        # what got through is the start of the data, with no chunk sent twice
+        assert received and received == data[:len(received)]
+        session.close()
+    finally:
+        os.close(master)
+        os.close(slave)
+
+class stallingPort:
+    # a port and an X1C3 behind it that stops reading for a moment part way through the first write
+    # like pyserial, the write that times out has already handed some of the chunk to the device
+    def __init__(self, *args, **kwargs):
+        self.is_open = True
+        self.timeout = kwargs.get('timeout')
+        self.write_timeout = kwargs.get('write_timeout')
+        self.received = bytearray()     # the frame the device is putting together
+        self.frames = []                # the frames it took whole
+        self.last = time.monotonic()
+        self.stalled = False
+
+    def write(self, data):
+        import serial
+        data = bytes(data)
+        now = time.monotonic()
+        if self.received and now - self.last > stallingPort.FRAME_TIMEOUT: self.received.clear()
+        self.last = now
+        if data.startswith(b'AT+SET=WRITE'):
+            self.received.clear()
+            return len(data)
+        if len(self.received) >= 200 and not self.stalled:
+            self.stalled = True
+            self.received += data[:len(data) // 2]
+            raise serial.SerialTimeoutException('Write timeout')
+        self.received += data
+        if len(self.received) >= layout.IMAGE_SIZE - 5:
+            self.frames.append(bytes(self.received))
+            self.received.clear()
+        return len(data)
+
+    def flush(self): pass
+    def reset_input_buffer(self): pass
+    def reset_output_buffer(self): pass
+    def read(self, size=1): return b''
+    in_waiting = 0
+    def close(self): self.is_open = False
+
+def test_timed_out_write_resends_the_whole_frame(monkeypatch):
+    import APRStool
+    stallingPort.FRAME_TIMEOUT = 0.05
+    ports = []
+    monkeypatch.setattr(APRStool.serial, 'Serial', lambda *a, **k: ports.append(stallingPort(*a, **k)) or ports[-1])
+    image = bytearray(sample())
+    image[20] = 9
+    d = device('/dev/stalling')
+    d.raw = bytes(image)
+    d.writeChunk, d.writeGap, d.writeBackoff = 64, 0.0, 0.1
+    POOL.get(d.port).baud = 115200     # chunks go out well inside the device's frame timeout
+    try:
+        assert d.writeSerialDevice()
+    finally:
+        POOL.closeAll()
+    assert ports[0].stalled
+    assert ports[0].frames == [bytes(image[5:])]
+
+def test_fifo_overrun_needs_pacing(sim):
+    # a 100 byte receive buffer loses most of an unpaced write, small paced chunks get through
+    unit = sim.add(sample(), pace=True, fifo=100, ack=True)
+    image = bytearray(sample())
+    image[20] = 9
+    d = device(unit.port)
+    d.raw = bytes(image)
+    d.writeChunk, d.writeGap, d.writeRetries = 512, 0.0, 0
+    d.writeSerialDevice()
+    time.sleep(0.6)
+    assert unit.overruns > 0 and unit.writes == 0
+    d.writeChunk = 32
+    assert d.writeSerialDevice()
+    assert unit.writes == 1 and unit.image[20] == 9
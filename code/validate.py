@@ -0,0 +1,278 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import layout
+
+##########
+#
+# Image and config validation
+#
+# A validator is compiled once per model from the layout table: the header,
+# text that decodes and fits, enum sizes and number widths come from the
+# fields themselves, and those are errors. The rules below add value ranges
+# and text syntax (callsigns, paths, frequencies, positions...); they are
+# what the firmware is thought to accept, not what the layout says, so they
+# are warnings unless strict is asked for. It checks a whole image, or a
+# dictionary of edits, in one pass and returns every problem as (offset,
+# field, message), so a bad image is caught before a slow write to the
+# device rather than after it.
+#
+#   python validate.py out/*.sav
+#   python validate.py -a club.arc -j 4 --strict
+#
+##########
+
+# field -> (pattern the whole text should match, what it should look like); empty text is always fine
+SYNTAX = {
+    'CALLSIGN':          (r'[A-Z0-9]{1,7}', "1 to 7 upper case letters and digits"),
+    'Type':              (r'[!=/@]', "one of ! = / @"),
+    'Icon 1':            (r'[/\\0-9A-Z][!-~]', "a symbol table (/, \\ or an overlay) and a symbol"),
+    'Icon 2':            (r'[/\\0-9A-Z][!-~]', "a symbol table (/, \\ or an overlay) and a symbol"),
+    'Latitude':          (r'\d{4}\.\d{2}[NS]', "DDMM.mmN or DDMM.mmS"),
+    'Longitude':         (r'\d{5}\.\d{2}[EW]', "DDDMM.mmE or DDDMM.mmW"),
+    'Message':           (r'[ -~]*', "printable ASCII"),
+    'Emergency Message': (r'[ -~]*', "printable ASCII"),
+    'Frequency 1':       (r'\d{3}\.\d{4}', "MHz as NNN.NNNN"),
+    'Frequency 2':       (r'\d{3}\.\d{4}', "MHz as NNN.NNNN"),
+    'IP Address':        (r'[A-Za-z0-9.\-]*', "an IP address or host name"),
+    'Remote Code':       (r'[!-~]*', "printable ASCII without spaces"),
+    'PATH 1':            (r'[A-Z0-9]{1,6}(-\d{1,2})? *', "a path alias such as WIDE1 or WIDE1-1"),
+    'PATH 2':            (r'[A-Z0-9]{1,6}(-\d{1,2})? *', "a path alias such as WIDE2 or WIDE2-1"),
+    'DIGI 1':            (r'[A-Z0-9]{1,6}(-\d{1,2})? *', "a path alias such as WIDE1 or WIDE1-1"),
+    'DIGI 2':            (r'[A-Z0-9]{1,6}(-\d{1,2})? *', "a path alias such as WIDE2 or WIDE2-1"),
+}
+
+# field -> (lowest, highest) for numbers the firmware limits more than the field width does
+RANGES = {
+    'Time Value':        (0, 9999),
+    'Icon 2 Time':       (0, 999),
+    'Altitude':          (0, 9999),
+    'Module Volume':     (0, 9),
+    'Module Mic':        (1, 8),
+    'PATH 1 Hops':       (0, 7),
+    'PATH 2 Hops':       (0, 7),
+}
+
+# the bands the RF module tunes, MHz
+BANDS = ((134.0, 174.0), (400.0, 480.0))
+
+def inBand(text):
+    return any(low <= float(text) <= high for low, high in BANDS)
+
+def position(text, degrees):
+    # the degrees and minutes of a Latitude/Longitude in range
+    return int(text[:degrees]) <= (90 if degrees == 2 else 180) and float(text[degrees:-1]) < 60
+
+# more checks, run when the text isn't empty and matched its pattern
+EXTRA = {
+    'Frequency 1': (inBand, "outside the " + ', '.join(str(l) + '-' + str(h) for l, h in BANDS) + " MHz bands"),
+    'Frequency 2': (inBand, "outside the " + ', '.join(str(l) + '-' + str(h) for l, h in BANDS) + " MHz bands"),
+    'Latitude':    (lambda t: position(t, 2), "degrees or minutes out of range"),
+    'Longitude':   (lambda t: position(t, 3), "degrees or minutes out of range"),
+}
+
+
+class validator:
+    # the checks for one codec, compiled once
+    def __init__(self, codec):
+        self.codec = codec
+        self.checks = []        # (struct index, name, offset, check, rule) for every field, in image order
+        self.byName = {}        # name -> (offset, check, rule)
+        index = 0
+        for name, start, width, kind, pad, options in codec.fields:
+            if kind == layout.CONST:
+                if name == 'Header': self.header = (index, start, pad)
+                index += 1
+                continue
+            check, rule = self.compile(name, width, kind, pad, options)
+            self.checks.append((index, name, start, check, rule))
+            self.byName[name] = (start, check, rule)
+            index += 1
+
+    def compile(self, name, width, kind, pad, options):
+        # (check, rule): functions that return an error message for a bad value, or None
+        # check is what the layout table says, rule the SYNTAX/RANGES/EXTRA rules for the field (None if it has none)
+        if kind == layout.STR:
+            def text(value):
+                return layout.decodeStr(value, pad) if isinstance(value, bytes) else str(value)
+            def check(value):
+                try: value = text(value)
+                except UnicodeDecodeError: return "not valid text"
+                if len(value.encode('utf-8')) > width: return "longer than " + str(width) + " bytes"
+                return None
+            pattern, describe = SYNTAX.get(name, (None, None))
+            match = re.compile(pattern).fullmatch if pattern else None
+            extra, complaint = EXTRA.get(name, (None, None))
+            if match is None and extra is None: return check, None
+            def rule(value):
+                try: value = text(value)
+                except UnicodeDecodeError: return None     # check has already said so
+                if not value: return None
+                if match is not None and not match(value): return repr(value) + " should be " + describe
+                if extra is not None and not extra(value): return repr(value) + " is " + complaint
+                return None
+            return check, rule
+
+        def between(low, high, describe):
+            def check(value):
+                try: value = int(value)
+                except (TypeError, ValueError): return repr(value) + " is not a number"
+                if not low <= value <= high: return str(value) + " should be " + describe
+                return None
+            return check
+        if options:
+            high = len(options) - 1
+            return between(0, high, "one of 0-" + str(high) + " (" + ', '.join(options) + ")"), None
+        high = 255 if kind == layout.U8 else 65535
+        check = between(0, high, "between 0 and " + str(high))
+        if name not in RANGES: return check, None
+        low, high = RANGES[name]
+        return check, between(low, high, "between " + str(low) + " and " + str(high))
+
+    def image(self, raw, hidden=(), checks=True, rules=False):
+        # every problem in a whole image, as (offset, field, message)
+        # checks: the layout's own checks, rules: the SYNTAX/RANGES/EXTRA rules
+        if len(raw) != self.codec.size:
+            return [(0, '', "image is " + str(len(raw)) + " bytes, not " + str(self.codec.size))] if checks else []
+        values = self.codec.struct.unpack_from(raw)
+        errors = []
+        index, start, header = self.header
+        if checks and values[index] != header: errors.append((start, 'Header', "doesn't start with " + repr(header)))
+        for index, name, start, check, rule in self.checks:
+            if name in hidden: continue
+            message = check(values[index]) if checks else None
+            if message is None and rules and rule is not None: message = rule(values[index])
+            if message: errors.append((start, name, message))
+        return errors
+
+    def config(self, config, checks=True, rules=False):
+        # every problem in a dictionary of field values (a whole config or just some edits)
+        errors = []
+        for name, value in config.items():
+            if name not in self.byName:
+                if checks: errors.append((-1, name, "no such field"))
+                continue
+            start, check, rule = self.byName[name]
+            message = check(value) if checks else None
+            if message is None and rules and rule is not None: message = rule(value)
+            if message: errors.append((start, name, message))
+        return sorted(errors)
+
+    def field(self, name, value, strict=False):
+        # the problem with one value, or None
+        start, check, rule = self.byName[name]
+        return check(value) or (rule(value) if strict and rule is not None else None)
+
+
+VALIDATORS = {}         # id(codec) -> validator
+
+def forCodec(codec):
+    if id(codec) not in VALIDATORS: VALIDATORS[id(codec)] = validator(codec)
+    return VALIDATORS[id(codec)]
+
+def checkImage(raw, model=layout.GENERIC, strict=False):
+    # what stops the image being written: the layout's checks, and the rules as well if strict
+    return forCodec(model.codec).image(raw, model.hidden, rules=strict)
+
+def checkConfig(config, model=layout.GENERIC, strict=False):
+    errors = forCodec(model.codec).config({k: v for k, v in config.items() if k not in model.hidden}, rules=strict)
+    hidden = [(model.codec.info[k][0], k, "not on " + model.name) for k in config if k in model.hidden]
+    return sorted(errors + hidden)
+
+def warnImage(raw, model=layout.GENERIC):
+    # the rules the image breaks, for values the layout itself is happy with
+    return forCodec(model.codec).image(raw, model.hidden, checks=False, rules=True)
+
+def warnConfig(config, model=layout.GENERIC):
+    return forCodec(model.codec).config({k: v for k, v in config.items() if k not in model.hidden}, checks=False, rules=True)
+
+def describe(errors):
+    return ["@" + str(offset) + " " + name + ": " + message if offset >= 0 else name + ": " + message
+            for offset, name, message in errors]
+
+
+########## Batch validation
+def checkRaw(raw, model, strict):
+    # (errors, warnings) for one image
+    errors = checkImage(raw, model, strict)
+    return errors, [] if strict else warnImage(raw, model)
+
+def checkFiles(names, modelName='generic', strict=False):
+    # runs in the workers: (name, errors, warnings) for every file that has problems
+    model = layout.byName(modelName)
+    bad = []
+    for name in names:
+        try:
+            with open(name, 'rb') as f:
+                errors, warnings = checkRaw(f.read(), model, strict)
+        except OSError as e:
+            errors, warnings = [(-1, '', str(e))], []
+        if errors or warnings: bad.append((name, errors, warnings))
+    return len(names), bad
+
+def checkArchive(path, first, count, modelName='generic', strict=False):
+    import archive
+    model = layout.byName(modelName)
+    bad = []
+    with archive.archive(path) as arc:
+        for k in range(first, min(first + count, len(arc))):
+            errors, warnings = checkRaw(arc.image(k), model, strict)
+            if errors or warnings: bad.append((path + '#' + str(k), errors, warnings))
+    return min(count, max(0, len(arc) - first)), bad
+
+def checkMany(names=(), archivePath=None, modelName='generic', jobs=None, batch=500, strict=False):
+    # validate files and/or an archive on a process pool, yields (checked count, [(name, errors, warnings)])
+    jobs = jobs or os.cpu_count() or 1
+    tasks = [(checkFiles, names[i:i + batch], modelName, strict) for i in range(0, len(names), batch)]
+    if archivePath:
+        import archive
+        with archive.archive(archivePath) as arc: total = len(arc)
+        tasks += [(checkArchive, archivePath, i, batch, modelName, strict) for i in range(0, total, batch)]
+    if jobs <= 1:
+        for task in tasks: yield task[0](*task[1:])
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for future in [pool.submit(task[0], *task[1:]) for task in tasks]:
+            yield future.result()
+
+def main():
+    parser = argparse.ArgumentParser(description='Check config images before they go near a device')
+    parser.add_argument("files", nargs='*', help = "Image files or globs")
+    parser.add_argument("-a", "--archive", help = "Check every record of an archive as well")
+    parser.add_argument("--model", default='generic', help = "Check against this model's fields")
+    parser.add_argument("-j", "--jobs", type=int, help = "Worker processes (default: one per CPU)")
+    parser.add_argument("-q", "--quiet", action='store_true', help = "Only list the bad files")
+    parser.add_argument("--strict", action='store_true', help = "Count breaking the syntax and range rules as an error, not a warning")
+    args = parser.parse_args()
+
+    names = []
+    for pattern in args.files:
+        names += sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+    if not names and not args.archive: parser.error("nothing to check")
+    try:
+        layout.byName(args.model)
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+
+    start = time.perf_counter()
+    checked = failed = warned = 0
+    for count, bad in checkMany(names, args.archive, args.model, args.jobs, strict=args.strict):
+        checked += count
+        for name, errors, warnings in bad:
+            if errors: failed += 1
+            else: warned += 1
+            if errors or not args.quiet: print(name)
+            if not args.quiet:
+                for line in describe(errors): print("   ", line)
+                for line in describe(warnings): print("    warning:", line)
+    print(checked, "image(s) checked,", failed, "with problems,", warned, "with warnings only, in", format(time.perf_counter() - start, '.2f') + "s", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()